@@ -0,0 +1,169 @@
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import duckdb
+import psycopg2
+import typer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from chartmetric_challenge.profiling import process_peak_rss_mb
+from chartmetric_challenge.youtube_playlist_pg import YoutubePlaylistPgIngestor
+from synthetic_youtube_playlists import generate_records, write_json
+
+
+POSTGRES_INIT_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'postgres_init')
+
+
+def reset_database(pg_connection_string: str):
+    '''
+    Recreates the tables in an empty public schema so every case loads into
+    the same state.
+    '''
+    connection = psycopg2.connect(pg_connection_string)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('DROP SCHEMA public CASCADE')
+            cursor.execute('CREATE SCHEMA public')
+            for filename in sorted(os.listdir(POSTGRES_INIT_DIRECTORY)):
+                with open(os.path.join(POSTGRES_INIT_DIRECTORY, filename)) as f:
+                    cursor.execute(f.read())
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def run_case(source_path: str, pg_connection_string: str | None, load_mode: str, json_format: str, intermediate_format: str) -> dict:
+    '''
+    Runs one ingest of source_path and returns the seconds spent in and
+    the process' peak RSS after each of load, convert and csvs_to_pg, plus
+    the ingestor's profile of every stage within them. Meant to run in a
+    fresh process so the peak RSS is this case's alone.
+    '''
+    seconds = {}
+    peak_rss = {}
+    with tempfile.TemporaryDirectory() as output_directory:
+        ingestor = YoutubePlaylistPgIngestor(
+            'day',
+            source_path,
+            output_directory,
+            pg_connection_string,
+            load_mode=load_mode,
+            json_format=json_format,
+            intermediate_format=intermediate_format,
+            profile=True,
+        )
+
+        start = time.perf_counter()
+        df = ingestor.load()
+        seconds['load'] = time.perf_counter() - start
+        peak_rss['load'] = process_peak_rss_mb()
+
+        start = time.perf_counter()
+        ingestor.convert(df)
+        seconds['convert'] = time.perf_counter() - start
+        peak_rss['convert'] = process_peak_rss_mb()
+
+        if pg_connection_string is not None:
+            reset_database(pg_connection_string)
+            start = time.perf_counter()
+            ingestor.csvs_to_pg()
+            seconds['csvs_to_pg'] = time.perf_counter() - start
+            peak_rss['csvs_to_pg'] = process_peak_rss_mb()
+
+        output_bytes = sum(os.path.getsize(os.path.join(output_directory, f)) for f in os.listdir(output_directory))
+        profile = ingestor.profile_report()
+        ingestor.close()
+    return {'seconds': seconds, 'peak_rss_mb': peak_rss, 'output_bytes': output_bytes, 'stages': profile['stages']}
+
+
+def main(
+    days: str = "7,30",
+    num_playlists: int = 10,
+    videos_per_playlist: int = 50,
+    scrapes_per_day: int = 2,
+    churn: float = 0.1,
+    artist_null_fraction: float = 0.45,
+    load_modes: str = "pandas,stream,duckdb",
+    json_format: str = "array",
+    intermediate_format: str = "csv",
+    pg_connection_string: str = None,
+    output_path: str = None,
+    log_level: str = "WARNING",
+):
+    '''
+    Times the ingest pipeline on synthetic data (see
+    synthetic_youtube_playlists.py) for every combination of days and
+    load_modes: load, convert and, if pg_connection_string is given,
+    csvs_to_pg, with the ingestor's profile of each step within them (eg
+    every log table). Every case runs in its own process so its peak RSS
+    can be recorded.
+
+    pg_connection_string must point to a scratch database, its public schema
+    is dropped and recreated before every load.
+
+    Writes the results as JSON to output_path (stdout by default) so runs
+    can be compared to catch regressions.
+    '''
+    logging.basicConfig(level=log_level)
+
+    cases = []
+    with tempfile.TemporaryDirectory() as source_directory:
+        for num_days in [int(d) for d in days.split(',')]:
+            source_path = os.path.join(source_directory, f'youtube_playlist_{num_days}.json')
+            records = write_json(
+                generate_records(num_playlists, videos_per_playlist, num_days, scrapes_per_day, churn, artist_null_fraction),
+                source_path,
+                json_format,
+            )
+            for load_mode in load_modes.split(','):
+                # spawn so the child's peak RSS doesn't start from ours
+                with multiprocessing.get_context('spawn').Pool(1) as pool:
+                    result = pool.apply(run_case, (source_path, pg_connection_string, load_mode, json_format, intermediate_format))
+                cases.append({
+                    'days': num_days,
+                    'load_mode': load_mode,
+                    'records': records,
+                    'source_bytes': os.path.getsize(source_path),
+                    **result,
+                    'records_per_second': records / sum(result['seconds'].values()),
+                })
+                print(
+                    f"days={num_days} load_mode={load_mode} records={records} "
+                    f"convert={result['seconds']['convert']:.3f}s peak_rss={max(result['peak_rss_mb'].values()):.0f}MB",
+                    file=sys.stderr,
+                )
+
+    results = {
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'duckdb': duckdb.__version__,
+        'parameters': {
+            'num_playlists': num_playlists,
+            'videos_per_playlist': videos_per_playlist,
+            'scrapes_per_day': scrapes_per_day,
+            'churn': churn,
+            'artist_null_fraction': artist_null_fraction,
+            'json_format': json_format,
+            'intermediate_format': intermediate_format,
+            'postgres': pg_connection_string is not None,
+        },
+        'cases': cases,
+    }
+    if output_path is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with open(output_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    typer.run(main)
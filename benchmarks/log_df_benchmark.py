@@ -0,0 +1,40 @@
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+import typer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from chartmetric_challenge.youtube_playlist_pg import YoutubePlaylistPgIngestor
+from synthetic_youtube_playlists import generate_records
+
+
+def main(
+    days: str = "7,30,90,180",
+    num_playlists: int = 10,
+    videos_per_playlist: int = 50,
+    scrapes_per_day: int = 2,
+):
+    '''
+    Times convert (which is dominated by the four log tables) on synthetic
+    data with an increasing number of day intervals. With the single pass
+    change detection the time should grow roughly linearly with the number
+    of rows rather than with days x rows.
+    '''
+    print(f"{'days':>6} {'rows':>10} {'seconds':>10} {'rows/sec':>12}")
+    for num_days in [int(d) for d in days.split(',')]:
+        df = pd.DataFrame(generate_records(num_playlists, videos_per_playlist, num_days, scrapes_per_day))
+        with tempfile.TemporaryDirectory() as output_directory:
+            ingestor = YoutubePlaylistPgIngestor('day', None, output_directory, None)
+            start = time.perf_counter()
+            ingestor.convert(df)
+            elapsed = time.perf_counter() - start
+        print(f"{num_days:>6} {len(df):>10} {elapsed:>10.3f} {len(df) / elapsed:>12.0f}")
+
+
+if __name__ == "__main__":
+    typer.run(main)
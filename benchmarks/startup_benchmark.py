@@ -0,0 +1,63 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import typer
+
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# modules the CLI should only import once an ingestor actually runs
+HEAVY_MODULES = ['duckdb', 'pyarrow', 'pandas', 'psycopg2']
+CASES = {
+    'help': ['--help'],
+    'invalid_ingestor_type': ['source.json', 'NOT_AN_INGESTOR', 'output', 'postgresql://localhost/unused'],
+}
+
+
+def imported_heavy_modules(args: list[str]) -> list[str]:
+    '''
+    The HEAVY_MODULES imported by running main.py with args.
+    '''
+    code = (
+        'import runpy, sys\n'
+        f'sys.argv = ["main.py"] + {args!r}\n'
+        'try:\n'
+        '    runpy.run_path("main.py", run_name="__main__")\n'
+        'except BaseException:\n'
+        '    pass\n'
+        f'print("heavy_modules=" + ",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n'
+    )
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT_DIRECTORY, capture_output=True, text=True)
+    line = [line for line in result.stdout.splitlines() if line.startswith('heavy_modules=')][-1]
+    return [m for m in line.removeprefix('heavy_modules=').split(',') if m]
+
+
+def main(repeats: int = 10, max_seconds: float | None = None):
+    '''
+    Times running main.py to the point it shows --help or rejects an invalid
+    ingestor_type, each in a fresh process like a scheduler would launch it,
+    and lists the heavy modules those runs import. Exits with an error if a
+    heavy module is imported or, with max_seconds, if a case's median is
+    slower.
+    '''
+    failed = False
+    print(f"{'case':>22} {'median':>8} {'min':>8}  heavy imports")
+    for name, args in CASES.items():
+        seconds = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, 'main.py'] + args, cwd=ROOT_DIRECTORY, capture_output=True)
+            seconds.append(time.perf_counter() - start)
+        median = statistics.median(seconds)
+        heavy_modules = imported_heavy_modules(args)
+        print(f"{name:>22} {median:>8.3f} {min(seconds):>8.3f}  {', '.join(heavy_modules) or '-'}")
+        if heavy_modules or (max_seconds is not None and median > max_seconds):
+            failed = True
+    if failed:
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,163 @@
+import datetime
+import json
+import os
+import random
+import string
+from typing import Iterator
+
+import typer
+
+
+WORDS = [
+    'love', 'night', 'heart', 'fire', 'dance', 'summer', 'tears', 'dream', 'gold', 'rain', 'city', 'lights',
+    'forever', 'baby', 'young', 'wild', 'blue', 'road', 'home', 'stay', 'again', 'better', 'sky', 'girl',
+]
+TITLE_SUFFIXES = ['(Official Music Video)', '(Official Video)', '(Lyrics)', '(Audio)', '[Official Video]', '']
+
+
+def _random_id(rng: random.Random, prefix: str, length: int) -> str:
+    return prefix + ''.join(rng.choices(string.ascii_letters + string.digits + '-_', k=length))
+
+
+def _phrase(rng: random.Random, max_words: int) -> str:
+    return ' '.join(rng.choices(WORDS, k=rng.randint(1, max_words))).title()
+
+
+def _make_videos(rng: random.Random, num_videos: int, artist_null_fraction: float) -> list[dict]:
+    artists = [_phrase(rng, 2) for _ in range(max(1, num_videos // 4))]
+    videos = []
+    for _ in range(num_videos):
+        video_id = _random_id(rng, '', 11)
+        track = _phrase(rng, 4)
+        if rng.random() < artist_null_fraction:
+            # like the real data, videos without an artist are often not
+            # titled "Artist - Track" and don't always have a track title
+            artist = None
+            title = f'{track} {rng.choice(TITLE_SUFFIXES)}'.strip()
+            track_title = track if rng.random() < 0.5 else None
+        else:
+            artist = rng.choice(artists)
+            title = f'{artist} - {track} {rng.choice(TITLE_SUFFIXES)}'.strip()
+            track_title = track
+        videos.append({
+            'video_id': video_id,
+            'title': title,
+            'artist_name': artist,
+            'image_url': f'https://i.ytimg.com/vi/{video_id}/default.jpg',
+            'track_title': track_title,
+        })
+    return videos
+
+
+def generate_records(
+    num_playlists: int = 10,
+    videos_per_playlist: int = 50,
+    days: int = 7,
+    scrapes_per_day: int = 2,
+    churn: float = 0.1,
+    artist_null_fraction: float = 0.45,
+    seed: int = 0,
+    start: datetime.datetime = datetime.datetime(2022, 5, 19),
+) -> Iterator[dict]:
+    '''
+    Yields records in the same schema as youtube_playlist.json: every scrape
+    of every playlist has one record per video in it.
+
+    Videos are drawn from a shared pool so popular ones show up in several
+    playlists, and channels own a few playlists each. On every scrape each
+    playlist's views change with probability churn, about churn of its
+    positions get swapped and with probability churn one of its videos is
+    replaced by a new one. artist_null_fraction of the videos have no
+    artist_name.
+    '''
+    rng = random.Random(seed)
+    videos = _make_videos(rng, max(2 * videos_per_playlist, num_playlists * videos_per_playlist // 2), artist_null_fraction)
+    channel_ids = [_random_id(rng, 'UC', 22) for _ in range(max(1, num_playlists // 3))]
+    playlists = []
+    for p in range(num_playlists):
+        playlists.append({
+            'playlist_id': _random_id(rng, 'PL', 32),
+            'playlist_name': f'{_phrase(rng, 3)} Hits {p} {start.year}',
+            'artwork_url': f'https://i.ytimg.com/vi/{_random_id(rng, "", 11)}/default.jpg',
+            'channel_id': rng.choice(channel_ids),
+            'views': rng.randint(100_000, 1_000_000_000),
+            'videos': rng.sample(videos, videos_per_playlist),
+        })
+
+    for day in range(days):
+        for scrape in range(scrapes_per_day):
+            scrape_start = start + datetime.timedelta(days=day, hours=scrape * 24 / scrapes_per_day)
+            for playlist in playlists:
+                playlist_videos = playlist['videos']
+                if rng.random() < churn:
+                    playlist['views'] += rng.randint(1, 100_000)
+                for _ in range(round(churn * len(playlist_videos))):
+                    i, j = rng.randrange(len(playlist_videos)), rng.randrange(len(playlist_videos))
+                    playlist_videos[i], playlist_videos[j] = playlist_videos[j], playlist_videos[i]
+                if rng.random() < churn:
+                    new_video = rng.choice(videos)
+                    if new_video not in playlist_videos:
+                        playlist_videos[rng.randrange(len(playlist_videos))] = new_video
+
+                # scrapes take a while so every playlist gets its own time
+                timestp = scrape_start + datetime.timedelta(seconds=rng.uniform(0, 3600))
+                for position, video in enumerate(playlist_videos):
+                    yield {
+                        'playlist_id': playlist['playlist_id'],
+                        'playlist_name': playlist['playlist_name'],
+                        'artwork_url': playlist['artwork_url'],
+                        'channel_id': playlist['channel_id'],
+                        'views': playlist['views'],
+                        'num_videos': len(playlist_videos),
+                        'timestp': timestp.isoformat(),
+                        **video,
+                        'position': position,
+                    }
+
+
+def write_json(records: Iterator[dict], path: str, json_format: str = 'array') -> int:
+    '''
+    Writes the records to path one at a time, as a JSON array or with
+    json_format "newline_delimited" one record per line. Returns the number
+    of records written.
+    '''
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        if json_format == 'array':
+            f.write('[')
+        for record in records:
+            if json_format == 'array':
+                f.write(',\n' if count else '\n')
+                f.write(json.dumps(record, ensure_ascii=False))
+            else:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            count += 1
+        if json_format == 'array':
+            f.write('\n]\n')
+    return count
+
+
+def main(
+    path: str,
+    num_playlists: int = 10,
+    videos_per_playlist: int = 50,
+    days: int = 7,
+    scrapes_per_day: int = 2,
+    churn: float = 0.1,
+    artist_null_fraction: float = 0.45,
+    seed: int = 0,
+    json_format: str = "array",
+):
+    '''
+    Writes a synthetic youtube_playlist.json to path, see generate_records.
+    '''
+    count = write_json(
+        generate_records(num_playlists, videos_per_playlist, days, scrapes_per_day, churn, artist_null_fraction, seed),
+        path,
+        json_format,
+    )
+    print(f"Wrote {count} records ({os.path.getsize(path)} bytes) to {path}")
+
+
+if __name__ == "__main__":
+    typer.run(main)
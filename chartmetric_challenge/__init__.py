@@ -1,7 +1,19 @@
-from chartmetric_challenge.constants import ORG_YOUTUBE, TYPE_PLAYLIST
-from chartmetric_challenge.youtube_playlist_pg import YoutubePlaylistPgIngestor
+import importlib
 
+from chartmetric_challenge.constants import ORG_SPOTIFY, ORG_YOUTUBE, TYPE_PLAYLIST
 
+
+# the module and class of each ingestor, only imported by ingestor_class so
+# the CLIs can show --help and validate their arguments without loading
+# duckdb, pyarrow and pandas
 VALID_INGESTORS = {
-    f'{TYPE_PLAYLIST}_{ORG_YOUTUBE}': YoutubePlaylistPgIngestor,
+    f'{TYPE_PLAYLIST}_{ORG_YOUTUBE}': 'chartmetric_challenge.youtube_playlist_pg:YoutubePlaylistPgIngestor',
+    f'{TYPE_PLAYLIST}_{ORG_SPOTIFY}': 'chartmetric_challenge.spotify_playlist_pg:SpotifyPlaylistPgIngestor',
 }
+
+
+def ingestor_class(ingestor_type: str) -> type:
+    if ingestor_type not in VALID_INGESTORS:
+        raise ValueError(f"ingestor_type must be one of {list(VALID_INGESTORS)}")
+    module_name, class_name = VALID_INGESTORS[ingestor_type].split(':')
+    return getattr(importlib.import_module(module_name), class_name)
@@ -0,0 +1,75 @@
+from typing import Iterable
+import functools
+import re
+import unicodedata
+
+import pyarrow as pa
+
+
+# "A feat. B", "A (ft. B)", "A x B" and "A with B" always credit A first, a
+# capital X is more likely part of a name like "Lil Nas X"
+FEATURING_SEPARATOR = re.compile(r'\s(?:[\(\[]\s*)?(?:feat\.?|ft\.?|featuring|(?-i:x)|with)\s+|[\(\[]\s*(?:feat\.?|ft\.?|featuring)\s+', re.IGNORECASE)
+# but plenty of single artists have "&" or "," in their name
+GROUP_SEPARATOR = re.compile(r'\s*(?:&|,)\s*')
+NON_ALPHANUMERIC = re.compile(r'[^\w]+|_')
+
+
+@functools.lru_cache(maxsize=1_000_000)
+def artist_key(name: str) -> str:
+    '''
+    Casefolds and strips accents and punctuation so spellings of the same
+    name compare equal, eg "BEYONCÉ" and "Beyonce" -> "beyonce".
+    '''
+    if not name.isascii():
+        name = unicodedata.normalize('NFKD', name)
+        name = ''.join(c for c in name if not unicodedata.combining(c))
+    name = name.casefold()
+    return ' '.join(NON_ALPHANUMERIC.sub(' ', name).split())
+
+
+class ArtistResolver:
+    '''
+    Maps raw artist names to a canonical artist: the first artist credited,
+    compared by artist_key, named after the first spelling of it seen.
+
+        resolver = ArtistResolver()
+        resolver.resolve('The Weeknd')               # ('the weeknd', 'The Weeknd')
+        resolver.resolve('THE WEEKND feat. Daft Punk')  # ('the weeknd', 'The Weeknd')
+
+    "&" and "," only split a name when its first part is already a known
+    artist, so "Doja Cat & SZA" resolves to Doja Cat once she's been seen but
+    "Mumford & Sons" stays one artist. names_by_key carries the canonical
+    artists over from earlier runs.
+    '''
+    def __init__(self, names_by_key: dict[str, str] | None = None):
+        self._names_by_key = dict(names_by_key or {})
+
+    def resolve(self, raw_name: str) -> tuple[str, str]:
+        '''
+        Returns the canonical key and name of raw_name.
+        '''
+        primary = FEATURING_SEPARATOR.split(raw_name, maxsplit=1)[0]
+        group_separator = GROUP_SEPARATOR.search(primary)
+        if group_separator is not None and artist_key(primary[:group_separator.start()]) in self._names_by_key:
+            primary = primary[:group_separator.start()]
+        key = artist_key(primary)
+        if not key:
+            # names that are all punctuation are only equal to themselves
+            primary = raw_name
+            key = raw_name
+        return key, self._names_by_key.setdefault(key, ' '.join(primary.split()))
+
+    def alias_table(self, raw_names: Iterable[str]) -> pa.Table:
+        '''
+        Resolves raw_names into a table of raw_name, canonical_key and name.
+        Names without "&" or "," are resolved first so that the collaborations
+        between them can be split, otherwise in order so a new artist is
+        named after the first of its spellings.
+        '''
+        rows = {'raw_name': [], 'canonical_key': [], 'name': []}
+        for raw_name in sorted(raw_names, key=lambda n: GROUP_SEPARATOR.search(n) is not None):
+            key, name = self.resolve(raw_name)
+            rows['raw_name'].append(raw_name)
+            rows['canonical_key'].append(key)
+            rows['name'].append(name)
+        return pa.table(rows, schema=pa.schema([('raw_name', pa.string()), ('canonical_key', pa.string()), ('name', pa.string())]))
@@ -0,0 +1,186 @@
+from typing import Iterator, NamedTuple
+import datetime
+import logging
+import time
+
+from chartmetric_challenge.constants import GRANULARITIES, GRANULARITY_DAY, GRANULARITY_HOUR, GRANULARITY_WEEK
+from chartmetric_challenge.ingest_state import sql_string
+from chartmetric_challenge.pg_copy import pg_connect, quote_identifier
+
+
+# the entity each log table tracks, compaction keeps the last row of each
+# per bucket
+LOG_TABLE_ID_COLUMNS = {
+    'playlist_metadata_log': ['playlist_id'],
+    'playlist_plays_log': ['playlist_id'],
+    'playlist_positions_log': ['playlist_id', 'media_item_id'],
+    'media_item_metadata_log': ['media_item_id'],
+}
+DEFAULT_RETENTION_POLICY = '90:week,365:month'
+
+
+class RetentionTier(NamedTuple):
+    days: int
+    granularity: str
+
+
+def parse_retention_policy(policy: str) -> list[RetentionTier]:
+    '''
+    Parses a policy like "90:week,365:month" (rows older than 90 days are
+    kept weekly, older than 365 days monthly) into tiers sorted by age.
+    '''
+    tiers = []
+    for tier in policy.split(','):
+        days, _, granularity = tier.partition(':')
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity in retention tier {tier!r} must be one of {GRANULARITIES}")
+        if not days.strip().isdigit():
+            raise ValueError(f"retention tier {tier!r} must look like <days>:<granularity>")
+        tiers.append(RetentionTier(int(days), granularity))
+    tiers.sort()
+    for younger, older in zip(tiers, tiers[1:]):
+        if younger.days == older.days or GRANULARITIES.index(older.granularity) < GRANULARITIES.index(younger.granularity):
+            raise ValueError(f"retention tiers {younger} and {older} must get coarser as they get older")
+    return tiers
+
+
+def truncate_timestamp(timestamp: datetime.datetime, granularity: str) -> datetime.datetime:
+    '''
+    Python's version of date_trunc, weeks start on Monday like in Postgres
+    and DuckDB.
+    '''
+    timestamp = timestamp.replace(minute=0, second=0, microsecond=0)
+    if granularity == GRANULARITY_HOUR:
+        return timestamp
+    timestamp = timestamp.replace(hour=0)
+    if granularity == GRANULARITY_DAY:
+        return timestamp
+    if granularity == GRANULARITY_WEEK:
+        return timestamp - datetime.timedelta(days=timestamp.weekday())
+    return timestamp.replace(day=1)
+
+
+def add_buckets(timestamp: datetime.datetime, granularity: str, count: int) -> datetime.datetime:
+    if granularity == GRANULARITY_HOUR:
+        return timestamp + datetime.timedelta(hours=count)
+    if granularity == GRANULARITY_DAY:
+        return timestamp + datetime.timedelta(days=count)
+    if granularity == GRANULARITY_WEEK:
+        return timestamp + datetime.timedelta(weeks=count)
+    month = timestamp.month - 1 + count
+    return timestamp.replace(year=timestamp.year + month // 12, month=month % 12 + 1)
+
+
+def tier_ranges(tiers: list[RetentionTier], as_of: datetime.datetime) -> list[tuple[RetentionTier, datetime.datetime | None, datetime.datetime]]:
+    '''
+    The [start, end) range of ingest timestamps each tier compacts. The ends
+    are rounded down to a whole bucket so the newest bucket of a tier is only
+    compacted once it's complete, a None start means from the oldest row.
+    '''
+    ranges = []
+    start = None
+    for tier in reversed(tiers):
+        end = truncate_timestamp(as_of - datetime.timedelta(days=tier.days), tier.granularity)
+        if start is not None:
+            end = max(start, end)
+        ranges.append((tier, start, end))
+        start = end
+    return list(reversed(ranges))
+
+
+def iter_batches(start: datetime.datetime, end: datetime.datetime, granularity: str, buckets_per_batch: int) -> Iterator[tuple[datetime.datetime, datetime.datetime]]:
+    '''
+    Splits [start, end) into ranges of buckets_per_batch whole buckets (the
+    first one is cut off at start).
+    '''
+    bucket_start = truncate_timestamp(start, granularity)
+    while bucket_start < end:
+        bucket_end = add_buckets(bucket_start, granularity, buckets_per_batch)
+        yield max(start, bucket_start), min(end, bucket_end)
+        bucket_start = bucket_end
+
+
+def compact_sql(table_name: str, id_columns: list[str], granularity: str, start: datetime.datetime, end: datetime.datetime) -> str:
+    '''
+    Deletes every row of table_name with an ingest_timestamp in [start, end)
+    which has a later row for the same entity in the same bucket, leaving the
+    last one. Works in Postgres and DuckDB.
+    '''
+    table = quote_identifier(table_name)
+    start_sql = f"TIMESTAMP {sql_string(start.isoformat(sep=' '))}"
+    end_sql = f"TIMESTAMP {sql_string(end.isoformat(sep=' '))}"
+    same_entity = ' AND '.join(f"later.{quote_identifier(c)} = {table}.{quote_identifier(c)}" for c in id_columns)
+    return f'''
+DELETE FROM {table}
+WHERE
+    ingest_timestamp >= {start_sql}
+    AND ingest_timestamp < {end_sql}
+    AND EXISTS (
+        SELECT 1
+        FROM {table} AS later
+        WHERE
+            {same_entity}
+            AND later.ingest_timestamp > {table}.ingest_timestamp
+            AND later.ingest_timestamp < {end_sql}
+            AND date_trunc({sql_string(granularity)}, later.ingest_timestamp) = date_trunc({sql_string(granularity)}, {table}.ingest_timestamp)
+    )
+'''
+
+
+def _count_rows(cursor, table_name: str) -> int:
+    cursor.execute(f"SELECT count(*) FROM {quote_identifier(table_name)}")
+    return cursor.fetchone()[0]
+
+
+def compact(
+    pg_connection_string: str,
+    tiers: list[RetentionTier],
+    as_of: datetime.datetime,
+    table_names: list[str] | None = None,
+    buckets_per_batch: int = 4,
+) -> dict[str, dict]:
+    '''
+    Compacts the log tables so rows older than each tier's days only keep
+    the last row per entity per tier granularity. Every batch of
+    buckets_per_batch buckets is deleted and committed in its own
+    transaction so no lock is held for long, and an interrupted run can just
+    be started again. Returns the rows before and after for each table.
+    '''
+    table_names = table_names or list(LOG_TABLE_ID_COLUMNS)
+    connection = pg_connect(pg_connection_string)
+    report = {}
+    try:
+        for table_name in table_names:
+            id_columns = LOG_TABLE_ID_COLUMNS[table_name]
+            start_time = time.perf_counter()
+            with connection.cursor() as cursor:
+                rows_before = _count_rows(cursor, table_name)
+                cursor.execute(f"SELECT min(ingest_timestamp) FROM {quote_identifier(table_name)}")
+                oldest = cursor.fetchone()[0]
+            connection.commit()
+            batch_count = 0
+            for tier, start, end in tier_ranges(tiers, as_of):
+                if oldest is None:
+                    break
+                for batch_start, batch_end in iter_batches(max(oldest, start or oldest), end, tier.granularity, buckets_per_batch):
+                    with connection.cursor() as cursor:
+                        cursor.execute(compact_sql(table_name, id_columns, tier.granularity, batch_start, batch_end))
+                        logging.debug(f"Deleted {cursor.rowcount} rows from {table_name} between {batch_start} and {batch_end}")
+                    connection.commit()
+                    batch_count += 1
+            with connection.cursor() as cursor:
+                rows_after = _count_rows(cursor, table_name)
+            connection.commit()
+            report[table_name] = {
+                'rows_before': rows_before,
+                'rows_after': rows_after,
+                'batches': batch_count,
+                'seconds': round(time.perf_counter() - start_time, 6),
+            }
+            logging.info(f"Compacted {table_name} from {rows_before} to {rows_after} rows in {batch_count} batches")
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    return report
@@ -12,4 +12,36 @@ PLAYLIST_METADATA_LOG_FILENAME = 'playlist_metadata_log.csv'
 PLAYLIST_PLAYS_LOG_FILENAME = 'playlist_plays_log.csv'
 PLAYLIST_POSITIONS_LOG_FILENAME = 'playlist_positions_log.csv'
 PLAYLISTS_FILENAME = 'playlists.csv'
+PLAYLIST_METADATA_CURRENT_FILENAME = 'playlist_metadata_current.csv'
+PLAYLIST_PLAYS_CURRENT_FILENAME = 'playlist_plays_current.csv'
+PLAYLIST_POSITIONS_CURRENT_FILENAME = 'playlist_positions_current.csv'
+MEDIA_ITEM_METADATA_CURRENT_FILENAME = 'media_item_metadata_current.csv'
 USERS_FILENAME = 'users.csv'
+
+LOAD_MODE_PANDAS = 'pandas'
+LOAD_MODE_STREAM = 'stream'
+LOAD_MODE_DUCKDB = 'duckdb'
+LOAD_MODES = [LOAD_MODE_PANDAS, LOAD_MODE_STREAM, LOAD_MODE_DUCKDB]
+JSON_FORMAT_ARRAY = 'array'
+JSON_FORMAT_NEWLINE_DELIMITED = 'newline_delimited'
+JSON_FORMATS = [JSON_FORMAT_ARRAY, JSON_FORMAT_NEWLINE_DELIMITED]
+INTERMEDIATE_FORMAT_CSV = 'csv'
+INTERMEDIATE_FORMAT_PARQUET = 'parquet'
+INTERMEDIATE_FORMAT_ARROW = 'arrow'
+INTERMEDIATE_FORMATS = [INTERMEDIATE_FORMAT_CSV, INTERMEDIATE_FORMAT_PARQUET, INTERMEDIATE_FORMAT_ARROW]
+SHARD_BY_PLAYLIST = 'playlist'
+SHARD_BY_DATE = 'date'
+SHARD_BYS = [SHARD_BY_PLAYLIST, SHARD_BY_DATE]
+MEDIA_ITEM_ISRC_FILENAME = 'media_item_isrc.csv'
+PG_LOAD_MODE_APPEND = 'append'
+PG_LOAD_MODE_UPSERT = 'upsert'
+PG_LOAD_MODES = [PG_LOAD_MODE_APPEND, PG_LOAD_MODE_UPSERT]
+RUN_REPORT_FILENAME = 'run_report.json'
+QUERY_PROFILES_DIRECTORY = 'query_profiles'
+DEAD_LETTER_FILENAME = 'dead_letter.jsonl'
+GRANULARITY_HOUR = 'hour'
+GRANULARITY_DAY = 'day'
+GRANULARITY_WEEK = 'week'
+GRANULARITY_MONTH = 'month'
+# finest to coarsest
+GRANULARITIES = [GRANULARITY_HOUR, GRANULARITY_DAY, GRANULARITY_WEEK, GRANULARITY_MONTH]
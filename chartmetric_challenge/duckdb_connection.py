@@ -0,0 +1,23 @@
+import duckdb
+
+
+def connect(
+    database: str = ':memory:',
+    memory_limit: str | None = None,
+    threads: int | None = None,
+    temp_directory: str | None = None,
+) -> duckdb.DuckDBPyConnection:
+    '''
+    Opens a new DuckDB connection which shares nothing with the module level
+    default connection. database can be a file path to keep tables on disk,
+    memory_limit is a DuckDB size (eg "4GB") and temp_directory is where
+    DuckDB spills to once it reaches the memory limit.
+    '''
+    config = {}
+    if memory_limit is not None:
+        config['memory_limit'] = memory_limit
+    if threads is not None:
+        config['threads'] = threads
+    if temp_directory is not None:
+        config['temp_directory'] = temp_directory
+    return duckdb.connect(database, config=config)
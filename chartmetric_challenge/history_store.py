@@ -0,0 +1,401 @@
+from typing import Any
+import collections
+import datetime
+import json
+import os
+import threading
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute
+import pyarrow.parquet
+
+from chartmetric_challenge.constants import INTERMEDIATE_FORMAT_CSV, INTERMEDIATE_FORMAT_PARQUET
+from chartmetric_challenge.ingest_state import sql_string
+from chartmetric_challenge.pg_copy import open_record_batches, quote_identifier
+from chartmetric_challenge.paths import output_path, superseded_output_path
+from chartmetric_challenge.pg_ingestor import LOG_TABLE_COLUMNS, LOG_TABLE_FILENAMES
+
+
+# small row groups so a lookup of one entity decodes little more than its
+# own rows
+DEFAULT_ROW_GROUP_SIZE = 16_384
+DEFAULT_CACHE_ROW_GROUPS = 256
+# a table is compacted into one file once it has more than this many
+DEFAULT_MAX_FILES = 8
+MANIFEST_FILENAME = 'manifest.json'
+# marks the rows a later ingest superseded, they hide the row with the same
+# key in an earlier file
+DELETED_COLUMN = 'is_deleted'
+# CSVs don't carry types, and a column a small file has no values for would
+# otherwise be read as VARCHAR
+COLUMN_TYPES = {
+    'playlist_id': 'BIGINT',
+    'media_item_id': 'BIGINT',
+    'user_id': 'BIGINT',
+    'artist_id': 'BIGINT',
+    'ingest_timestamp': 'TIMESTAMP',
+    'num_media_items': 'BIGINT',
+    'plays': 'BIGINT',
+    'position': 'BIGINT',
+}
+
+
+def history_store_path(store_directory: str, table_name: str) -> str:
+    '''
+    The directory of table_name's files, listed in order by its manifest.
+    '''
+    return os.path.join(store_directory, table_name)
+
+
+def key_columns(table_name: str) -> list[str]:
+    id_column_names, _ = LOG_TABLE_COLUMNS[table_name]
+    return id_column_names + ['ingest_timestamp']
+
+
+def read_manifest(table_directory: str) -> list[str]:
+    try:
+        with open(os.path.join(table_directory, MANIFEST_FILENAME)) as f:
+            return json.load(f)['files']
+    except FileNotFoundError:
+        return []
+
+
+def _write_manifest(table_directory: str, filenames: list[str]):
+    path = os.path.join(table_directory, MANIFEST_FILENAME)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump({'files': filenames}, f)
+    os.replace(f'{path}.tmp', path)
+
+
+def _next_filename(filenames: list[str]) -> str:
+    # numbers are never reused, so a file name always means the same rows
+    number = max((int(os.path.splitext(f)[0]) for f in filenames), default=0) + 1
+    return f'{number:08d}.parquet'
+
+
+def _read(con: duckdb.DuckDBPyConnection, path: str, intermediate_format: str) -> duckdb.DuckDBPyRelation:
+    if intermediate_format == INTERMEDIATE_FORMAT_CSV:
+        return con.read_csv(path)
+    elif intermediate_format == INTERMEDIATE_FORMAT_PARQUET:
+        return con.read_parquet(path)
+    return con.from_arrow(open_record_batches(path, intermediate_format))
+
+
+def _typed_select(relation_name: str, relation_columns: list[str], table_name: str, deleted: bool, source_index: int) -> str:
+    # every file of a table gets the same columns and types, the superseded
+    # keys only have the key columns
+    _, other_column_types = LOG_TABLE_COLUMNS[table_name]
+    columns = []
+    for c in key_columns(table_name) + list(other_column_types):
+        column_type = COLUMN_TYPES.get(c, other_column_types.get(c))
+        value = quote_identifier(c) if c in relation_columns else 'NULL'
+        columns.append(f"CAST({value} AS {column_type}) AS {quote_identifier(c)}")
+    return f"SELECT {', '.join(columns)}, {str(deleted).lower()} AS {DELETED_COLUMN}, {source_index} AS source_index FROM {relation_name}"
+
+
+def _write_file(con: duckdb.DuckDBPyConnection, query: str, path: str, row_group_size: int):
+    # written next to its final path and then moved there, so readers never
+    # see a partial file
+    con.execute(f"COPY ({query}) TO {sql_string(f'{path}.tmp')} (FORMAT parquet, COMPRESSION zstd, ROW_GROUP_SIZE {row_group_size})")
+    os.replace(f'{path}.tmp', path)
+
+
+def update_history_store(
+    store_directory: str,
+    output_directories: list[str],
+    intermediate_format: str = INTERMEDIATE_FORMAT_CSV,
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    max_files: int = DEFAULT_MAX_FILES,
+) -> dict[str, int]:
+    '''
+    Adds the log tables in output_directories (the output of one or more
+    ingests, in the order they ran) to the store as one new parquet file
+    per log table, sorted by its IDs then ingest_timestamp so each row
+    group's statistics cover a narrow range of IDs. The rows an ingest
+    superseded (see superseded_output_path) are added as deleted rows. A
+    row that's in several files is read from the last one, so the files
+    already in the store are never rewritten, except that a table with more
+    than max_files is compacted (see compact_history_store). Returns the
+    rows written for each table.
+    '''
+    os.makedirs(store_directory, exist_ok=True)
+    con = duckdb.connect()
+    row_counts = {}
+    try:
+        for table_name, filename in LOG_TABLE_FILENAMES.items():
+            selects = []
+            for i, output_directory in enumerate(output_directories):
+                path = output_path(output_directory, filename, intermediate_format)
+                for source_path, deleted in [(path, False), (superseded_output_path(path), True)]:
+                    if os.path.exists(source_path):
+                        relation_name = f'source_{len(selects)}'
+                        relation = _read(con, source_path, intermediate_format)
+                        relation.create_view(relation_name)
+                        selects.append(_typed_select(relation_name, relation.columns, table_name, deleted, i))
+            if not selects:
+                continue
+
+            table_directory = history_store_path(store_directory, table_name)
+            os.makedirs(table_directory, exist_ok=True)
+            filenames = read_manifest(table_directory)
+            new_filename = _next_filename(filenames)
+            keys = ', '.join(key_columns(table_name))
+            _write_file(con, f'''
+SELECT * EXCLUDE (source_index)
+FROM ({' UNION ALL BY NAME '.join(selects)})
+QUALIFY row_number() OVER (PARTITION BY {keys} ORDER BY source_index DESC) = 1
+ORDER BY {keys}
+''', os.path.join(table_directory, new_filename), row_group_size)
+            _write_manifest(table_directory, filenames + [new_filename])
+            row_counts[table_name] = pyarrow.parquet.ParquetFile(os.path.join(table_directory, new_filename)).metadata.num_rows
+            if len(filenames) + 1 > max_files:
+                _compact_table(con, table_directory, table_name, row_group_size)
+    finally:
+        con.close()
+    return row_counts
+
+
+def compact_history_store(store_directory: str, row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> dict[str, int]:
+    '''
+    Merges each table's files into one, keeping the last row per key and
+    dropping the deleted ones. Returns the rows in each table.
+    '''
+    con = duckdb.connect()
+    row_counts = {}
+    try:
+        for table_name in LOG_TABLE_FILENAMES:
+            table_directory = history_store_path(store_directory, table_name)
+            if read_manifest(table_directory):
+                row_counts[table_name] = _compact_table(con, table_directory, table_name, row_group_size)
+    finally:
+        con.close()
+    return row_counts
+
+
+def _compact_table(con: duckdb.DuckDBPyConnection, table_directory: str, table_name: str, row_group_size: int) -> int:
+    filenames = read_manifest(table_directory)
+    new_filename = _next_filename(filenames)
+    keys = ', '.join(key_columns(table_name))
+    selects = [
+        f"SELECT *, {i} AS file_index FROM read_parquet({sql_string(os.path.join(table_directory, f))})"
+        for i, f in enumerate(filenames)
+    ]
+    _write_file(con, f'''
+SELECT * EXCLUDE (file_index)
+FROM (
+    FROM ({' UNION ALL '.join(selects)})
+    QUALIFY row_number() OVER (PARTITION BY {keys} ORDER BY file_index DESC) = 1
+)
+WHERE NOT {DELETED_COLUMN}
+ORDER BY {keys}
+''', os.path.join(table_directory, new_filename), row_group_size)
+    _write_manifest(table_directory, [new_filename])
+    # readers which still have the old manifest retry once these are gone
+    for filename in filenames:
+        os.remove(os.path.join(table_directory, filename))
+    return pyarrow.parquet.ParquetFile(os.path.join(table_directory, new_filename)).metadata.num_rows
+
+
+class _StoreFile:
+    '''
+    A store file's metadata and the min/max of the columns lookups filter on
+    in each of its row groups. Files are never changed once written.
+    '''
+    def __init__(self, path: str, filter_columns: list[str]):
+        self.path = path
+        self.metadata = pyarrow.parquet.read_metadata(path)
+        self.schema = pyarrow.parquet.read_schema(path)
+        column_indexes = {self.metadata.schema.column(i).name: i for i in range(self.metadata.num_columns)}
+        self.row_group_ranges = []
+        for row_group in range(self.metadata.num_row_groups):
+            ranges = {}
+            for column in filter_columns:
+                statistics = self.metadata.row_group(row_group).column(column_indexes[column]).statistics
+                if statistics is not None and statistics.has_min_max:
+                    ranges[column] = (statistics.min, statistics.max)
+            self.row_group_ranges.append(ranges)
+
+    def read_row_group(self, row_group: int) -> pa.Table:
+        # a reader of its own, so reads from several threads don't share
+        # one, the metadata is only parsed once though
+        return pyarrow.parquet.ParquetFile(self.path, metadata=self.metadata).read_row_group(row_group)
+
+    def row_groups(self, values: dict[str, Any], start: datetime.datetime | None, end: datetime.datetime | None) -> list[int]:
+        '''
+        The row groups which could have rows matching values between start
+        and end, a column without statistics can't rule any out.
+        '''
+        matches = []
+        for row_group, ranges in enumerate(self.row_group_ranges):
+            if any(c in ranges and not ranges[c][0] <= v <= ranges[c][1] for c, v in values.items()):
+                continue
+            if 'ingest_timestamp' in ranges:
+                oldest, newest = ranges['ingest_timestamp']
+                if (start is not None and newest < start) or (end is not None and oldest >= end):
+                    continue
+            matches.append(row_group)
+        return matches
+
+
+class HistoryStore:
+    '''
+    Answers time series lookups on the log tables from the parquet files
+    update_history_store writes instead of from Postgres.
+
+        store = HistoryStore('history')
+        store.get_position_history(playlist_id=3, media_item_id=42, start=datetime.datetime(2022, 5, 1))
+
+    Only the row groups whose statistics could match are read, from every
+    file of the table, and a key in several files is taken from the last
+    one. Up to cache_row_groups decoded row groups are kept in memory
+    (least recently used first out), so repeated lookups of the same
+    entities don't touch the disk at all. Files added by a later
+    update_history_store are picked up on the next lookup. Safe to share
+    between threads: the caches are behind a lock and every row group read
+    opens its own reader.
+    '''
+    def __init__(self, store_directory: str, cache_row_groups: int = DEFAULT_CACHE_ROW_GROUPS):
+        self._store_directory = store_directory
+        self._cache_row_groups = cache_row_groups
+        # the version of each table's manifest and its files
+        self._manifests = {}
+        self._row_group_cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def history(
+        self,
+        table_name: str,
+        start: datetime.datetime | None = None,
+        end: datetime.datetime | None = None,
+        **values,
+    ) -> pd.DataFrame:
+        '''
+        The rows of table_name with ingest_timestamp in [start, end) whose ID
+        columns equal values, eg history('playlist_plays_log', playlist_id=3),
+        sorted by the IDs then ingest_timestamp.
+        '''
+        if table_name not in LOG_TABLE_COLUMNS:
+            raise ValueError(f"table_name must be one of {list(LOG_TABLE_COLUMNS)}")
+        id_column_names, _ = LOG_TABLE_COLUMNS[table_name]
+        unknown_columns = [c for c in values if c not in id_column_names]
+        if unknown_columns:
+            raise ValueError(f"{unknown_columns} aren't ID columns of {table_name}")
+        values = {c: v for c, v in values.items() if v is not None}
+
+        try:
+            store_files, tables = self._read_row_groups(table_name, values, start, end)
+        except FileNotFoundError:
+            # compacted away since the manifest was read
+            store_files, tables = self._read_row_groups(table_name, values, start, end)
+        if not store_files:
+            return pd.DataFrame()
+        if not tables:
+            return store_files[-1].schema.empty_table().drop_columns([DELETED_COLUMN]).to_pandas()
+        table = pa.concat_tables(tables)
+
+        mask = None
+        for column, value in values.items():
+            mask = self._and(mask, pyarrow.compute.equal(table[column], value))
+        if start is not None:
+            mask = self._and(mask, pyarrow.compute.greater_equal(table['ingest_timestamp'], pa.scalar(start, table.schema.field('ingest_timestamp').type)))
+        if end is not None:
+            mask = self._and(mask, pyarrow.compute.less(table['ingest_timestamp'], pa.scalar(end, table.schema.field('ingest_timestamp').type)))
+        if mask is not None:
+            table = table.filter(mask)
+
+        df = table.to_pandas()
+        if df['file_index'].nunique() > 1:
+            # the last file's row of each key wins, deleted ones included
+            keys = key_columns(table_name)
+            df = df.sort_values(keys + ['file_index']).drop_duplicates(keys, keep='last')
+        return df[~df[DELETED_COLUMN]].drop(columns=[DELETED_COLUMN, 'file_index']).reset_index(drop=True)
+
+    def get_position_history(
+        self,
+        playlist_id: int | None = None,
+        media_item_id: int | None = None,
+        start: datetime.datetime | None = None,
+        end: datetime.datetime | None = None,
+    ) -> pd.DataFrame:
+        '''
+        The positions of a media item on a playlist over time, or of every
+        media item on a playlist if media_item_id is None. Without a
+        playlist_id the row groups can't be narrowed down much, since the
+        files are sorted by playlist first.
+        '''
+        return self.history('playlist_positions_log', start, end, playlist_id=playlist_id, media_item_id=media_item_id)
+
+    def get_plays_history(
+        self,
+        playlist_id: int,
+        start: datetime.datetime | None = None,
+        end: datetime.datetime | None = None,
+    ) -> pd.DataFrame:
+        return self.history('playlist_plays_log', start, end, playlist_id=playlist_id)
+
+    def cache_info(self) -> dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'row_groups': len(self._row_group_cache)}
+
+    @staticmethod
+    def _and(mask, condition):
+        return condition if mask is None else pyarrow.compute.and_(mask, condition)
+
+    def _read_row_groups(
+        self,
+        table_name: str,
+        values: dict[str, Any],
+        start: datetime.datetime | None,
+        end: datetime.datetime | None,
+    ) -> tuple[list[_StoreFile], list[pa.Table]]:
+        '''
+        The table's files and the row groups of them which could match, with
+        a file_index column saying which file each row came from.
+        '''
+        store_files = self._store_files(table_name)
+        tables = []
+        for file_index, store_file in enumerate(store_files):
+            for row_group in store_file.row_groups(values, start, end):
+                table = self._row_group(store_file, row_group)
+                tables.append(table.append_column('file_index', pa.array([file_index] * table.num_rows, pa.int32())))
+        return store_files, tables
+
+    def _store_files(self, table_name: str) -> list[_StoreFile]:
+        table_directory = history_store_path(self._store_directory, table_name)
+        try:
+            stat = os.stat(os.path.join(table_directory, MANIFEST_FILENAME))
+        except FileNotFoundError:
+            return []
+        # a new manifest is moved over the old one, so it's a new inode
+        version = (stat.st_ino, stat.st_mtime_ns)
+        with self._lock:
+            cached_version, store_files = self._manifests.get(table_name, (None, []))
+            if cached_version != version:
+                # only the new files need their metadata read
+                known_files = {f.path: f for f in store_files}
+                store_files = []
+                for filename in read_manifest(table_directory):
+                    path = os.path.join(table_directory, filename)
+                    store_files.append(known_files.get(path) or _StoreFile(path, key_columns(table_name)))
+                self._manifests[table_name] = (version, store_files)
+            return store_files
+
+    def _row_group(self, store_file: _StoreFile, row_group: int) -> pa.Table:
+        # file names are never reused, so a path always has the same rows
+        key = (store_file.path, row_group)
+        with self._lock:
+            table = self._row_group_cache.get(key)
+            if table is not None:
+                self._row_group_cache.move_to_end(key)
+                self.hits += 1
+                return table
+            self.misses += 1
+        table = store_file.read_row_group(row_group)
+        with self._lock:
+            self._row_group_cache[key] = table
+            while len(self._row_group_cache) > self._cache_row_groups:
+                self._row_group_cache.popitem(last=False)
+        return table
@@ -0,0 +1,111 @@
+import datetime
+import json
+import os
+import shutil
+
+import duckdb
+
+
+WATERMARK_FILENAME = 'watermark.json'
+
+
+def sql_string(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+class IngestState:
+    '''
+    Everything an incremental ingest needs to carry over from the previous
+    run, stored as parquet files in state_directory: the ID dictionaries, the
+    last row written for each entity of every log table and the watermark
+    (the latest source timestamp that has been ingested).
+
+    Changes are staged in a pending directory while converting and only
+    replace the current state on commit, so a failed run can be retried.
+    With continue_from an ingest can start from another one's staged state
+    before that's committed.
+    '''
+    def __init__(self, state_directory: str, con: duckdb.DuckDBPyConnection):
+        self._con = con
+        self._state_directory = state_directory
+        self._pending_directory = os.path.join(state_directory, 'pending')
+        # where the state is read from, the first directory with a file wins
+        self._read_directories = [state_directory]
+        try:
+            os.makedirs(self._state_directory, exist_ok=True)
+        except OSError:
+            raise ValueError(f"state_directory {self._state_directory} is not a valid path")
+
+    def _path(self, name: str) -> str:
+        return self._find(f'{name}.parquet')
+
+    def _find(self, filename: str) -> str:
+        for directory in self._read_directories:
+            path = os.path.join(directory, filename)
+            if os.path.exists(path):
+                return path
+        return os.path.join(self._state_directory, filename)
+
+    def has(self, name: str) -> bool:
+        return os.path.exists(self._path(name))
+
+    def scan(self, name: str) -> str:
+        '''
+        Returns a DuckDB table expression which reads the committed state,
+        or the state staged by the ingest this one continues from.
+        '''
+        return f'read_parquet({sql_string(self._path(name))})'
+
+    def continue_from(self, previous: 'IngestState'):
+        '''
+        Reads previous's staged state, falling back to whatever previous
+        reads, instead of the committed state. This ingest stages into its
+        own pending directory, and previous has to be committed with
+        keep_pending first since this one may still be reading its files.
+        '''
+        self._read_directories = [previous._pending_directory] + previous._read_directories
+        self._pending_directory = os.path.join(self._state_directory, f'pending_{len(self._read_directories) - 1}')
+
+    def reset_pending(self):
+        shutil.rmtree(self._pending_directory, ignore_errors=True)
+        os.makedirs(self._pending_directory)
+
+    def stage(self, name: str, query: str):
+        self._con.execute(
+            f"COPY ({query}) TO {sql_string(os.path.join(self._pending_directory, f'{name}.parquet'))} (FORMAT parquet)"
+        )
+
+    def watermark(self) -> datetime.datetime | None:
+        path = self._find(WATERMARK_FILENAME)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return datetime.datetime.fromisoformat(json.load(f)['watermark'])
+
+    def stage_watermark(self, watermark: datetime.datetime):
+        with open(os.path.join(self._pending_directory, WATERMARK_FILENAME), 'w') as f:
+            json.dump({'watermark': watermark.isoformat()}, f)
+
+    def commit(self, keep_pending: bool = False):
+        '''
+        Replaces the committed state with the staged one. With keep_pending
+        the staged files are copied rather than moved, for ingests which
+        continue_from this one, see discard_pending.
+        '''
+        if not os.path.isdir(self._pending_directory):
+            return
+        # the watermark goes last so an interrupted commit reprocesses the
+        # same records next time rather than skipping them
+        filenames = sorted(os.listdir(self._pending_directory), key=lambda f: f == WATERMARK_FILENAME)
+        for filename in filenames:
+            path = os.path.join(self._state_directory, filename)
+            if keep_pending:
+                shutil.copyfile(os.path.join(self._pending_directory, filename), f'{path}.tmp')
+                os.replace(f'{path}.tmp', path)
+            else:
+                os.replace(os.path.join(self._pending_directory, filename), path)
+        if not keep_pending:
+            os.rmdir(self._pending_directory)
+
+    def discard_pending(self):
+        shutil.rmtree(self._pending_directory, ignore_errors=True)
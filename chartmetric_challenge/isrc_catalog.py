@@ -0,0 +1,149 @@
+from typing import Iterator, TextIO
+import csv
+import io
+import logging
+import time
+
+from chartmetric_challenge.isrc_matching import normalize_title
+from chartmetric_challenge.pg_copy import DEFAULT_CHUNK_SIZE, PgCopyLoader, copy_csv_sql, quote_identifier
+
+
+CATALOG_TABLE_NAME = 'isrc_lookup'
+CATALOG_COLUMNS = ['cm_track', 'track', 'isrc', 'cm_artist', 'artist', 'normalized_title']
+CATALOG_COLUMN_TYPES = {
+    'cm_track': 'bigint',
+    'track': 'varchar',
+    # ISRCs are ASCII codes, sorting them bytewise is much faster than by
+    # the database's locale
+    'isrc': 'varchar COLLATE "C"',
+    'cm_artist': 'bigint',
+    'artist': 'varchar',
+    'normalized_title': 'varchar',
+}
+# (name suffix, definition) of the indexes built once the rows are loaded,
+# the trigram one needs pg_trgm
+CATALOG_INDEXES = [
+    ('normalized_title', 'btree (normalized_title)'),
+    ('cm_track', 'btree (cm_track)'),
+]
+CATALOG_TRIGRAM_INDEXES = [
+    ('normalized_title_trgm', 'gin (normalized_title gin_trgm_ops)'),
+]
+
+
+def iter_catalog_chunks(f: TextIO, chunk_size: int = DEFAULT_CHUNK_SIZE, counts: dict | None = None) -> Iterator[bytes]:
+    '''
+    Reads a catalog CSV like cm_track.csv (cm_track, track, isrc, cm_artist,
+    artist) and yields UTF-8 CSV of CATALOG_COLUMNS without a header, in
+    chunks of roughly chunk_size characters. Rows without an ISRC are
+    skipped. counts gets the rows read and skipped.
+    '''
+    counts = counts if counts is not None else {}
+    reader = csv.reader(f)
+    header = next(reader)
+    missing = [c for c in CATALOG_COLUMNS[:-1] if c not in header]
+    if missing:
+        raise ValueError(f"columns {missing} are not in the catalog header {header}")
+    cm_track_index, track_index, isrc_index, cm_artist_index, artist_index = [header.index(c) for c in CATALOG_COLUMNS[:-1]]
+    # the uncached function, most catalog titles are only seen once
+    normalize = normalize_title.__wrapped__
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    rows_read = rows_skipped = 0
+    for row in reader:
+        rows_read += 1
+        isrc = row[isrc_index].strip().upper()
+        if not isrc:
+            rows_skipped += 1
+            continue
+        track = row[track_index]
+        writer.writerow([row[cm_track_index], track, isrc, row[cm_artist_index], row[artist_index], normalize(track)])
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+    counts.update(rows_read=rows_read, rows_skipped=rows_skipped)
+
+
+def load_catalog(
+    pg_connection_string: str,
+    catalog_path: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    work_mem: str = '256MB',
+) -> dict:
+    '''
+    Replaces the isrc_lookup table with the catalog at catalog_path, one row
+    per ISRC (the one with the lowest cm_track when the catalog repeats an
+    ISRC).
+
+    The rows are streamed with COPY into an unlogged table without any
+    indexes, deduplicated into a new table, indexed and then swapped in for
+    the old table, all in one transaction. Building the indexes once over
+    all the rows is much faster than updating them row by row, and readers
+    keep using the old table until the swap. work_mem is Postgres' memory
+    for the deduplicating sort and the index builds in this transaction, with
+    the default 4MB they spill to disk. Returns the rows read, skipped and
+    loaded and the seconds each step took.
+    '''
+    table = quote_identifier(CATALOG_TABLE_NAME)
+    loading_table = quote_identifier(f'{CATALOG_TABLE_NAME}_loading')
+    new_table_name = f'{CATALOG_TABLE_NAME}_new'
+    new_table = quote_identifier(new_table_name)
+    report = {}
+    seconds = {}
+    with PgCopyLoader(pg_connection_string, chunk_size) as loader:
+        with loader.cursor() as cursor:
+            start = time.perf_counter()
+            cursor.execute("SELECT set_config('work_mem', %s, true), set_config('maintenance_work_mem', %s, true)", (work_mem, work_mem))
+            cursor.execute(f"DROP TABLE IF EXISTS {loading_table}")
+            cursor.execute(
+                f"CREATE UNLOGGED TABLE {loading_table} "
+                f"({', '.join(f'{quote_identifier(c)} {CATALOG_COLUMN_TYPES[c]}' for c in CATALOG_COLUMNS)})"
+            )
+            sql = copy_csv_sql(f'{CATALOG_TABLE_NAME}_loading', CATALOG_COLUMNS, header=False)
+            with open(catalog_path, newline='', encoding='utf-8') as f:
+                for chunk in iter_catalog_chunks(f, chunk_size, report):
+                    cursor.copy_expert(sql, io.BytesIO(chunk), size=chunk_size)
+            seconds['copy'] = time.perf_counter() - start
+            logging.info(f"Copied {report['rows_read'] - report['rows_skipped']} catalog rows in {seconds['copy']:.3f}s")
+
+            start = time.perf_counter()
+            column_list = ', '.join(quote_identifier(c) for c in CATALOG_COLUMNS)
+            cursor.execute(f"DROP TABLE IF EXISTS {new_table}")
+            cursor.execute(
+                f"CREATE TABLE {new_table} AS "
+                f"SELECT DISTINCT ON (isrc) {column_list} FROM {loading_table} ORDER BY isrc, cm_track"
+            )
+            report['rows_loaded'] = cursor.rowcount
+            cursor.execute(f"DROP TABLE {loading_table}")
+            seconds['dedupe'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            cursor.execute(f"ALTER TABLE {new_table} ADD CONSTRAINT {quote_identifier(f'{new_table_name}_pkey')} PRIMARY KEY (isrc)")
+            indexes = CATALOG_INDEXES
+            cursor.execute("SELECT count(*) FROM pg_available_extensions WHERE name = 'pg_trgm'")
+            if cursor.fetchone()[0]:
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                indexes = indexes + CATALOG_TRIGRAM_INDEXES
+            else:
+                logging.warning("pg_trgm isn't available, skipping the trigram indexes")
+            for suffix, definition in indexes:
+                cursor.execute(f"CREATE INDEX {quote_identifier(f'{new_table_name}_{suffix}')} ON {new_table} USING {definition}")
+            cursor.execute(f"ANALYZE {new_table}")
+            seconds['index'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            cursor.execute(f"ALTER TABLE {new_table} RENAME TO {table}")
+            for suffix in ['pkey'] + [suffix for suffix, _ in indexes]:
+                cursor.execute(
+                    f"ALTER INDEX {quote_identifier(f'{new_table_name}_{suffix}')} "
+                    f"RENAME TO {quote_identifier(f'{CATALOG_TABLE_NAME}_{suffix}')}"
+                )
+            seconds['swap'] = time.perf_counter() - start
+    report['seconds'] = {name: round(s, 6) for name, s in seconds.items()}
+    logging.info(f"Loaded {report['rows_loaded']} of {report['rows_read']} catalog rows into {CATALOG_TABLE_NAME}")
+    return report
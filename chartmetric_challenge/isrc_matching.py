@@ -0,0 +1,270 @@
+from collections import Counter, defaultdict
+from typing import Iterable, Iterator, NamedTuple
+import csv
+import functools
+import logging
+import os
+import re
+import time
+import unicodedata
+
+import pyarrow as pa
+import pyarrow.csv
+import pyarrow.parquet
+
+from chartmetric_challenge.constants import ARTISTS_FILENAME, INTERMEDIATE_FORMAT_CSV, MEDIA_ITEM_METADATA_FILENAME
+from chartmetric_challenge.paths import output_path, state_path
+from chartmetric_challenge.pg_copy import open_record_batches, pg_connect
+
+
+FEATURING_IN_BRACKETS = re.compile(r'[\(\[][^\)\]]*\b(?:feat|ft|featuring)\b[^\)\]]*[\)\]]')
+FEATURING_TO_END = re.compile(r'\b(?:feat|ft|featuring)\b.*$')
+BRACKETS = re.compile(r'[\(\[][^\)\]]*[\)\]]')
+VIDEO_TITLE_SEPARATOR = re.compile(r'\s+[-–—]\s*')
+NON_ALPHANUMERIC = re.compile(r'[^\w]+|_')
+ARTIST_SEPARATORS = re.compile(r'\s*(?:,|&|\+|\bx\b|\band\b|\bwith\b|\bfeat\b\.?|\bft\b\.?|\bfeaturing\b)\s*')
+
+MATCH_TITLE_AND_ARTIST = 'title_and_artist'
+MATCH_VIDEO_TITLE_AND_ARTIST = 'video_title_and_artist'
+MATCH_TITLE_ONLY = 'title_only'
+MATCH_FUZZY = 'fuzzy'
+
+
+class IsrcMatch(NamedTuple):
+    isrc: str
+    match_type: str
+    confidence: float
+
+
+@functools.lru_cache(maxsize=1_000_000)
+def normalize_title(title: str) -> str:
+    '''
+    Casefolds, strips accents, "feat." credits and punctuation, eg
+    "FEEL SOMETHING (feat. Marshmello)" -> "feel something".
+    '''
+    # ASCII has nothing to decompose, and most titles don't credit anyone
+    if not title.isascii():
+        title = unicodedata.normalize('NFKD', title)
+        title = ''.join(c for c in title if not unicodedata.combining(c))
+    title = title.casefold()
+    if 'ft' in title or 'feat' in title:
+        title = FEATURING_IN_BRACKETS.sub(' ', title)
+        title = FEATURING_TO_END.sub(' ', title)
+    return ' '.join(NON_ALPHANUMERIC.sub(' ', title).split())
+
+
+@functools.lru_cache(maxsize=1_000_000)
+def split_artists(artist: str) -> tuple[str, ...]:
+    '''
+    Normalized names of every artist credited in a string like
+    "Marshmello ft. Bastille" or "Doja Cat, The Weeknd".
+    '''
+    artist = unicodedata.normalize('NFKD', artist)
+    artist = ''.join(c for c in artist if not unicodedata.combining(c)).casefold()
+    names = (' '.join(NON_ALPHANUMERIC.sub(' ', a).split()) for a in ARTIST_SEPARATORS.split(artist))
+    return tuple(n for n in names if n)
+
+
+def split_video_title(primary_title: str) -> tuple[str | None, str]:
+    '''
+    YouTube music videos are usually titled "Artist - Track (Official Video)",
+    returns the artist part (if there is one) and the track with anything in
+    brackets removed.
+    '''
+    parts = VIDEO_TITLE_SEPARATOR.split(primary_title, maxsplit=1)
+    if len(parts) == 1:
+        return None, BRACKETS.sub(' ', primary_title)
+    return parts[0], BRACKETS.sub(' ', parts[1])
+
+
+def trigrams(value: str) -> set[str]:
+    padded = f'  {value} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class IsrcIndex:
+    '''
+    Hash index of a track catalog keyed on normalized (title, artist) with a
+    trigram index over each artist's titles as a fallback for near misses.
+
+    Fuzzy matching only considers the artist's titles, scores just the
+    max_candidates of them sharing the most trigrams with the query, and
+    ignores trigrams found in more than max_trigram_frequency of the artist's
+    titles, so a miss costs a bounded amount of work however big the catalog
+    is.
+    '''
+    def __init__(self, max_candidates: int = 20, max_trigram_frequency: int = 500, min_similarity: float = 0.6):
+        self._max_candidates = max_candidates
+        self._max_trigram_frequency = max_trigram_frequency
+        self._min_similarity = min_similarity
+        self._by_title_and_artist = {}
+        self._by_title = defaultdict(set)
+        self._titles_by_artist_trigram = defaultdict(list)
+
+    def __len__(self):
+        return len(self._by_title_and_artist)
+
+    def add(self, track: str, artist: str, isrc: str):
+        title = normalize_title(track)
+        if not title or not isrc:
+            return
+        for artist_name in split_artists(artist or ''):
+            key = (title, artist_name)
+            if key in self._by_title_and_artist:
+                continue
+            self._by_title_and_artist[key] = isrc
+            for trigram in trigrams(title):
+                self._titles_by_artist_trigram[(artist_name, trigram)].append(title)
+        self._by_title[title].add(isrc)
+
+    @classmethod
+    def from_catalog(cls, catalog_path: str, **kwargs) -> 'IsrcIndex':
+        '''
+        Builds the index from a CSV with track, artist and isrc columns such
+        as cm_track.csv.
+        '''
+        index = cls(**kwargs)
+        with open(catalog_path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                index.add(row['track'], row['artist'], row['isrc'])
+        return index
+
+    def match(self, secondary_title: str | None, primary_title: str | None, artist: str | None) -> IsrcMatch | None:
+        '''
+        Matches a media item to an ISRC, trying exact (hash) lookups first and
+        only falling back to fuzzy title matching when they all miss.
+        '''
+        video_artist, video_track = split_video_title(primary_title) if primary_title else (None, None)
+        artists = split_artists(artist) if artist else ()
+        video_artists = split_artists(video_artist) if video_artist else ()
+        titles = [
+            (normalize_title(t), match_type)
+            for t, match_type in [(secondary_title, MATCH_TITLE_AND_ARTIST), (video_track, MATCH_VIDEO_TITLE_AND_ARTIST)]
+            if t
+        ]
+
+        for artist_names, confidence in [(artists, 1.0), (video_artists, 0.9)]:
+            for title, match_type in titles:
+                for artist_name in artist_names:
+                    isrc = self._by_title_and_artist.get((title, artist_name))
+                    if isrc is not None:
+                        return IsrcMatch(isrc, match_type, confidence if match_type == MATCH_TITLE_AND_ARTIST else confidence - 0.05)
+
+        if not artists and not video_artists:
+            for title, _ in titles:
+                isrcs = self._by_title.get(title, ())
+                if len(isrcs) == 1:
+                    return IsrcMatch(next(iter(isrcs)), MATCH_TITLE_ONLY, 0.6)
+
+        return self._fuzzy_match(titles, set(artists) | set(video_artists))
+
+    def _fuzzy_match(self, titles: list[tuple[str, str]], artist_names: set[str]) -> IsrcMatch | None:
+        if not artist_names:
+            return None
+        best = None
+        for title, _ in titles:
+            query_trigrams = trigrams(title)
+            for artist_name in artist_names:
+                shared = Counter()
+                for trigram in query_trigrams:
+                    candidates = self._titles_by_artist_trigram.get((artist_name, trigram), ())
+                    if len(candidates) <= self._max_trigram_frequency:
+                        shared.update(candidates)
+                for candidate, shared_count in shared.most_common(self._max_candidates):
+                    similarity = shared_count / len(query_trigrams | trigrams(candidate))
+                    if similarity >= self._min_similarity and (best is None or similarity > best[0]):
+                        best = (similarity, self._by_title_and_artist[(candidate, artist_name)])
+        if best is None:
+            return None
+        return IsrcMatch(best[1], MATCH_FUZZY, round(0.8 * best[0], 3))
+
+
+def _read_output(output_directory: str, filename: str, intermediate_format: str) -> pa.Table:
+    path = output_path(output_directory, filename, intermediate_format)
+    if intermediate_format == INTERMEDIATE_FORMAT_CSV:
+        return pyarrow.csv.read_csv(path)
+    return open_record_batches(path, intermediate_format).read_all()
+
+
+def read_artist_names(
+    artist_ids: set[int],
+    output_directory: str,
+    intermediate_format: str = INTERMEDIATE_FORMAT_CSV,
+    state_directory: str | None = None,
+    pg_connection_string: str | None = None,
+) -> dict[int, str]:
+    '''
+    The names of artist_ids. An incremental convert only outputs the artists
+    it added, so names missing from output_directory are looked up in the
+    state's artist IDs and then the artists table.
+    '''
+    artists = _read_output(output_directory, ARTISTS_FILENAME, intermediate_format).select(['id', 'name'])
+    artist_names = dict(zip(*artists.to_pydict().values()))
+    missing_ids = artist_ids - artist_names.keys()
+    if missing_ids and state_directory is not None and os.path.exists(state_path(state_directory, 'artists')):
+        artists = pyarrow.parquet.read_table(state_path(state_directory, 'artists'), columns=['id', 'name'])
+        artist_names.update((i, n) for i, n in zip(*artists.to_pydict().values()) if i in missing_ids)
+        missing_ids = artist_ids - artist_names.keys()
+    if missing_ids and pg_connection_string is not None:
+        connection = pg_connect(pg_connection_string)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT id, name FROM artists WHERE id = ANY(%s)', (sorted(missing_ids),))
+                artist_names.update(cursor.fetchall())
+        finally:
+            connection.close()
+    return artist_names
+
+
+def read_media_items(
+    output_directory: str,
+    intermediate_format: str = INTERMEDIATE_FORMAT_CSV,
+    state_directory: str | None = None,
+    pg_connection_string: str | None = None,
+) -> list[dict]:
+    '''
+    The latest titles and artist name of every media item in a convert's
+    output_directory, see read_artist_names for where the names come from.
+    '''
+    metadata = _read_output(output_directory, MEDIA_ITEM_METADATA_FILENAME, intermediate_format)
+    latest = {}
+    for row in metadata.sort_by([('media_item_id', 'ascending'), ('ingest_timestamp', 'ascending')]).to_pylist():
+        latest[row['media_item_id']] = row
+    artist_ids = {row['artist_id'] for row in latest.values() if row['artist_id'] is not None}
+    artist_names = read_artist_names(artist_ids, output_directory, intermediate_format, state_directory, pg_connection_string)
+    return [
+        {
+            'media_item_id': row['media_item_id'],
+            'primary_title': row['primary_title'],
+            'secondary_title': row['secondary_title'],
+            'artist_name': artist_names.get(row['artist_id']),
+        }
+        for row in latest.values()
+    ]
+
+
+def match_media_items(index: IsrcIndex, media_items: Iterable[dict]) -> Iterator[dict]:
+    '''
+    Yields a media_item_isrc row for every media item that matched. Each item
+    needs a media_item_id, primary_title, secondary_title and artist_name.
+    '''
+    start = time.perf_counter()
+    item_count = 0
+    match_count = 0
+    for item in media_items:
+        item_count += 1
+        match = index.match(item['secondary_title'], item['primary_title'], item['artist_name'])
+        if match is not None:
+            match_count += 1
+            yield {
+                'media_item_id': item['media_item_id'],
+                'isrc': match.isrc,
+                'match_type': match.match_type,
+                'confidence': match.confidence,
+            }
+    elapsed = time.perf_counter() - start
+    logging.info(
+        f"Matched {match_count} of {item_count} media items in {elapsed:.3f}s "
+        f"({match_count / elapsed if elapsed else 0:.0f} matches/sec, "
+        f"{item_count / elapsed if elapsed else 0:.0f} media items/sec)"
+    )
@@ -0,0 +1,129 @@
+from typing import Iterator
+import json
+
+import pyarrow as pa
+
+from chartmetric_challenge.constants import JSON_FORMAT_ARRAY, JSON_FORMAT_NEWLINE_DELIMITED
+
+
+def iter_json_records(path: str, json_format: str = JSON_FORMAT_ARRAY, read_size: int = 1 << 20) -> Iterator[dict]:
+    '''
+    Yields the records of a JSON file one at a time without reading the whole
+    file into memory. json_format is either a single top level array of
+    records or newline delimited records.
+    '''
+    if json_format == JSON_FORMAT_NEWLINE_DELIMITED:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif json_format == JSON_FORMAT_ARRAY:
+        yield from _iter_json_array(path, read_size)
+    else:
+        raise ValueError(f"json_format {json_format} is not supported")
+
+
+def _iter_json_array(path: str, read_size: int) -> Iterator[dict]:
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as f:
+        buffer = ''
+        position = 0
+        started = False
+        eof = False
+        while True:
+            # skip over the separators between records
+            while position < len(buffer) and (buffer[position].isspace() or buffer[position] in ',['):
+                if buffer[position] == '[':
+                    if started:
+                        raise ValueError(f"{path} is not a JSON array of records")
+                    started = True
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            if position < len(buffer) and not started:
+                raise ValueError(f"{path} is not a JSON array of records")
+
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # either the buffer ends part way through a record or the
+                # file is malformed, read more to find out
+                if eof:
+                    if buffer[position:].strip():
+                        raise ValueError(f"{path} ends with an incomplete record")
+                    raise ValueError(f"{path} is missing the closing ]")
+                buffer = buffer[position:]
+                position = 0
+                chunk = f.read(read_size)
+                eof = chunk == ''
+                buffer += chunk
+                continue
+
+            yield record
+            position = end
+
+
+def string_schema(schema: pa.Schema) -> pa.Schema:
+    return pa.schema([(field.name, pa.string()) for field in schema])
+
+
+def _json_string(value) -> str | None:
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def _string_record_batch(records: list[dict], schema: pa.Schema) -> pa.RecordBatch:
+    try:
+        batch = pa.RecordBatch.from_pylist(records, schema=schema)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        # only a batch with a value that doesn't fit the schema pays for
+        # converting value by value, the bad values are kept as JSON
+        return pa.RecordBatch.from_arrays(
+            [pa.array([_json_string(r.get(field.name)) for r in records], pa.string()) for field in schema],
+            schema=string_schema(schema),
+        )
+    return pa.RecordBatch.from_arrays([c.cast(pa.string()) for c in batch.columns], schema=string_schema(schema))
+
+
+def iter_record_batches(
+    path: str,
+    schema: pa.Schema,
+    json_format: str = JSON_FORMAT_ARRAY,
+    batch_size: int = 50_000,
+    strict: bool = True,
+) -> Iterator[pa.RecordBatch]:
+    '''
+    Groups the records of a JSON file into Arrow record batches of at most
+    batch_size rows. Fields missing from the schema are dropped.
+
+    A value which doesn't fit the schema raises, unless strict is False in
+    which case every field is returned as a string (see string_schema) so
+    the bad values can be validated later on.
+    '''
+    to_record_batch = pa.RecordBatch.from_pylist if strict else _string_record_batch
+    records = []
+    for record in iter_json_records(path, json_format):
+        records.append(record)
+        if len(records) >= batch_size:
+            yield to_record_batch(records, schema=schema)
+            records = []
+    if records:
+        yield to_record_batch(records, schema=schema)
+
+
+def record_batch_reader(
+    path: str,
+    schema: pa.Schema,
+    json_format: str = JSON_FORMAT_ARRAY,
+    batch_size: int = 50_000,
+    strict: bool = True,
+) -> pa.RecordBatchReader:
+    '''
+    Same as iter_record_batches but wrapped in a reader so it can be scanned
+    directly by DuckDB.
+    '''
+    return pa.RecordBatchReader.from_batches(
+        schema if strict else string_schema(schema),
+        iter_record_batches(path, schema, json_format, batch_size, strict),
+    )
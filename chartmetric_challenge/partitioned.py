@@ -0,0 +1,81 @@
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+
+from chartmetric_challenge.constants import INTERMEDIATE_FORMAT_PARQUET, SHARD_BY_PLAYLIST
+
+
+def _convert_shard(ingestor_class: type, granularity: str, shard_source_directory: str, ids_directory: str, shard_output_directory: str) -> dict:
+    start = time.perf_counter()
+    ingestor = ingestor_class(granularity, None, shard_output_directory, None, intermediate_format=INTERMEDIATE_FORMAT_PARQUET)
+    rows = ingestor.convert_shard(shard_source_directory, ids_directory)
+    ingestor.close()
+    return {
+        'shard': os.path.basename(shard_source_directory),
+        'rows': rows,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def ingest_partitioned(
+    ingestor_class: type,
+    granularity: str,
+    source_path: str,
+    output_directory: str,
+    pg_connection_string: str | None,
+    num_shards: int = 4,
+    shard_by: str = SHARD_BY_PLAYLIST,
+    max_workers: int | None = None,
+    **ingestor_kwargs,
+) -> list[dict]:
+    '''
+    Same result as ingestor_class(...).ingest() but the log tables are built
+    by a pool of processes, each handling one shard of the source rows.
+
+    The IDs are assigned once up front and shared with every shard so they
+    stay globally consistent. Each shard then reduces its rows to the latest
+    row per ID per interval, and the change detection runs once over the
+    combined (much smaller) shard output. Skips the Postgres load if
+    pg_connection_string is None. With a state_directory in ingestor_kwargs
+    the run is incremental like main.py's, and its state is only committed
+    once the output has been loaded.
+
+    Returns the timings for each shard.
+    '''
+    ingestor = ingestor_class(granularity, source_path, output_directory, pg_connection_string, **ingestor_kwargs)
+    logging.info(f"Starting load")
+    df = ingestor.load()
+
+    os.makedirs(output_directory, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix='shards_', dir=output_directory) as shard_directory:
+        logging.info(f"Starting split into {num_shards} shards by {shard_by}")
+        shard_source_directories = ingestor.write_shards(df, shard_directory, num_shards, shard_by)
+        ids_directory = os.path.join(shard_directory, 'ids')
+        shard_output_directories = [
+            os.path.join(shard_directory, 'output', os.path.basename(d)) for d in shard_source_directories
+        ]
+
+        logging.info(f"Starting conversion of {len(shard_source_directories)} shards")
+        # spawn rather than fork, forking a process that has DuckDB threads
+        # running isn't safe
+        with ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [
+                executor.submit(_convert_shard, ingestor_class, granularity, source_directory, ids_directory, shard_output_directory)
+                for source_directory, shard_output_directory in zip(shard_source_directories, shard_output_directories)
+            ]
+            shard_timings = [f.result() for f in futures]
+        for timing in shard_timings:
+            logging.info(f"Converted {timing['shard']} ({timing['rows']} rows) in {timing['seconds']:.3f}s")
+
+        logging.info(f"Starting merge of shard output")
+        ingestor.merge_shards(shard_output_directories)
+
+    if pg_connection_string is not None:
+        logging.info(f"Starting write to postgres")
+        ingestor.csvs_to_pg()
+    ingestor.commit_state()
+    ingestor.close()
+    return shard_timings
@@ -0,0 +1,32 @@
+import os
+
+
+def output_path(output_directory: str, filename: str, intermediate_format: str) -> str:
+    return os.path.join(output_directory, f'{os.path.splitext(filename)[0]}.{intermediate_format}')
+
+
+def granularity_output_path(path: str, granularity: str) -> str:
+    '''
+    Where the extra granularities of a log table are written, eg
+    playlist_positions_log_hour.csv next to playlist_positions_log.csv.
+    '''
+    root, extension = os.path.splitext(path)
+    return f'{root}_{granularity}{extension}'
+
+
+def superseded_output_path(path: str) -> str:
+    '''
+    Where the keys of the earlier log rows a log table replaces are written,
+    eg playlist_positions_log_superseded.csv next to
+    playlist_positions_log.csv, see PgIngestor._insert_log_rows.
+    '''
+    root, extension = os.path.splitext(path)
+    return f'{root}_superseded{extension}'
+
+
+def state_path(state_directory: str, name: str) -> str:
+    '''
+    Where the committed state called name (eg an ID dictionary like artists)
+    is stored in state_directory.
+    '''
+    return os.path.join(state_directory, f'{name}.parquet')
@@ -0,0 +1,400 @@
+from typing import Iterator, TextIO
+import csv
+import datetime
+import io
+import logging
+import os
+import uuid
+
+import psycopg2
+import psycopg2.extensions
+import pyarrow as pa
+import pyarrow.csv
+import pyarrow.parquet
+
+from chartmetric_challenge.constants import INTERMEDIATE_FORMAT_ARROW, INTERMEDIATE_FORMAT_CSV, INTERMEDIATE_FORMAT_PARQUET
+
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def pg_connect(pg_connection_string: str) -> psycopg2.extensions.connection:
+    '''
+    Opens a new connection, the caller closes it. Every loader gets its own
+    so concurrent loads don't wait on (or fail for) a shared one.
+    '''
+    connection = psycopg2.connect(pg_connection_string)
+    # the files are sent as raw bytes so Postgres has to read them as UTF-8
+    connection.set_client_encoding('UTF8')
+    return connection
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def copy_csv_sql(table_name: str, columns: list[str], header: bool) -> str:
+    return (
+        f"COPY {quote_identifier(table_name)} ({', '.join(quote_identifier(c) for c in columns)}) "
+        f"FROM STDIN WITH (FORMAT csv, HEADER {'true' if header else 'false'})"
+    )
+
+
+def insert_select_sql(staging_table_name: str, table_name: str, columns: list[str]) -> str:
+    column_list = ', '.join(quote_identifier(c) for c in columns)
+    return (
+        f"INSERT INTO {quote_identifier(table_name)} AS target ({column_list}) "
+        f"SELECT {column_list} FROM {quote_identifier(staging_table_name)}"
+    )
+
+
+def upsert_sql(
+    staging_table_name: str,
+    table_name: str,
+    columns: list[str],
+    conflict_columns: list[str],
+    update: bool,
+    newer_column: str | None = None,
+) -> str:
+    '''
+    Merges the staging table into table_name. Rows whose conflict_columns
+    already exist are skipped, or if update is True have their other columns
+    updated, but only when a value actually changed so re-running the same
+    load doesn't rewrite any rows. With newer_column a row is only updated
+    by one with a greater newer_column, so loading an older file can't roll
+    it back.
+    '''
+    sql = (
+        f"{insert_select_sql(staging_table_name, table_name, columns)} "
+        f"ON CONFLICT ({', '.join(quote_identifier(c) for c in conflict_columns)}) "
+    )
+    update_columns = [c for c in columns if c not in conflict_columns]
+    if not update or not update_columns:
+        return sql + "DO NOTHING"
+    sql += (
+        f"DO UPDATE SET {', '.join(f'{quote_identifier(c)} = EXCLUDED.{quote_identifier(c)}' for c in update_columns)} "
+        f"WHERE ({', '.join(f'target.{quote_identifier(c)}' for c in update_columns)}) "
+        f"IS DISTINCT FROM ({', '.join(f'EXCLUDED.{quote_identifier(c)}' for c in update_columns)})"
+    )
+    if newer_column is not None:
+        sql += f" AND target.{quote_identifier(newer_column)} < EXCLUDED.{quote_identifier(newer_column)}"
+    return sql
+
+
+def delete_using_sql(staging_table_name: str, table_name: str, columns: list[str]) -> str:
+    '''
+    Deletes the rows of table_name equal to a row of the staging table on
+    all of columns.
+    '''
+    return (
+        f"DELETE FROM {quote_identifier(table_name)} AS target "
+        f"USING {quote_identifier(staging_table_name)} AS staging "
+        f"WHERE {' AND '.join(f'target.{quote_identifier(c)} = staging.{quote_identifier(c)}' for c in columns)}"
+    )
+
+
+def month_partition_name(table_name: str, month_start: datetime.datetime) -> str:
+    return f'{table_name}_{month_start:%Y_%m}'
+
+
+def create_month_partition_sql(table_name: str, month_start: datetime.datetime) -> str:
+    '''
+    Creates the partition of a table range partitioned by ingest_timestamp
+    (see postgres_init_partitioned) holding month_start's month.
+    '''
+    month_start = month_start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    month_end = (month_start + datetime.timedelta(days=32)).replace(day=1)
+    return (
+        f"CREATE TABLE IF NOT EXISTS {quote_identifier(month_partition_name(table_name, month_start))} "
+        f"PARTITION OF {quote_identifier(table_name)} "
+        f"FOR VALUES FROM ('{month_start.isoformat(sep=' ')}') TO ('{month_end.isoformat(sep=' ')}')"
+    )
+
+
+def read_csv_header(path: str) -> list[str]:
+    with open(path, newline='', encoding='utf-8') as f:
+        return next(csv.reader(f))
+
+
+def iter_projected_chunks(f: TextIO, columns: list[str], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    '''
+    Reads a CSV with a header and yields UTF-8 CSV (without a header) of only
+    the requested columns, in chunks of roughly chunk_size characters.
+    '''
+    reader = csv.reader(f)
+    header = next(reader)
+    missing = [c for c in columns if c not in header]
+    if missing:
+        raise ValueError(f"columns {missing} are not in the CSV header {header}")
+    indexes = [header.index(c) for c in columns]
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for row in reader:
+        writer.writerow([row[i] for i in indexes])
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def open_record_batches(path: str, intermediate_format: str, batch_size: int = 65_536) -> pa.RecordBatchReader:
+    '''
+    Reads a parquet or Arrow IPC file back as record batches. Arrow files are
+    memory mapped so the batches point straight at the file.
+    '''
+    if intermediate_format == INTERMEDIATE_FORMAT_PARQUET:
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        return pa.RecordBatchReader.from_batches(
+            parquet_file.schema_arrow,
+            parquet_file.iter_batches(batch_size=batch_size),
+        )
+    elif intermediate_format == INTERMEDIATE_FORMAT_ARROW:
+        ipc_file = pa.ipc.open_file(pa.memory_map(path))
+        return pa.RecordBatchReader.from_batches(
+            ipc_file.schema,
+            (ipc_file.get_batch(i) for i in range(ipc_file.num_record_batches)),
+        )
+    else:
+        raise ValueError(f"intermediate_format {intermediate_format} is not supported")
+
+
+def iter_csv_chunks(batches: pa.RecordBatchReader, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    '''
+    Encodes record batches as CSV (without a header) in chunks of roughly
+    chunk_size bytes, nulls are written as unquoted empty values which COPY
+    reads as NULL.
+    '''
+    buffer = io.BytesIO()
+    write_options = pyarrow.csv.WriteOptions(include_header=False)
+    for batch in batches:
+        pyarrow.csv.write_csv(batch, buffer, write_options)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class PgCopyLoader:
+    '''
+    Streams CSV files into Postgres with COPY FROM STDIN. Every loader opens
+    its own connection, and all copies made through it share one
+    transaction, which is committed when the loader exits without an error
+    and rolled back otherwise. The connection is closed on exit.
+
+        with PgCopyLoader(pg_connection_string) as loader:
+            loader.copy_csv('playlists.csv', 'playlists')
+            loader.copy_columnar('artists.parquet', 'artists', 'parquet')
+
+    Passing conflict_columns to a copy makes it an upsert: the file is
+    COPYed into an unlogged staging table which is then merged into the
+    table in one statement (see upsert_sql), so loading the same file twice
+    is a no-op rather than a unique violation.
+    '''
+    def __init__(self, pg_connection_string: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self._pg_connection_string = pg_connection_string
+        self._chunk_size = chunk_size
+        self._connection = None
+
+    def __enter__(self):
+        self._connection = pg_connect(self._pg_connection_string)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self._connection.commit()
+            else:
+                self._connection.rollback()
+        finally:
+            self._connection.close()
+            self._connection = None
+
+    def copy_csv(
+        self,
+        path: str,
+        table_name: str,
+        rename: dict[str, str] | None = None,
+        columns: list[str] | None = None,
+        conflict_columns: list[str] | None = None,
+        update: bool = False,
+        newer_column: str | None = None,
+    ) -> int:
+        '''
+        COPY a CSV with a header row into table_name. rename maps CSV column
+        names to table column names. If columns is given only those CSV
+        columns are loaded, which means the rows have to be rewritten in
+        Python, otherwise the file is streamed to Postgres as is.
+        conflict_columns, update and newer_column make it an upsert, see
+        upsert_sql. Returns the number of rows copied.
+        '''
+        rename = rename or {}
+        row_count = 0
+        with self._connection.cursor() as cursor:
+            if columns is None:
+                table_columns = [rename.get(c, c) for c in read_csv_header(path)]
+                copy_table_name = self._copy_target(cursor, table_name, conflict_columns)
+                sql = copy_csv_sql(copy_table_name, table_columns, header=True)
+                with open(path, 'rb') as f:
+                    cursor.copy_expert(sql, f, size=self._chunk_size)
+                row_count = cursor.rowcount
+            else:
+                table_columns = [rename.get(c, c) for c in columns]
+                copy_table_name = self._copy_target(cursor, table_name, conflict_columns)
+                sql = copy_csv_sql(copy_table_name, table_columns, header=False)
+                with open(path, newline='', encoding='utf-8') as f:
+                    for chunk in iter_projected_chunks(f, columns, self._chunk_size):
+                        cursor.copy_expert(sql, io.BytesIO(chunk), size=self._chunk_size)
+                        row_count += cursor.rowcount
+            logging.info(f"Copied {os.path.getsize(path)} bytes from {path} into {copy_table_name}")
+            if conflict_columns:
+                self._merge(cursor, copy_table_name, table_name, table_columns, conflict_columns, update, newer_column)
+        return row_count
+
+    def copy_columnar(
+        self,
+        path: str,
+        table_name: str,
+        intermediate_format: str,
+        rename: dict[str, str] | None = None,
+        conflict_columns: list[str] | None = None,
+        update: bool = False,
+        newer_column: str | None = None,
+    ) -> int:
+        '''
+        COPY a parquet or Arrow IPC file into table_name. rename maps file
+        column names to table column names. conflict_columns, update and
+        newer_column make it an upsert, see upsert_sql. Returns the number of
+        rows copied.
+        '''
+        rename = rename or {}
+        row_count = 0
+        batches = open_record_batches(path, intermediate_format)
+        table_columns = [rename.get(c, c) for c in batches.schema.names]
+        with self._connection.cursor() as cursor:
+            copy_table_name = self._copy_target(cursor, table_name, conflict_columns)
+            sql = copy_csv_sql(copy_table_name, table_columns, header=False)
+            for chunk in iter_csv_chunks(batches, self._chunk_size):
+                cursor.copy_expert(sql, io.BytesIO(chunk), size=self._chunk_size)
+                row_count += cursor.rowcount
+            logging.info(f"Copied {os.path.getsize(path)} bytes from {path} into {copy_table_name}")
+            if conflict_columns:
+                self._merge(cursor, copy_table_name, table_name, table_columns, conflict_columns, update, newer_column)
+        return row_count
+
+    def delete_rows(self, path: str, table_names: list[str], intermediate_format: str) -> int:
+        '''
+        Deletes the rows of each of table_names which equal a row of the file
+        at path on all of the file's columns, eg the log rows a later ingest
+        superseded. The file is COPYed into an unlogged staging table first.
+        Returns the number of rows deleted.
+        '''
+        if intermediate_format == INTERMEDIATE_FORMAT_CSV:
+            columns = read_csv_header(path)
+        else:
+            columns = open_record_batches(path, intermediate_format).schema.names
+        staging_table_name = f'{table_names[0]}_delete_{uuid.uuid4().hex[:8]}'
+        column_list = ', '.join(quote_identifier(c) for c in columns)
+        with self._connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE UNLOGGED TABLE {quote_identifier(staging_table_name)} AS "
+                f"SELECT {column_list} FROM {quote_identifier(table_names[0])} WITH NO DATA"
+            )
+        if intermediate_format == INTERMEDIATE_FORMAT_CSV:
+            self.copy_csv(path, staging_table_name)
+        else:
+            self.copy_columnar(path, staging_table_name, intermediate_format)
+        row_count = 0
+        with self._connection.cursor() as cursor:
+            for table_name in table_names:
+                cursor.execute(delete_using_sql(staging_table_name, table_name, columns))
+                logging.info(f"Deleted {cursor.rowcount} rows from {table_name} matching {path}")
+                row_count += cursor.rowcount
+            cursor.execute(f"DROP TABLE {quote_identifier(staging_table_name)}")
+        return row_count
+
+    def partitioned_table_names(self) -> set[str]:
+        with self._connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT c.relname FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+                "WHERE pg_table_is_visible(c.oid)"
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+    def create_month_partitions(self, table_name: str, month_starts: list[datetime.datetime]) -> list[str]:
+        '''
+        Creates any of the monthly partitions of table_name which don't exist
+        yet and returns their names. Creating a partition locks the whole
+        table, so this should be committed before a long load.
+        '''
+        partition_names = []
+        with self._connection.cursor() as cursor:
+            for month_start in sorted(set(month_starts)):
+                cursor.execute(create_month_partition_sql(table_name, month_start))
+                partition_names.append(month_partition_name(table_name, month_start))
+        logging.info(f"Created or found partitions {partition_names} of {table_name}")
+        return partition_names
+
+    def cursor(self):
+        '''
+        A cursor on the loader's connection, for statements that are part of
+        the same transaction as the copies.
+        '''
+        return self._connection.cursor()
+
+    def insert_from(
+        self,
+        staging_table_name: str,
+        table_name: str,
+        columns: list[str],
+        conflict_columns: list[str] | None = None,
+        update: bool = False,
+        newer_column: str | None = None,
+    ) -> int:
+        '''
+        Inserts the rows of staging_table_name into table_name, an upsert if
+        conflict_columns are given (see upsert_sql). Returns the number of
+        rows inserted or updated.
+        '''
+        if conflict_columns:
+            sql = upsert_sql(staging_table_name, table_name, columns, conflict_columns, update, newer_column)
+        else:
+            sql = insert_select_sql(staging_table_name, table_name, columns)
+        with self._connection.cursor() as cursor:
+            cursor.execute(sql)
+            logging.info(f"Merged {cursor.rowcount} rows from {staging_table_name} into {table_name}")
+            return cursor.rowcount
+
+    def _copy_target(self, cursor, table_name: str, conflict_columns: list[str] | None) -> str:
+        '''
+        The table to COPY into, a new staging table for upserts. Its name is
+        unique so concurrent loads into the same table don't share it.
+        '''
+        if not conflict_columns:
+            return table_name
+        staging_table_name = f'{table_name}_staging_{uuid.uuid4().hex[:8]}'
+        # unlogged since the rows only live until the merge, LIKE copies the
+        # column types but not the constraints. Creating it is part of the
+        # transaction, so a failed load doesn't leave it behind either.
+        cursor.execute(
+            f"CREATE UNLOGGED TABLE {quote_identifier(staging_table_name)} "
+            f"(LIKE {quote_identifier(table_name)})"
+        )
+        return staging_table_name
+
+    def _merge(
+        self,
+        cursor,
+        staging_table_name: str,
+        table_name: str,
+        columns: list[str],
+        conflict_columns: list[str],
+        update: bool,
+        newer_column: str | None,
+    ):
+        self.insert_from(staging_table_name, table_name, columns, conflict_columns, update, newer_column)
+        cursor.execute(f"DROP TABLE {quote_identifier(staging_table_name)}")
@@ -0,0 +1,1196 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+import concurrent.futures
+import datetime
+import logging
+import os
+import sys
+
+import duckdb
+import pyarrow as pa
+
+if TYPE_CHECKING:
+    # only load_mode "pandas" needs pandas, and it's slow to import
+    import pandas as pd
+
+from chartmetric_challenge.constants import (
+    LOAD_MODE_PANDAS,
+    LOAD_MODE_STREAM,
+    LOAD_MODE_DUCKDB,
+    JSON_FORMAT_ARRAY,
+    JSON_FORMAT_NEWLINE_DELIMITED,
+    JSON_FORMATS,
+    INTERMEDIATE_FORMAT_CSV,
+    INTERMEDIATE_FORMAT_PARQUET,
+    INTERMEDIATE_FORMAT_ARROW,
+    INTERMEDIATE_FORMATS,
+    SHARD_BY_PLAYLIST,
+    SHARD_BY_DATE,
+    PG_LOAD_MODE_APPEND,
+    PG_LOAD_MODE_UPSERT,
+    PG_LOAD_MODES,
+    ARTISTS_FILENAME,
+    MEDIA_ITEMS_FILENAME,
+    USERS_FILENAME,
+    MEDIA_ITEM_METADATA_FILENAME,
+    PLAYLIST_METADATA_LOG_FILENAME,
+    PLAYLIST_PLAYS_LOG_FILENAME,
+    PLAYLIST_POSITIONS_LOG_FILENAME,
+    PLAYLISTS_FILENAME,
+    PLAYLIST_METADATA_CURRENT_FILENAME,
+    PLAYLIST_PLAYS_CURRENT_FILENAME,
+    PLAYLIST_POSITIONS_CURRENT_FILENAME,
+    MEDIA_ITEM_METADATA_CURRENT_FILENAME,
+    RUN_REPORT_FILENAME,
+    QUERY_PROFILES_DIRECTORY,
+    DEAD_LETTER_FILENAME,
+    GRANULARITIES,
+    GRANULARITY_DAY,
+    GRANULARITY_WEEK,
+    GRANULARITY_MONTH,
+)
+from chartmetric_challenge.artist_resolution import ArtistResolver
+from chartmetric_challenge.duckdb_connection import connect
+from chartmetric_challenge.ingest_state import IngestState, sql_string
+from chartmetric_challenge.json_stream import record_batch_reader
+from chartmetric_challenge.paths import granularity_output_path, output_path, superseded_output_path
+from chartmetric_challenge.pg_copy import DEFAULT_CHUNK_SIZE, PgCopyLoader, open_record_batches
+from chartmetric_challenge.profiling import Profiler
+
+
+# the columns of a source record the conversion works with, a source maps
+# its own fields onto these (see PgIngestor.COLUMN_MAPPING). The IDs are the
+# source's own, eg a YouTube video ID for media_item_id.
+SOURCE_COLUMN_TYPES = {
+    'playlist_id': 'VARCHAR',
+    'playlist_name': 'VARCHAR',
+    'playlist_cover_url': 'VARCHAR',
+    'user_id': 'VARCHAR',
+    'plays': 'BIGINT',
+    'num_media_items': 'BIGINT',
+    'timestp': 'VARCHAR',
+    'media_item_id': 'VARCHAR',
+    'primary_title': 'VARCHAR',
+    'artist_name': 'VARCHAR',
+    'media_cover_url': 'VARCHAR',
+    'secondary_title': 'VARCHAR',
+    'position': 'BIGINT',
+}
+# records missing any of these can't be converted, the rest are nullable
+REQUIRED_COLUMN_NAMES = ['playlist_id', 'media_item_id', 'timestp']
+ID_TABLE_FILENAMES = {
+    'playlists': PLAYLISTS_FILENAME,
+    'users': USERS_FILENAME,
+    'media_items': MEDIA_ITEMS_FILENAME,
+    'artists': ARTISTS_FILENAME,
+}
+ID_TABLE_NAMES = list(ID_TABLE_FILENAMES)
+LOG_TABLE_FILENAMES = {
+    'playlist_metadata_log': PLAYLIST_METADATA_LOG_FILENAME,
+    'playlist_plays_log': PLAYLIST_PLAYS_LOG_FILENAME,
+    'playlist_positions_log': PLAYLIST_POSITIONS_LOG_FILENAME,
+    'media_item_metadata_log': MEDIA_ITEM_METADATA_FILENAME,
+}
+# the latest row per ID of each log table
+LOG_TABLE_CURRENT_TABLE_NAMES = {
+    'playlist_metadata_log': 'playlist_metadata_current',
+    'playlist_plays_log': 'playlist_plays_current',
+    'playlist_positions_log': 'playlist_positions_current',
+    'media_item_metadata_log': 'media_item_metadata_current',
+}
+CURRENT_TABLE_FILENAMES = {
+    'playlist_metadata_current': PLAYLIST_METADATA_CURRENT_FILENAME,
+    'playlist_plays_current': PLAYLIST_PLAYS_CURRENT_FILENAME,
+    'playlist_positions_current': PLAYLIST_POSITIONS_CURRENT_FILENAME,
+    'media_item_metadata_current': MEDIA_ITEM_METADATA_CURRENT_FILENAME,
+}
+# the ID columns and the other columns (with their types) of each log table,
+# which keeps a row per ID whenever the other columns change
+LOG_TABLE_COLUMNS = {
+    'playlist_metadata_log': (
+        ['playlist_id'],
+        {'playlist_name': 'VARCHAR', 'cover_url': 'VARCHAR', 'user_id': 'BIGINT', 'num_media_items': 'INT'},
+    ),
+    'playlist_plays_log': (['playlist_id'], {'plays': 'BIGINT'}),
+    'playlist_positions_log': (['playlist_id', 'media_item_id'], {'position': 'INT'}),
+    # NOTE Turns out this is 1:1 with media_items in this dataset,
+    # I'm not going to redo it but it would make queries simpler if I did
+    'media_item_metadata_log': (
+        ['media_item_id'],
+        {'primary_title': 'VARCHAR', 'secondary_title': 'VARCHAR', 'artist_id': 'BIGINT', 'media_cover_url': 'VARCHAR'},
+    ),
+}
+
+
+def row_digest_column_name(table_name: str) -> str:
+    return f'{table_name}_digest'
+
+
+def digest_sql(values: list[str]) -> str:
+    '''
+    The lower 64 bits of the MD5 of values. Unlike DuckDB's hash() MD5
+    doesn't change between DuckDB versions, so digests kept in the state
+    stay comparable. Each value is written as its length and text, or - for
+    NULL, so different values can't run together into the same string.
+    '''
+    texts = [f'CAST({v} AS VARCHAR)' for v in values]
+    parts = [f"coalesce(length({t}) || ':' || {t}, '-')" for t in texts]
+    return f"md5_number_lower(concat({', '.join(parts)}))"
+
+
+def row_digest_sql(table_name: str) -> str:
+    '''
+    The digest (see digest_sql) of the columns of the log table_name that
+    change detection compares. The columns are cast to the log table's
+    types first, so the digest of a source row equals the digest of the
+    same row read back from the log table.
+    '''
+    _, other_column_types = LOG_TABLE_COLUMNS[table_name]
+    return digest_sql([f'CAST({c} AS {t})' for c, t in other_column_types.items()])
+
+
+def reduction_granularity(granularities: list[str]) -> str:
+    '''
+    The coarsest granularity whose intervals each fall inside a single
+    interval of every one of granularities.
+    '''
+    finest_granularity = min(granularities, key=GRANULARITIES.index)
+    # weeks don't fit inside months but days fit inside both
+    if finest_granularity == GRANULARITY_WEEK and GRANULARITY_MONTH in granularities:
+        return GRANULARITY_DAY
+    return finest_granularity
+
+
+def is_dataframe(df) -> bool:
+    # a DataFrame can't exist unless something already imported pandas
+    return 'pandas' in sys.modules and isinstance(df, sys.modules['pandas'].DataFrame)
+
+
+# NOTE could separate convertion from ingestion
+class PgIngestor:
+    '''
+    Given a JSON file of playlist data, convert it to CSVs and ingest them
+    into the specified Postgres database. The conversion is the same for
+    every source, a subclass only declares what its records look like:
+
+        class SpotifyPlaylistPgIngestor(PgIngestor):
+            SOURCE_NAME = ORG_SPOTIFY
+            SOURCE_SCHEMA = pa.schema([('playlist_uri', pa.string()), ('track_uri', pa.string()), ...])
+            COLUMN_MAPPING = {'playlist_id': 'playlist_uri', 'media_item_id': 'track_uri', ...}
+
+    SOURCE_NAME is the source's value in the SOURCE enum, SOURCE_SCHEMA the
+    fields of a source record (load_mode "stream" and "duckdb" parse them with
+    it) and COLUMN_MAPPING maps every column of SOURCE_COLUMN_TYPES to the
+    source field it's read from, or None if the source doesn't have it.
+    The columns are those of a playlist, so only playlist sources fit.
+
+    granularity is the interval ("hour", "day", "week" or "month") the log
+    tables keep the latest row of, the same log tables at each of
+    extra_granularities are written alongside them (see
+    granularity_output_path) but aren't loaded into Postgres.
+
+    load_mode controls how the source file is read: "pandas" reads the whole
+    file into a DataFrame, "stream" parses it incrementally into Arrow record
+    batches of batch_size rows and "duckdb" lets DuckDB scan the file itself.
+    json_format is either "array" or "newline_delimited".
+
+    The CSVs are loaded with COPY over a single connection in one transaction,
+    copy_chunk_size is how many bytes are sent to Postgres at a time. With a
+    pg_max_concurrency over 1 the ID tables are instead loaded at once over up
+    to that many connections, then each log table with its current table,
+    see csvs_to_pg for what that gives up.
+
+    Alongside each log table a *_current table (eg playlist_positions_current)
+    with the latest row per ID is written and upserted into Postgres, a row
+    is only replaced by a later one, so dashboards can look up the latest
+    state by primary key rather than searching the log for it.
+
+    If state_directory is set the ingest is incremental: IDs carry on from the
+    previous run, change detection starts from the last row the previous run
+    wrote and only records newer than the previous run's latest timestamp are
+    processed. The output CSVs then only contain new rows.
+
+    intermediate_format picks the format of the converted files: "csv",
+    "parquet" or "arrow" (Arrow IPC). The columnar formats keep their types
+    and are compressed with zstd.
+
+    Each ingestor has its own DuckDB connection so several can run at once in
+    the same process. duckdb_database can be a file to keep the working
+    tables on disk, the other duckdb_ options set DuckDB's memory_limit,
+    threads and temp_directory (where it spills once over the memory limit).
+    With a file, enriched_df is also materialized in it and the source rows
+    dropped once it is, so together with load_mode "duckdb" and a
+    memory_limit the convert's memory use stays bounded however big the
+    source is.
+
+    With canonicalize_artists, spellings and collaborations of the same
+    artist (eg "The Weeknd" and "THE WEEKND ft. Daft Punk") share one artist
+    ID, see ArtistResolver. The raw names resolved so far are kept in the
+    state_directory so later runs only resolve the names they haven't seen.
+    '''
+    SOURCE_NAME: str
+    SOURCE_SCHEMA: pa.Schema
+    COLUMN_MAPPING: dict[str, str | None]
+
+    def __init__(
+        self,
+        granularity: str,
+        source_path: str,
+        output_directory: str,
+        pg_connection_string: str,
+        load_mode: str = LOAD_MODE_PANDAS,
+        json_format: str = JSON_FORMAT_ARRAY,
+        batch_size: int = 50_000,
+        copy_chunk_size: int = DEFAULT_CHUNK_SIZE,
+        state_directory: str | None = None,
+        intermediate_format: str = INTERMEDIATE_FORMAT_CSV,
+        duckdb_database: str = ':memory:',
+        duckdb_memory_limit: str | None = None,
+        duckdb_threads: int | None = None,
+        duckdb_temp_directory: str | None = None,
+        pg_load_mode: str = PG_LOAD_MODE_APPEND,
+        profile: bool = False,
+        profile_queries: bool = False,
+        dead_letter_path: str | None = None,
+        extra_granularities: list[str] | None = None,
+        canonicalize_artists: bool = False,
+        pg_max_concurrency: int = 1,
+    ):
+        if intermediate_format not in INTERMEDIATE_FORMATS:
+            raise ValueError(f"intermediate_format {intermediate_format} is not supported")
+        if pg_load_mode not in PG_LOAD_MODES:
+            raise ValueError(f"pg_load_mode {pg_load_mode} is not supported")
+        if pg_load_mode == PG_LOAD_MODE_UPSERT and state_directory is None:
+            # the ID tables are merged on their source IDs but the log rows
+            # refer to the IDs of this run, which only match the IDs already
+            # in Postgres if they carry on from the same state
+            raise ValueError(f"pg_load_mode {pg_load_mode} needs a state_directory")
+        if pg_max_concurrency < 1:
+            raise ValueError("pg_max_concurrency must be at least 1")
+        self._source_path = source_path
+        self._output_directory = output_directory
+        self._intermediate_format = intermediate_format
+        missing_columns = [c for c in SOURCE_COLUMN_TYPES if c not in self.COLUMN_MAPPING]
+        if missing_columns:
+            raise ValueError(f"{type(self).__name__}.COLUMN_MAPPING is missing {missing_columns}")
+        self._id_output_paths = {table_name: self._output_path(filename) for table_name, filename in ID_TABLE_FILENAMES.items()}
+        self._log_output_paths = {table_name: self._output_path(filename) for table_name, filename in LOG_TABLE_FILENAMES.items()}
+        self._current_output_paths = {table_name: self._output_path(filename) for table_name, filename in CURRENT_TABLE_FILENAMES.items()}
+        self._pg_connection_string = pg_connection_string
+        self._granularity = granularity
+        self._extra_granularities = [g for g in extra_granularities or [] if g != granularity]
+        self._canonicalize_artists = canonicalize_artists
+        self._load_mode = load_mode
+        self._json_format = json_format
+        self._batch_size = batch_size
+        self._copy_chunk_size = copy_chunk_size
+        self._pg_load_mode = pg_load_mode
+        self._pg_max_concurrency = pg_max_concurrency
+        self._dead_letter_path = dead_letter_path or os.path.join(output_directory, DEAD_LETTER_FILENAME)
+        self._con = connect(duckdb_database, duckdb_memory_limit, duckdb_threads, duckdb_temp_directory)
+        self._materialize_enriched_df = duckdb_database != ':memory:'
+        self._state = IngestState(state_directory, self._con) if state_directory is not None else None
+        # the watermark of the previous runs, set by _prepare_source
+        self._previous_watermark = None
+        self._profiler = Profiler(
+            profile,
+            os.path.join(output_directory, QUERY_PROFILES_DIRECTORY) if profile_queries else None,
+        )
+
+    def close(self):
+        self._con.close()
+
+    def profile_report(self) -> dict:
+        '''
+        The time, rows in/out and memory of every stage run so far, only
+        recorded if the ingestor was created with profile=True.
+        '''
+        return self._profiler.report()
+
+    def _row_count(self, name: str) -> int:
+        return self._con.sql(f'SELECT COUNT(*) FROM {name}').fetchone()[0]
+
+    def _output_path(self, filename: str) -> str:
+        return output_path(self._output_directory, filename, self._intermediate_format)
+
+    def _write_output(self, relation: duckdb.DuckDBPyRelation, output_path: str):
+        if self._intermediate_format == INTERMEDIATE_FORMAT_CSV:
+            relation.to_csv(output_path)
+        elif self._intermediate_format == INTERMEDIATE_FORMAT_PARQUET:
+            relation.to_parquet(output_path, compression='zstd')
+        elif self._intermediate_format == INTERMEDIATE_FORMAT_ARROW:
+            batches = relation.to_arrow_reader()
+            options = pa.ipc.IpcWriteOptions(compression='zstd')
+            with pa.ipc.new_file(output_path, batches.schema, options=options) as writer:
+                for batch in batches:
+                    writer.write_batch(batch)
+
+    def _read_output(self, output_path: str) -> duckdb.DuckDBPyRelation:
+        if self._intermediate_format == INTERMEDIATE_FORMAT_CSV:
+            return self._con.read_csv(output_path)
+        elif self._intermediate_format == INTERMEDIATE_FORMAT_PARQUET:
+            return self._con.read_parquet(output_path)
+        return self._con.from_arrow(open_record_batches(output_path, self._intermediate_format))
+
+    def _has_rows(self, output_path: str) -> bool:
+        return self._read_output(output_path).limit(1).fetchone() is not None
+
+    def _output_month_starts(self, output_path: str) -> list[datetime.datetime]:
+        '''
+        The first instant of every month a log table output has rows in.
+        '''
+        # a header-only CSV (eg from an incremental rerun with nothing new)
+        # has its columns read as VARCHAR, hence the cast
+        month_starts = self._read_output(output_path).select("date_trunc('month', CAST(ingest_timestamp AS TIMESTAMP))").distinct()
+        return [row[0] for row in month_starts.fetchall()]
+
+    def ingest(self):
+        logging.info(f"Starting load")
+        with self._profiler.stage('load'):
+            df = self.load()
+            if self._profiler.enabled and is_dataframe(df):
+                self._profiler.set_rows(rows_out=len(df))
+        if is_dataframe(df):
+            logging.info(f"Starting conversion of {len(df)} rows")
+        else:
+            logging.info(f"Starting conversion of {self._load_mode} loaded rows")
+        with self._profiler.stage('convert'):
+            self.convert(df)
+        logging.info(f"Starting write to postgres")
+        with self._profiler.stage('csvs_to_pg'):
+            self.csvs_to_pg()
+        with self._profiler.stage('commit_state'):
+            self.commit_state()
+        if self._profiler.enabled:
+            report_path = os.path.join(self._output_directory, RUN_REPORT_FILENAME)
+            self._profiler.write_report(report_path)
+            logging.info(f"Wrote run report to {report_path}")
+
+    def commit_state(self, keep_staged: bool = False):
+        '''
+        Makes the state from the last convert the starting point of the next
+        incremental ingest. Only call this once the output has been loaded.
+        keep_staged is for when a later ingest continues from this one's
+        staged state, see continue_state_from.
+        '''
+        if self._state is not None:
+            self._state.commit(keep_pending=keep_staged)
+
+    def continue_state_from(self, previous: PgIngestor):
+        '''
+        Makes the next convert start from the state previous's convert staged
+        rather than the committed state, so a file can be converted while the
+        one before it is still being loaded. previous has to be committed
+        with keep_staged, and once neither is needed any more
+        discard_staged_state cleans up after both.
+        '''
+        if self._state is not None and previous._state is not None:
+            self._state.continue_from(previous._state)
+
+    def discard_staged_state(self):
+        if self._state is not None:
+            self._state.discard_pending()
+
+    def load(self) -> pd.DataFrame | pa.RecordBatchReader | duckdb.DuckDBPyRelation:
+        if not os.path.exists(self._source_path):
+            raise ValueError(f"source_path {self._source_path} does not exist")
+        if self._json_format not in JSON_FORMATS:
+            raise ValueError(f"json_format {self._json_format} is not supported")
+
+        if self._load_mode == LOAD_MODE_PANDAS:
+            import pandas as pd
+            return pd.read_json(
+                self._source_path,
+                orient='records',
+                lines=self._json_format == JSON_FORMAT_NEWLINE_DELIMITED,
+            )
+        elif self._load_mode == LOAD_MODE_STREAM:
+            # badly typed values are kept (as strings) for _validate_source
+            return record_batch_reader(self._source_path, self.SOURCE_SCHEMA, self._json_format, self._batch_size, strict=False)
+        elif self._load_mode == LOAD_MODE_DUCKDB:
+            return self._con.read_json(
+                self._source_path,
+                format=self._json_format,
+                columns={field.name: 'VARCHAR' for field in self.SOURCE_SCHEMA},
+            )
+        else:
+            raise ValueError(f"load_mode {self._load_mode} is not supported")
+
+    def load_source(self) -> int:
+        '''
+        Loads the source and copies it into the ingestor's DuckDB connection
+        ahead of time, then convert(None) picks it up without parsing the
+        file again. Returns the number of source records.
+        '''
+        with self._profiler.stage('register_source'):
+            self._register_source(self.load())
+            row_count = self._row_count('df')
+            self._profiler.set_rows(rows_out=row_count)
+        return row_count
+
+    def convert(self, df: pd.DataFrame | pa.RecordBatchReader | duckdb.DuckDBPyRelation | None):
+        '''
+        Converts df, or with None the source from load_source, to the output
+        files.
+        '''
+        self._make_output_directory()
+        source_df_name = self._prepare_source(df)
+        self._stage_watermark(source_df_name)
+
+        # in memory enriched_df is a view, the joins run as part of each log
+        # table, on disk it's a table and the source rows are dropped
+        with self._profiler.stage('enriched_df'):
+            self._create_enriched_df(source_df_name)
+            if self._materialize_enriched_df:
+                self._drop_source()
+        self._create_logs()
+        if self._materialize_enriched_df:
+            self._con.execute('DROP TABLE enriched_df')
+
+    def write_shards(
+        self,
+        df: pd.DataFrame | pa.RecordBatchReader | duckdb.DuckDBPyRelation,
+        shard_directory: str,
+        num_shards: int,
+        shard_by: str,
+    ) -> list[str]:
+        '''
+        First step of a partitioned convert: assigns the IDs (written to the
+        output_directory as usual) and splits the source rows into num_shards
+        parquet directories under shard_directory, by playlist_id hash or by
+        contiguous ranges of intervals. Returns the shard directories, which
+        are converted independently with convert_shard and then combined
+        with merge_shards.
+        '''
+        self._make_output_directory()
+        source_df_name = self._prepare_source(df)
+        self._stage_watermark(source_df_name)
+
+        os.makedirs(os.path.join(shard_directory, 'ids'), exist_ok=True)
+        for name in ID_TABLE_NAMES + (['artist_aliases'] if self._canonicalize_artists else []):
+            self._con.execute(f"COPY (FROM {name}) TO {sql_string(os.path.join(shard_directory, 'ids', f'{name}.parquet'))} (FORMAT parquet)")
+
+        if shard_by == SHARD_BY_PLAYLIST:
+            shard_expression = f'hash(playlist_id) % {num_shards}'
+        elif shard_by == SHARD_BY_DATE:
+            # shards hold whole intervals so an interval's latest row is
+            # always found within a single shard
+            minimum_interval, interval_count = self._con.sql(
+f'''
+SELECT
+    MIN(date_trunc('{self._granularity}', CAST(timestp AS TIMESTAMP))),
+    date_diff(
+        '{self._granularity}',
+        MIN(date_trunc('{self._granularity}', CAST(timestp AS TIMESTAMP))),
+        MAX(date_trunc('{self._granularity}', CAST(timestp AS TIMESTAMP)))
+    ) + 1,
+FROM {source_df_name}
+''').fetchone()
+            shard_expression = (
+                f"date_diff('{self._granularity}', TIMESTAMP '{minimum_interval}', date_trunc('{self._granularity}', CAST(timestp AS TIMESTAMP)))"
+                f" * {num_shards} // {interval_count}"
+            )
+        else:
+            raise ValueError(f"shard_by {shard_by} is not supported")
+
+        source_directory = os.path.join(shard_directory, 'source')
+        self._con.execute(
+f'''
+COPY (
+    SELECT *, {shard_expression} AS shard FROM {source_df_name}
+) TO {sql_string(source_directory)} (FORMAT parquet, PARTITION_BY (shard), OVERWRITE_OR_IGNORE)
+''')
+        if not os.path.isdir(source_directory):
+            return []
+        return sorted(os.path.join(source_directory, d) for d in os.listdir(source_directory))
+
+    def convert_shard(self, shard_source_directory: str, ids_directory: str) -> int:
+        '''
+        Writes the latest row per ID per interval of each log table for one
+        shard to the output_directory as parquet, change detection happens
+        in merge_shards. Returns the number of source rows in the shard.
+        '''
+        self._make_output_directory()
+        self._register_source(self._con.read_parquet(os.path.join(shard_source_directory, '*.parquet')))
+        for name in ID_TABLE_NAMES:
+            self._con.execute(f"CREATE OR REPLACE VIEW {name} AS FROM read_parquet({sql_string(os.path.join(ids_directory, f'{name}.parquet'))})")
+        artist_aliases_path = os.path.join(ids_directory, 'artist_aliases.parquet')
+        # the shard's ingestor isn't told about canonicalize_artists
+        self._canonicalize_artists = os.path.exists(artist_aliases_path)
+        if self._canonicalize_artists:
+            self._con.execute(f"CREATE OR REPLACE VIEW artist_aliases AS FROM read_parquet({sql_string(artist_aliases_path)})")
+        self._create_enriched_df('df')
+        self._create_logs(detect_changes=False)
+        return self._con.sql('SELECT COUNT(*) FROM df').fetchone()[0]
+
+    def merge_shards(self, shard_output_directories: list[str]):
+        '''
+        Runs change detection over the combined output of every convert_shard
+        and writes the log tables to the output_directory, the same as
+        convert would have. With a state_directory the state is staged as
+        well, and committed with commit_state once the output is loaded.
+        '''
+        # the shards only hold the latest rows at granularity
+        if reduction_granularity([self._granularity] + self._extra_granularities) != self._granularity:
+            raise ValueError(f"extra_granularities must all be made of whole {self._granularity} intervals")
+        source_names = {}
+        for table_name, filename in LOG_TABLE_FILENAMES.items():
+            paths = [output_path(d, filename, INTERMEDIATE_FORMAT_PARQUET) for d in shard_output_directories]
+            self._con.execute(
+                f"CREATE OR REPLACE VIEW {table_name}_shards AS "
+                f"SELECT *, ingest_timestamp AS timestp, {row_digest_sql(table_name)} AS {row_digest_column_name(table_name)} "
+                f"FROM read_parquet([{', '.join(sql_string(p) for p in paths)}])"
+            )
+            source_names[table_name] = f'{table_name}_shards'
+        self._create_logs(source_names)
+
+    def _stage_watermark(self, source_df_name: str):
+        if self._state is not None:
+            new_watermark = self._con.sql(f'SELECT MAX(CAST(timestp AS TIMESTAMP)) FROM {source_df_name}').fetchone()[0]
+            if new_watermark is not None:
+                self._state.stage_watermark(new_watermark)
+
+    def _make_output_directory(self):
+        try:
+            os.makedirs(self._output_directory, exist_ok=True)
+        except OSError:
+            raise ValueError(f"output_directory {self._output_directory} is not a valid path")
+
+    def _prepare_source(self, df: pd.DataFrame | pa.RecordBatchReader | duckdb.DuckDBPyRelation | None) -> str:
+        '''
+        Registers and validates the source rows and assigns their IDs,
+        returns the name of the rows which still need converting.
+        '''
+        if df is not None:
+            with self._profiler.stage('register_source'):
+                self._register_source(df)
+                if self._profiler.enabled:
+                    self._profiler.set_rows(rows_out=self._row_count('df'))
+        source_df_name = 'df'
+        if self._state is not None:
+            self._state.reset_pending()
+            watermark = self._previous_watermark = self._state.watermark()
+            if watermark is not None:
+                # everything up to the watermark was ingested by previous runs,
+                # bad timestamps are kept for _validate_source to reject
+                timestp = self.COLUMN_MAPPING['timestp']
+                self._con.sql(f"CREATE OR REPLACE TEMP VIEW new_df AS SELECT * FROM df WHERE TRY_CAST({timestp} AS TIMESTAMP) > '{watermark.isoformat()}' OR TRY_CAST({timestp} AS TIMESTAMP) IS NULL")
+                source_df_name = 'new_df'
+        with self._profiler.stage('validate'):
+            source_df_name = self._validate_source(source_df_name)
+
+        self._create_and_register_ids(source_df_name, 'playlist_id', True, self._id_output_paths['playlists'], 'playlists')
+        self._create_and_register_ids(source_df_name, 'user_id', True, self._id_output_paths['users'], 'users')
+        self._create_and_register_ids(source_df_name, 'media_item_id', True, self._id_output_paths['media_items'], 'media_items')
+        if self._canonicalize_artists:
+            with self._profiler.stage('artist_aliases'):
+                self._create_artist_aliases(source_df_name)
+            self._create_and_register_ids('artist_aliases', 'name', False, self._id_output_paths['artists'], 'artists', output_id_col_name='name')
+        else:
+            self._create_and_register_ids(source_df_name, 'artist_name', False, self._id_output_paths['artists'], 'artists', output_id_col_name='name')
+        return source_df_name
+
+    def _create_artist_aliases(self, source_df_name: str):
+        '''
+        Registers artist_aliases, the canonical name of every raw artist_name
+        (see ArtistResolver). Only the names previous runs haven't already
+        resolved go through Python, the rest are a hash join on the aliases
+        kept in the state.
+        '''
+        has_known_aliases = self._state is not None and self._state.has('artist_aliases')
+        new_raw_names = self._con.sql(
+f'''
+SELECT artist_name
+FROM {source_df_name}
+WHERE
+    artist_name IS NOT NULL
+    {f"AND artist_name NOT IN (SELECT raw_name FROM {self._state.scan('artist_aliases')})" if has_known_aliases else ''}
+GROUP BY artist_name
+-- a new artist is named after its most common spelling
+ORDER BY count(*) DESC, artist_name
+''').fetchall()
+        names_by_key = {}
+        if has_known_aliases:
+            names_by_key = dict(self._con.sql(f"SELECT DISTINCT canonical_key, name FROM {self._state.scan('artist_aliases')}").fetchall())
+        new_aliases = ArtistResolver(names_by_key).alias_table(row[0] for row in new_raw_names)
+        self._profiler.set_rows(rows_in=len(new_raw_names), rows_out=len(new_aliases))
+
+        self._con.execute('DROP TABLE IF EXISTS artist_aliases')
+        self._con.register('new_artist_aliases', new_aliases)
+        self._con.execute(
+            'CREATE TABLE artist_aliases AS FROM new_artist_aliases'
+            + (f" UNION ALL FROM {self._state.scan('artist_aliases')}" if has_known_aliases else '')
+        )
+        self._con.unregister('new_artist_aliases')
+        if self._state is not None:
+            self._state.stage('artist_aliases', 'FROM artist_aliases')
+
+    def _validate_source(self, source_df_name: str) -> str:
+        '''
+        Checks the required columns are present, the timestamps parse and
+        the numbers are integers with one scan over the source. Invalid
+        records are written to the dead_letter_path (JSON lines, or parquet if
+        it ends with .parquet) with a reject_reason named after the source
+        field, such as "missing_video_id" or "invalid_views". Returns the name
+        of a view of the valid records with the SOURCE_COLUMN_TYPES columns
+        cast to their types.
+        '''
+        mapping = self.COLUMN_MAPPING
+        checks = [(f'{mapping[c]} IS NULL', f'missing_{mapping[c]}') for c in REQUIRED_COLUMN_NAMES]
+        checks.append((f"TRY_CAST({mapping['timestp']} AS TIMESTAMP) IS NULL", f"invalid_{mapping['timestp']}"))
+        int_field_names = [mapping[c] for c, t in SOURCE_COLUMN_TYPES.items() if t == 'BIGINT' and mapping[c] is not None]
+        # casting to BIGINT rounds, so 1.5 would pass as 2 without the DOUBLE comparison
+        checks.extend(
+            (f'{c} IS NOT NULL AND (TRY_CAST({c} AS BIGINT) IS NULL OR TRY_CAST({c} AS DOUBLE) <> TRY_CAST({c} AS BIGINT))', f'invalid_{c}')
+            for c in int_field_names
+        )
+        is_invalid = ' OR '.join(f'({condition})' for condition, _ in checks)
+
+        if os.path.exists(self._dead_letter_path):
+            os.remove(self._dead_letter_path)
+        invalid_count = self._con.sql(f'SELECT COUNT(*) FROM {source_df_name} WHERE {is_invalid}').fetchone()[0]
+        if invalid_count:
+            reject_reason = 'CASE ' + ' '.join(f"WHEN {condition} THEN '{reason}'" for condition, reason in checks) + ' END'
+            dead_letter_format = 'parquet' if self._dead_letter_path.endswith('.parquet') else 'json'
+            self._con.execute(
+                f"COPY (SELECT *, {reject_reason} AS reject_reason FROM {source_df_name} WHERE {is_invalid}) "
+                f"TO {sql_string(self._dead_letter_path)} (FORMAT {dead_letter_format})"
+            )
+            logging.warning(f"Wrote {invalid_count} invalid records to {self._dead_letter_path}")
+        if self._profiler.enabled:
+            row_count = self._row_count(source_df_name)
+            self._profiler.set_rows(rows_in=row_count, rows_out=row_count - invalid_count)
+
+        columns = ', '.join(
+            f'CAST({mapping[c] if mapping[c] is not None else "NULL"} AS {t}) AS {c}'
+            for c, t in SOURCE_COLUMN_TYPES.items()
+        )
+        # the checks are only repeated by the later scans if anything failed them
+        self._con.execute(
+            f'CREATE OR REPLACE TEMP VIEW valid_df AS SELECT {columns} FROM {source_df_name}'
+            + (f' WHERE NOT ({is_invalid})' if invalid_count else '')
+        )
+        return 'valid_df'
+
+    def _create_enriched_df(self, source_df_name: str):
+        # NOTE I thought about doing all these transformations in Python, but
+        # then found it wasn't too much work to do in SQL. I would likely
+        # reconsider if I had to do more complex transformations.
+        artists_join = 'LEFT JOIN artists ON df.artist_name = artists.name'
+        if self._canonicalize_artists:
+            artists_join = (
+                'LEFT JOIN artist_aliases ON df.artist_name = artist_aliases.raw_name\n'
+                '    LEFT JOIN artists ON artist_aliases.name = artists.name'
+            )
+        row_digests = ', '.join(f'{row_digest_sql(t)} AS {row_digest_column_name(t)}' for t in LOG_TABLE_COLUMNS)
+        enriched_df = self._con.query(
+f'''
+-- Replaces the source-specific ID's with the ID's we generated and hashes
+-- the columns each log table compares, so change detection only has to
+-- compare one value per row
+SELECT *, {row_digests} FROM (
+SELECT
+    playlists.id AS playlist_id,
+    df.playlist_name,
+    df.playlist_cover_url AS cover_url,
+    users.id AS user_id,
+    df.plays,
+    df.num_media_items,
+    CAST(df.timestp AS TIMESTAMP) AS timestp,
+    media_items.id AS media_item_id,
+    df.primary_title,
+    artists.id AS artist_id,
+    df.media_cover_url,
+    df.secondary_title,
+    df.position,
+FROM
+    {source_df_name} df
+    JOIN playlists ON df.playlist_id = playlists.source_id
+    LEFT JOIN users ON df.user_id = users.source_id
+    JOIN media_items ON df.media_item_id = media_items.source_id
+    {artists_join}
+)
+'''
+        )
+        if self._materialize_enriched_df:
+            self._con.execute('DROP TABLE IF EXISTS enriched_df')
+            enriched_df.create('enriched_df')
+        else:
+            self._con.register('enriched_df', enriched_df)
+
+    def _drop_source(self):
+        for view_name in ['valid_df', 'new_df']:
+            self._con.execute(f'DROP VIEW IF EXISTS {view_name}')
+        self._con.unregister('df')
+        self._con.execute('DROP TABLE IF EXISTS df')
+        # frees the dropped blocks for reuse by the log tables
+        self._con.execute('CHECKPOINT')
+
+    def _create_logs(self, source_names: dict[str, str] | None = None, detect_changes: bool = True):
+        '''
+        Builds every log table from enriched_df, unless source_names maps the
+        table name to another source with the same columns.
+        '''
+        for granularity in [self._granularity] + self._extra_granularities:
+            if granularity not in GRANULARITIES:
+                raise ValueError(f"granularity {granularity} is not supported")
+
+        source_names = {table_name: (source_names or {}).get(table_name, 'enriched_df') for table_name in LOG_TABLE_FILENAMES}
+        for table_name, (id_column_names, other_column_types) in LOG_TABLE_COLUMNS.items():
+            with self._log_stage(table_name, source_names):
+                columns = [f'{c} BIGINT' for c in id_column_names] + ['ingest_timestamp TIMESTAMP']
+                columns += [f'{c} {t}' for c, t in other_column_types.items()] + ['row_digest UBIGINT']
+                self._con.sql(f'DROP TABLE IF EXISTS {table_name}')
+                self._con.sql(f"CREATE TABLE {table_name} ({', '.join(columns)}, PRIMARY KEY ({', '.join(id_column_names)}, ingest_timestamp))")
+                self._create_log_df(
+                    table_name,
+                    id_column_names,
+                    list(other_column_types),
+                    self._granularity,
+                    self._log_output_paths[table_name],
+                    source_names[table_name],
+                    detect_changes,
+                )
+
+    def _log_stage(self, table_name: str, source_names: dict[str, str]):
+        # the source rows are counted before the stage starts so the count
+        # isn't part of its time
+        rows_in = self._row_count(source_names[table_name]) if self._profiler.enabled else None
+        return self._profiler.stage(f'log.{table_name}', rows_in=rows_in)
+
+    def _register_source(self, df: pd.DataFrame | pa.RecordBatchReader | duckdb.DuckDBPyRelation):
+        '''
+        Makes the source data available as "df". DataFrames are registered as
+        is, streamed batches and DuckDB scans are copied into a DuckDB table
+        once because convert reads "df" several times.
+        '''
+        self._con.unregister('df')
+        self._con.sql('DROP TABLE IF EXISTS df')
+        if is_dataframe(df):
+            self._con.register('df', df)
+        elif isinstance(df, pa.RecordBatchReader):
+            self._con.register('source_batches', df)
+            self._con.sql('CREATE TABLE df AS SELECT * FROM source_batches')
+            self._con.unregister('source_batches')
+        else:
+            df.create('df')
+
+    def _create_and_register_ids(
+        self,
+        input_df_name: str,
+        id_col_name: str,
+        include_source: bool,
+        output_path: str,
+        register_name: str,
+        output_id_col_name: str = 'source_id',
+    ):
+        with self._profiler.stage(f'ids.{register_name}'):
+            has_known_ids = self._state is not None and self._state.has(register_name)
+            new_ids_table_name = f'new_{register_name}'
+            self._con.execute(
+f'''
+CREATE OR REPLACE TEMP TABLE {new_ids_table_name} AS
+-- This assigns a unique int ID to each unique value in the specified ID column,
+-- carrying on from the IDs previous runs assigned if there are any. They're
+-- numbered in order of the values so converting the same rows from the same
+-- state always gives the same IDs.
+WITH temp_table AS (
+    SELECT DISTINCT {id_col_name} FROM {input_df_name}
+)
+SELECT
+    {f'(SELECT MAX(id) FROM {self._state.scan(register_name)}) + ' if has_known_ids else ''}row_number() OVER (ORDER BY {id_col_name}) AS id,
+    {"'" + self.SOURCE_NAME + "' AS source," if include_source else ''}
+    {id_col_name} AS {output_id_col_name},
+FROM
+    temp_table
+WHERE
+    {id_col_name} IS NOT NULL
+    {f'AND {id_col_name} NOT IN (SELECT {output_id_col_name} FROM {self._state.scan(register_name)})' if has_known_ids else ''}
+ORDER BY
+    id
+''')
+            if self._profiler.enabled:
+                self._profiler.set_rows(rows_out=self._row_count(new_ids_table_name))
+            self._write_output(self._con.table(new_ids_table_name), output_path)
+            # only the new IDs are output but the joins need all of them
+            self._con.execute(
+                f'CREATE OR REPLACE TEMP TABLE {register_name} AS '
+                + (f'FROM {self._state.scan(register_name)} UNION ALL ' if has_known_ids else '')
+                + f'FROM {new_ids_table_name}'
+            )
+            self._con.execute(f'DROP TABLE {new_ids_table_name}')
+            if self._state is not None:
+                self._state.stage(register_name, f'FROM {register_name}')
+
+    def _create_log_df(
+        self,
+        table_name: str,
+        id_column_names: list[str],
+        other_column_names: list[str],
+        granularity: str,
+        output_filepath: str,
+        source_name: str = 'enriched_df',
+        detect_changes: bool = True,
+    ):
+        '''
+        Builds the log table at granularity plus a {table_name}_{granularity}
+        table for each of the extra granularities, see _insert_log_rows.
+
+        The latest row of an interval is also the latest row of any smaller
+        interval inside it, so with extra granularities source_name is
+        scanned once to reduce it to the latest row per ID at the
+        reduction_granularity and every log table is built from that.
+        '''
+        granularities = [granularity] + self._extra_granularities
+        if len(granularities) > 1:
+            latest_table_name = f'{table_name}_latest'
+            self._con.execute(
+f'''
+CREATE OR REPLACE TEMP TABLE {latest_table_name} AS
+SELECT
+    {', '.join(id_column_names + other_column_names)},
+    {row_digest_column_name(table_name)},
+    timestp,
+FROM
+    {source_name}
+QUALIFY
+    row_number() OVER (PARTITION BY {', '.join(id_column_names)}, date_trunc('{reduction_granularity(granularities)}', timestp) ORDER BY timestp DESC) = 1
+''')
+            source_name = latest_table_name
+
+        for extra_granularity in self._extra_granularities:
+            extra_table_name = f'{table_name}_{extra_granularity}'
+            self._con.execute(f'CREATE OR REPLACE TABLE {extra_table_name} AS FROM {table_name} LIMIT 0')
+            with self._profiler.stage(f'log.{extra_table_name}'):
+                self._insert_log_rows(
+                    extra_table_name,
+                    id_column_names,
+                    other_column_names,
+                    extra_granularity,
+                    granularity_output_path(output_filepath, extra_granularity),
+                    source_name,
+                    row_digest_column_name(table_name),
+                    detect_changes,
+                )
+        self._insert_log_rows(
+            table_name,
+            id_column_names,
+            other_column_names,
+            granularity,
+            output_filepath,
+            source_name,
+            row_digest_column_name(table_name),
+            detect_changes,
+        )
+        if detect_changes:
+            # the shards of a partitioned convert don't detect changes, their
+            # log tables aren't final yet
+            current_table_name = LOG_TABLE_CURRENT_TABLE_NAMES[table_name]
+            with self._profiler.stage(f'log.{current_table_name}'):
+                self._write_output(
+                    self._con.sql(
+f'''
+SELECT * EXCLUDE (row_digest)
+FROM (
+    FROM {table_name}
+    -- an ID whose row was superseded falls back to the row before it when
+    -- the superseding row is the same as that one
+    UNION ALL BY NAME
+    FROM {table_name}_previous
+    SEMI JOIN {table_name}_superseded USING ({', '.join(id_column_names)})
+)
+QUALIFY row_number() OVER (PARTITION BY {', '.join(id_column_names)} ORDER BY ingest_timestamp DESC) = 1
+ORDER BY {', '.join(id_column_names)}
+'''),
+                    self._current_output_paths[current_table_name],
+                )
+
+        # everything the later stages need has been written out
+        for dropped_table_name in [table_name] + [f'{table_name}_{g}' for g in self._extra_granularities]:
+            self._con.execute(f'DROP VIEW {dropped_table_name}_previous')
+            self._con.execute(f'DROP TABLE {dropped_table_name}_superseded')
+            self._con.execute(f'DROP TABLE {dropped_table_name}')
+        if len(granularities) > 1:
+            self._con.execute(f'DROP TABLE {source_name}')
+
+    def _insert_log_rows(
+        self,
+        table_name: str,
+        id_column_names: list[str],
+        other_column_names: list[str],
+        granularity: str,
+        output_filepath: str,
+        source_name: str,
+        row_digest_column_name: str,
+        detect_changes: bool,
+    ):
+        '''
+        Fills the log table in a single pass over source_name: keep the latest
+        row per ID per interval, then keep only the rows which differ from the
+        previous interval's row for the same ID. With detect_changes off every
+        latest row per ID per interval is kept.
+
+        Rows are compared by the digest of their other columns in
+        row_digest_column_name (see row_digest_sql) rather than column by
+        column, a change going unnoticed would take a 64-bit collision between
+        two consecutive rows of the same ID.
+
+        Comparing against the previous interval (rather than the previous kept
+        row) gives the same result because a dropped row is always equal to
+        the last kept row.
+
+        For incremental ingests the last row previous runs wrote for each ID
+        is added as a seed row, which is compared against but never output.
+        The previous runs stopped at the watermark, part way through its
+        interval, so their row for that interval is superseded if this run
+        has a later row for the same ID in it. Superseded rows aren't seeds,
+        the row before them is, and their keys are written next to the log
+        table (see superseded_output_path) for csvs_to_pg to delete, if there
+        are any. The state keeps the last two rows per ID so there's always a
+        row to fall back on.
+        '''
+        id_columns = ', '.join(id_column_names)
+        all_columns = ', '.join(id_column_names + other_column_names)
+        has_seed_rows = detect_changes and self._state is not None and self._state.has(table_name)
+        superseded_table_name = f'{table_name}_superseded'
+        previous_view_name = f'{table_name}_previous'
+        self._con.execute(f'CREATE OR REPLACE TEMP TABLE {superseded_table_name} AS SELECT {id_columns}, ingest_timestamp FROM {table_name} LIMIT 0')
+        if has_seed_rows:
+            state = self._state.scan(table_name)
+            seed_row_digest = 'row_digest'
+            if 'row_digest' not in self._con.sql(f'FROM {state} LIMIT 0').columns:
+                # state written before the digests were kept (or which kept
+                # DuckDB's hash() instead), its columns already have the log
+                # table's types
+                seed_row_digest = digest_sql(other_column_names)
+            if self._previous_watermark is not None:
+                open_interval_start = f"date_trunc('{granularity}', TIMESTAMP '{self._previous_watermark.isoformat()}')"
+                self._con.execute(
+f'''
+INSERT INTO {superseded_table_name}
+SELECT
+    {id_columns},
+    ingest_timestamp,
+FROM
+    {state}
+SEMI JOIN (
+    SELECT DISTINCT {id_columns} FROM {source_name} WHERE date_trunc('{granularity}', timestp) = {open_interval_start}
+) USING ({id_columns})
+WHERE
+    ingest_timestamp >= {open_interval_start}
+''')
+            self._con.execute(
+f'''
+CREATE OR REPLACE TEMP VIEW {previous_view_name} AS
+SELECT
+    {all_columns},
+    ingest_timestamp,
+    {seed_row_digest} AS row_digest,
+FROM
+    {state}
+ANTI JOIN {superseded_table_name} USING ({id_columns}, ingest_timestamp)
+''')
+        else:
+            self._con.execute(f'CREATE OR REPLACE TEMP VIEW {previous_view_name} AS SELECT {all_columns}, ingest_timestamp, row_digest FROM {table_name} LIMIT 0')
+        seed_rows_query = f'''
+    UNION ALL BY NAME
+    SELECT
+        {id_columns},
+        row_digest,
+        ingest_timestamp,
+        true AS is_seed_row,
+    FROM
+        {previous_view_name}
+''' if has_seed_rows else ''
+        with self._profiler.query_profile(self._con, table_name):
+            self._con.execute(
+f'''
+-- Take the latest row for each ID in each interval, then compare its digest
+-- with the digest of the latest row for the same ID in the previous interval
+WITH LATEST_ROW_FOR_GRANULARITY AS (
+    SELECT
+        {all_columns},
+        {row_digest_column_name} AS row_digest,
+        timestp AS ingest_timestamp,
+        false AS is_seed_row,
+    FROM
+        {source_name}
+    QUALIFY
+        row_number() OVER (PARTITION BY {id_columns}, date_trunc('{granularity}', timestp) ORDER BY timestp DESC) = 1
+    {seed_rows_query}
+),
+ROW_WITH_PREVIOUS AS (
+    SELECT
+        *,
+        row_number() OVER previous_rows = 1 AS is_first_row,
+        lag(row_digest) OVER previous_rows AS previous_row_digest,
+    FROM
+        LATEST_ROW_FOR_GRANULARITY
+    WINDOW previous_rows AS (PARTITION BY {id_columns} ORDER BY ingest_timestamp)
+)
+INSERT INTO {table_name}
+(
+    {all_columns},
+    ingest_timestamp,
+    row_digest
+)
+SELECT
+    {all_columns},
+    ingest_timestamp,
+    row_digest
+FROM
+    ROW_WITH_PREVIOUS
+WHERE
+    NOT is_seed_row
+    {"AND (is_first_row OR row_digest IS DISTINCT FROM previous_row_digest)" if detect_changes else ''}
+ORDER BY
+    date_trunc('{granularity}', ingest_timestamp), {id_columns}
+''')
+        if self._profiler.enabled:
+            self._profiler.set_rows(rows_out=self._row_count(table_name))
+        with self._profiler.stage(f'log.{table_name}.write'):
+            self._write_output(self._con.sql(f'SELECT * EXCLUDE (row_digest) FROM {table_name}'), output_filepath)
+            # only a delta which starts in the previous run's last interval
+            # replaces rows, and a left over file would delete them again
+            if os.path.exists(superseded_output_path(output_filepath)):
+                os.remove(superseded_output_path(output_filepath))
+            if has_seed_rows and self._previous_watermark is not None and self._row_count(superseded_table_name) > 0:
+                self._write_output(
+                    self._con.sql(f'FROM {superseded_table_name} ORDER BY {id_columns}'),
+                    superseded_output_path(output_filepath),
+                )
+
+        if self._state is not None and detect_changes:
+            self._state.stage(table_name, f'''
+SELECT
+    {all_columns},
+    ingest_timestamp,
+    row_digest
+FROM (
+    SELECT {all_columns}, ingest_timestamp, row_digest FROM {table_name}
+    UNION ALL
+    SELECT {all_columns}, ingest_timestamp, row_digest FROM {previous_view_name}
+)
+QUALIFY
+    row_number() OVER (PARTITION BY {id_columns} ORDER BY ingest_timestamp DESC) <= 2
+''')
+
+    def csvs_to_pg(self):
+        path_to_table_name = {
+            **{path: table_name for table_name, path in self._id_output_paths.items()},
+            **{path: table_name for table_name, path in self._log_output_paths.items()},
+            **{path: table_name for table_name, path in self._current_output_paths.items()},
+        }
+        column_renames = {
+            'playlist_metadata_log': {'playlist_name': 'name'},
+            'media_item_metadata_log': {'media_cover_url': 'cover_url'},
+            'playlist_metadata_current': {'playlist_name': 'name'},
+            'media_item_metadata_current': {'media_cover_url': 'cover_url'},
+        }
+        # the unique keys an upsert merges on, the ID tables are only ever
+        # inserted into while the log rows are updated if they changed
+        table_name_to_conflict_columns = {
+            'playlists': (['source', 'source_id'], False),
+            'users': (['source', 'source_id'], False),
+            'media_items': (['source', 'source_id'], False),
+            'artists': (['name'], False),
+            'playlist_metadata_log': (['playlist_id', 'ingest_timestamp'], True),
+            'playlist_plays_log': (['playlist_id', 'ingest_timestamp'], True),
+            'playlist_positions_log': (['playlist_id', 'media_item_id', 'ingest_timestamp'], True),
+            'media_item_metadata_log': (['media_item_id', 'ingest_timestamp'], True),
+        }
+        # the current tables are always upserted, see upsert_sql's newer_column
+        current_table_name_to_conflict_columns = {
+            'playlist_metadata_current': ['playlist_id'],
+            'playlist_plays_current': ['playlist_id'],
+            'playlist_positions_current': ['playlist_id', 'media_item_id'],
+            'media_item_metadata_current': ['media_item_id'],
+        }
+        # with the postgres_init_partitioned schema the log tables are
+        # partitioned by month, the partitions for the files are created (and
+        # committed) first so the parent tables are only locked briefly
+        copy_table_names = {}
+        with self._profiler.stage('create_partitions'):
+            with PgCopyLoader(self._pg_connection_string, self._copy_chunk_size) as loader:
+                partitioned_table_names = loader.partitioned_table_names()
+                for path, table_name in path_to_table_name.items():
+                    if table_name in LOG_TABLE_FILENAMES and table_name in partitioned_table_names:
+                        partition_names = loader.create_month_partitions(table_name, self._output_month_starts(path))
+                        # a file within one month is COPYed straight into its
+                        # partition, otherwise the parent routes each row
+                        if len(partition_names) == 1:
+                            copy_table_names[table_name] = partition_names[0]
+        copy_kwargs = {}
+        for path, table_name in path_to_table_name.items():
+            conflict_columns, update, newer_column = None, False, None
+            if table_name in current_table_name_to_conflict_columns:
+                conflict_columns, update, newer_column = current_table_name_to_conflict_columns[table_name], True, 'ingest_timestamp'
+            elif self._pg_load_mode == PG_LOAD_MODE_UPSERT:
+                conflict_columns, update = table_name_to_conflict_columns[table_name]
+            copy_kwargs[path] = dict(
+                rename=column_renames.get(table_name),
+                conflict_columns=conflict_columns,
+                update=update,
+                newer_column=newer_column,
+            )
+
+        # the rows of the previous run's last interval which this run
+        # replaced, their current rows go too and are re-upserted from the
+        # current file
+        superseded_paths = {
+            path: superseded_output_path(path)
+            for path, table_name in path_to_table_name.items()
+            if table_name in LOG_TABLE_FILENAMES and os.path.exists(superseded_output_path(path)) and self._has_rows(superseded_output_path(path))
+        }
+
+        def delete_superseded(loader: PgCopyLoader, path: str) -> int:
+            table_name = path_to_table_name[path]
+            return loader.delete_rows(
+                superseded_paths[path],
+                [table_name, LOG_TABLE_CURRENT_TABLE_NAMES[table_name]],
+                self._intermediate_format,
+            )
+
+        def copy(loader: PgCopyLoader, path: str) -> int:
+            table_name = path_to_table_name[path]
+            copy_table_name = copy_table_names.get(table_name, table_name)
+            if self._intermediate_format == INTERMEDIATE_FORMAT_CSV:
+                return loader.copy_csv(path, copy_table_name, **copy_kwargs[path])
+            return loader.copy_columnar(path, copy_table_name, self._intermediate_format, **copy_kwargs[path])
+
+        if self._pg_max_concurrency == 1:
+            with PgCopyLoader(self._pg_connection_string, self._copy_chunk_size) as loader:
+                for path, table_name in path_to_table_name.items():
+                    if path in superseded_paths:
+                        with self._profiler.stage(f'delete.{table_name}'):
+                            self._profiler.set_rows(rows_out=delete_superseded(loader, path))
+                    with self._profiler.stage(f'copy.{table_name}'):
+                        self._profiler.set_rows(rows_out=copy(loader, path))
+            return
+
+        # Separate connections can't share a transaction, and a log table's
+        # foreign keys only see ID rows which are committed, so the load is
+        # done in two phases: the ID tables at once, each in its own
+        # transaction, then each log table together with its current table.
+        # A failure part way leaves the phases (and groups) that finished
+        # loaded, rerunning with pg_load_mode "upsert" finishes the load.
+        id_groups = [[path] for path, table_name in path_to_table_name.items() if table_name in ID_TABLE_FILENAMES]
+        log_groups = [
+            [path] + [p for p, t in path_to_table_name.items() if t == LOG_TABLE_CURRENT_TABLE_NAMES[table_name]]
+            for path, table_name in path_to_table_name.items()
+            if table_name in LOG_TABLE_FILENAMES
+        ]
+
+        def load_group(paths: list[str]) -> int:
+            row_count = 0
+            with PgCopyLoader(self._pg_connection_string, self._copy_chunk_size) as loader:
+                for path in paths:
+                    if path in superseded_paths:
+                        delete_superseded(loader, path)
+                    row_count += copy(loader, path)
+            return row_count
+
+        with concurrent.futures.ThreadPoolExecutor(self._pg_max_concurrency) as executor:
+            for phase_name, groups in [('ids', id_groups), ('logs', log_groups)]:
+                with self._profiler.stage(f'copy.{phase_name}'):
+                    self._profiler.set_rows(rows_out=sum(executor.map(load_group, groups)))
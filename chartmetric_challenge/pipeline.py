@@ -0,0 +1,168 @@
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable
+
+
+_DONE = object()
+
+
+def source_output_directory(output_directory: str, source_path: str) -> str:
+    return os.path.join(output_directory, os.path.splitext(os.path.basename(source_path))[0])
+
+
+def _put(q: queue.Queue, item, should_stop: Callable[[], bool]) -> bool:
+    # waits for space but gives up once a later stage has failed, so a full
+    # queue nobody reads any more can't block forever
+    while not should_stop():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _iter_queue(q: queue.Queue, should_stop: Callable[[], bool]):
+    while True:
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            if should_stop():
+                return
+            continue
+        if item is _DONE:
+            return
+        yield item
+
+
+def ingest_files(
+    ingestor_class: type,
+    granularity: str,
+    source_paths: list[str],
+    output_directory: str,
+    pg_connection_string: str | None,
+    state_directory: str | None = None,
+    queue_size: int = 1,
+    **ingestor_kwargs,
+) -> dict:
+    '''
+    Ingests source_paths in order as a pipeline: while file N is converted
+    the next file is parsed and file N-1's output is COPYed into Postgres,
+    each stage in its own thread. At most queue_size files wait between two
+    stages, so a slow stage holds back the ones before it rather than
+    parsed files piling up in memory.
+
+    Each file gets its own ingestor and output directory under
+    output_directory (see source_output_directory). The files are converted
+    one after another through state_directory (output_directory/state by
+    default), the same as separate incremental runs, so the IDs and change
+    detection carry on from one file to the next. Each file is converted
+    from the state the file before it staged (see continue_state_from) and
+    its state is only committed once it's been loaded, so after a failed
+    load a rerun starts again from the last loaded file. If a stage fails
+    the stages before it stop but the ones after it finish the files
+    they've been handed. Skips the Postgres load if pg_connection_string is
+    None.
+
+    Returns the records and seconds spent in each stage per file and in
+    total.
+    '''
+    if len({source_output_directory(output_directory, p) for p in source_paths}) != len(source_paths):
+        raise ValueError("source_paths must have different file names")
+    state_directory = state_directory or os.path.join(output_directory, 'state')
+
+    start = time.perf_counter()
+    files = [{'source_path': p, 'output_directory': source_output_directory(output_directory, p)} for p in source_paths]
+    converted_queue = queue.Queue(queue_size)
+    loaded_queue = queue.Queue(queue_size)
+    failed_stage_indexes = []
+    errors = []
+    ingestors = []
+
+    def run_stage(index: int, name: str, stage, input_queue: queue.Queue | None, output_queue: queue.Queue | None):
+        def should_stop() -> bool:
+            return any(i > index for i in failed_stage_indexes)
+
+        try:
+            items = iter(files) if input_queue is None else _iter_queue(input_queue, should_stop)
+            for item in items:
+                if should_stop():
+                    break
+                stage_start = time.perf_counter()
+                stage(item)
+                item[f'{name}_seconds'] = time.perf_counter() - stage_start
+                logging.info(f"Finished {name} of {item['source_path']} in {item[f'{name}_seconds']:.3f}s")
+                if output_queue is not None and not _put(output_queue, item, should_stop):
+                    break
+        except Exception as e:
+            logging.exception(f"{name} failed")
+            errors.append(e)
+            failed_stage_indexes.append(index)
+        finally:
+            if output_queue is not None:
+                _put(output_queue, _DONE, should_stop)
+
+    def load(item: dict):
+        kwargs = dict(ingestor_kwargs)
+        if kwargs.get('duckdb_database', ':memory:') != ':memory:':
+            # two files are worked on at once and a database file can only
+            # be opened by one connection
+            root, extension = os.path.splitext(kwargs['duckdb_database'])
+            kwargs['duckdb_database'] = f"{root}_{os.path.basename(item['output_directory'])}{extension}"
+        ingestor = ingestor_class(
+            granularity,
+            item['source_path'],
+            item['output_directory'],
+            pg_connection_string,
+            state_directory=state_directory,
+            **kwargs,
+        )
+        if ingestors:
+            ingestor.continue_state_from(ingestors[-1])
+        ingestors.append(ingestor)
+        item['ingestor'] = ingestor
+        item['records'] = ingestor.load_source()
+
+    def convert(item: dict):
+        item['ingestor'].convert(None)
+
+    def csvs_to_pg(item: dict):
+        if pg_connection_string is not None:
+            item['ingestor'].csvs_to_pg()
+        # the next file's convert may still be reading this one's staged state
+        item['ingestor'].commit_state(keep_staged=True)
+        item['ingestor'].close()
+        item['loaded'] = True
+
+    threads = [
+        threading.Thread(target=run_stage, args=(0, 'load', load, None, converted_queue)),
+        threading.Thread(target=run_stage, args=(1, 'convert', convert, converted_queue, loaded_queue)),
+        threading.Thread(target=run_stage, args=(2, 'csvs_to_pg', csvs_to_pg, loaded_queue, None)),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for ingestor in ingestors:
+        ingestor.discard_staged_state()
+        ingestor.close()
+
+    for item in files:
+        item.pop('ingestor', None)
+        if 'convert_seconds' in item and not item.get('loaded'):
+            logging.error(f"{item['source_path']} was converted to {item['output_directory']} but not loaded, a rerun converts it again")
+    if errors:
+        raise errors[0]
+
+    return {
+        'files': len(files),
+        'records': sum(item['records'] for item in files),
+        'seconds': time.perf_counter() - start,
+        'stage_seconds': {
+            name: sum(item[f'{name}_seconds'] for item in files) for name in ['load', 'convert', 'csvs_to_pg']
+        },
+        'per_file': files,
+    }
@@ -0,0 +1,196 @@
+import datetime
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+import duckdb
+
+from chartmetric_challenge.ingest_state import sql_string
+
+
+# how often the RSS is sampled while a stage runs
+RSS_SAMPLE_SECONDS = 0.01
+
+
+def process_peak_rss_mb() -> float:
+    '''
+    The highest RSS the process has had since it started, not just during
+    the current stage.
+    '''
+    # ru_maxrss is in KB on Linux but bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def rss_mb() -> float | None:
+    '''
+    The process' current RSS, None where /proc isn't available (eg macOS).
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except OSError:
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+class _NullContext:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+class _Stage:
+    def __init__(self, profiler: 'Profiler', name: str, rows_in: int | None):
+        self._profiler = profiler
+        self.record = {'name': name}
+        if rows_in is not None:
+            self.record['rows_in'] = rows_in
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        self.record['started_at'] = round(self._start - self._profiler.start, 6)
+        self._profiler.stages.append(self.record)
+        self._profiler._enter_stage(self.record)
+        return self.record
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.record['seconds'] = round(time.perf_counter() - self._start, 6)
+        if exc_type is not None:
+            self.record['error'] = repr(exc_value)
+        self._profiler._exit_stage(self.record)
+        return False
+
+
+class _QueryProfile:
+    def __init__(self, con: duckdb.DuckDBPyConnection, path: str):
+        self._con = con
+        self._path = path
+
+    def __enter__(self):
+        self._con.execute("PRAGMA enable_profiling = 'json'")
+        self._con.execute(f"SET profiling_output = {sql_string(self._path)}")
+        return self._path
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._con.execute("PRAGMA disable_profiling")
+        return False
+
+
+class Profiler:
+    '''
+    Records the wall time, rows in/out and memory of each stage of a run
+    and writes them out as a JSON report.
+
+        with profiler.stage('convert.playlist_plays_log'):
+            ...
+            if profiler.enabled:
+                profiler.set_rows(rows_out=count)
+
+    Stages can be nested, set_rows applies to the innermost one.
+
+    While a stage runs a thread samples the process' RSS every
+    RSS_SAMPLE_SECONDS, peak_rss_mb is the highest sample within the stage
+    (left out where rss_mb isn't available). Allocations that come and go
+    between two samples are missed. process_peak_rss_mb is the process'
+    peak so far when the stage ended, which may well be from an earlier
+    stage. Both are the whole process', so they include the memory of
+    anything running at the same time, eg the other stages of a pipeline.
+
+    When query_profile_directory is set, query_profile also saves DuckDB's
+    JSON profile (the EXPLAIN ANALYZE tree) of the query run inside it.
+
+    A disabled profiler hands out a shared do-nothing context, so leaving
+    the stages in the hot path costs next to nothing. Anything expensive
+    that is only needed for the report, like counting rows, should be
+    guarded by enabled.
+    '''
+    def __init__(self, enabled: bool = False, query_profile_directory: str | None = None):
+        self.enabled = enabled or query_profile_directory is not None
+        self.start = time.perf_counter()
+        self.stages = []
+        self.active = []
+        # the highest RSS sampled for each active stage, by id of its record
+        self._peak_rss = {}
+        self._peak_rss_lock = threading.Lock()
+        self._sampler = None
+        self._stop_sampling = threading.Event()
+        self._started_at = datetime.datetime.now(datetime.timezone.utc)
+        self._query_profile_directory = query_profile_directory
+
+    def stage(self, name: str, rows_in: int | None = None):
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return _Stage(self, name, rows_in)
+
+    def _enter_stage(self, record: dict):
+        self.active.append(record)
+        rss = rss_mb()
+        with self._peak_rss_lock:
+            self._peak_rss[id(record)] = rss
+        if self._sampler is None and rss is not None:
+            self._stop_sampling.clear()
+            self._sampler = threading.Thread(target=self._sample_rss, daemon=True)
+            self._sampler.start()
+
+    def _exit_stage(self, record: dict):
+        self._record_rss(rss_mb())
+        self.active.pop()
+        with self._peak_rss_lock:
+            peak = self._peak_rss.pop(id(record))
+        if peak is not None:
+            record['peak_rss_mb'] = round(peak, 1)
+        record['process_peak_rss_mb'] = round(process_peak_rss_mb(), 1)
+        if not self.active and self._sampler is not None:
+            self._stop_sampling.set()
+            self._sampler.join()
+            self._sampler = None
+
+    def _record_rss(self, rss: float | None):
+        if rss is None:
+            return
+        with self._peak_rss_lock:
+            for key, peak in self._peak_rss.items():
+                if peak is not None and rss > peak:
+                    self._peak_rss[key] = rss
+
+    def _sample_rss(self):
+        while not self._stop_sampling.wait(RSS_SAMPLE_SECONDS):
+            self._record_rss(rss_mb())
+
+    def set_rows(self, rows_in: int | None = None, rows_out: int | None = None):
+        if not self.active:
+            return
+        if rows_in is not None:
+            self.active[-1]['rows_in'] = rows_in
+        if rows_out is not None:
+            self.active[-1]['rows_out'] = rows_out
+
+    def query_profile(self, con: duckdb.DuckDBPyConnection, name: str):
+        if self._query_profile_directory is None:
+            return _NULL_CONTEXT
+        os.makedirs(self._query_profile_directory, exist_ok=True)
+        path = os.path.join(self._query_profile_directory, f'{name}.json')
+        if self.active:
+            self.active[-1]['query_profile'] = path
+        return _QueryProfile(con, path)
+
+    def report(self) -> dict:
+        return {
+            'started_at': self._started_at.isoformat(),
+            'seconds': round(time.perf_counter() - self.start, 6),
+            'process_peak_rss_mb': round(process_peak_rss_mb(), 1),
+            'stages': self.stages,
+        }
+
+    def write_report(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
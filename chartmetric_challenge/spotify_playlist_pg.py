@@ -0,0 +1,46 @@
+import pyarrow as pa
+
+from chartmetric_challenge.constants import ORG_SPOTIFY
+from chartmetric_challenge.pg_ingestor import PgIngestor
+
+
+SPOTIFY_PLAYLIST_SCHEMA = pa.schema([
+    ('playlist_uri', pa.string()),
+    ('name', pa.string()),
+    ('image', pa.string()),
+    ('owner_id', pa.string()),
+    ('followers', pa.int64()),
+    ('total_tracks', pa.int64()),
+    ('scraped_at', pa.string()),
+    ('track_uri', pa.string()),
+    ('track_name', pa.string()),
+    ('artist', pa.string()),
+    ('album_art', pa.string()),
+    ('position', pa.int64()),
+])
+
+
+class SpotifyPlaylistPgIngestor(PgIngestor):
+    '''
+    Ingests scrapes of Spotify playlists, a user owns each playlist and the
+    tracks are its media items. Spotify doesn't publish play counts for a
+    playlist so its followers are logged as its plays, and a track only has
+    the one title. See PgIngestor for the options.
+    '''
+    SOURCE_NAME = ORG_SPOTIFY
+    SOURCE_SCHEMA = SPOTIFY_PLAYLIST_SCHEMA
+    COLUMN_MAPPING = {
+        'playlist_id': 'playlist_uri',
+        'playlist_name': 'name',
+        'playlist_cover_url': 'image',
+        'user_id': 'owner_id',
+        'plays': 'followers',
+        'num_media_items': 'total_tracks',
+        'timestp': 'scraped_at',
+        'media_item_id': 'track_uri',
+        'primary_title': 'track_name',
+        'artist_name': 'artist',
+        'media_cover_url': 'album_art',
+        'secondary_title': None,
+        'position': 'position',
+    }
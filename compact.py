@@ -0,0 +1,44 @@
+import datetime
+import json
+import logging
+
+import typer
+
+from chartmetric_challenge.compaction import DEFAULT_RETENTION_POLICY, LOG_TABLE_ID_COLUMNS, compact, parse_retention_policy
+
+
+def main(
+    pg_connection_string: str,
+    policy: str = DEFAULT_RETENTION_POLICY,
+    as_of: str = None,
+    tables: str = ",".join(LOG_TABLE_ID_COLUMNS),
+    buckets_per_batch: int = 4,
+    log_level: str = "INFO",
+):
+    '''
+    Compacts the *_log tables by age: with the default policy "90:week,365:month"
+    rows older than 90 days only keep the last row per entity (eg playlist) per
+    week and rows older than 365 days the last row per month. Ages are
+    relative to as_of (an ISO timestamp, now by default).
+
+    Rows are deleted buckets_per_batch buckets at a time, each batch in its own
+    transaction, so it can run next to ingests and be rerun if interrupted.
+    Prints the rows before and after for each table.
+    '''
+    logging.basicConfig(level=log_level)
+
+    tiers = parse_retention_policy(policy)
+    table_names = [t for t in tables.split(',') if t]
+    for table_name in table_names:
+        if table_name not in LOG_TABLE_ID_COLUMNS:
+            raise ValueError(f"tables must be in {list(LOG_TABLE_ID_COLUMNS)}")
+    if buckets_per_batch < 1:
+        raise ValueError("buckets_per_batch must be at least 1")
+    as_of_timestamp = datetime.datetime.fromisoformat(as_of) if as_of else datetime.datetime.now()
+
+    report = compact(pg_connection_string, tiers, as_of_timestamp, table_names, buckets_per_batch)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,50 @@
+import csv
+import logging
+import os
+import time
+
+import typer
+
+from chartmetric_challenge.constants import MEDIA_ITEM_ISRC_FILENAME
+from chartmetric_challenge.isrc_matching import IsrcIndex, match_media_items, read_media_items
+from chartmetric_challenge.pg_copy import PgCopyLoader
+
+
+def main(
+    output_directory: str,
+    catalog_path: str = "cm_track.csv",
+    intermediate_format: str = "csv",
+    pg_connection_string: str = None,
+    state_directory: str = None,
+    log_level: str = "INFO",
+):
+    '''
+    Matches the media items in output_directory (from a main.py run) to the
+    ISRCs in catalog_path and writes media_item_isrc.csv to output_directory,
+    with how each match was made and a confidence between 0 and 1. Loads the
+    matches into the media_item_isrc table if pg_connection_string is given,
+    replacing any earlier match for the same media item.
+
+    An incremental convert only outputs the artists it added, give the
+    state_directory it used (or pg_connection_string) to look up the names
+    of the others.
+    '''
+    logging.basicConfig(level=log_level)
+
+    start = time.perf_counter()
+    index = IsrcIndex.from_catalog(catalog_path)
+    logging.info(f"Indexed {len(index)} catalog tracks in {time.perf_counter() - start:.3f}s")
+
+    media_item_isrc_path = os.path.join(output_directory, MEDIA_ITEM_ISRC_FILENAME)
+    with open(media_item_isrc_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, ['media_item_id', 'isrc', 'match_type', 'confidence'])
+        writer.writeheader()
+        writer.writerows(match_media_items(index, read_media_items(output_directory, intermediate_format, state_directory, pg_connection_string)))
+
+    if pg_connection_string is not None:
+        with PgCopyLoader(pg_connection_string) as loader:
+            loader.copy_csv(media_item_isrc_path, 'media_item_isrc', conflict_columns=['media_item_id'], update=True)
+
+
+if __name__ == "__main__":
+    typer.run(main)
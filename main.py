@@ -1,8 +1,11 @@
+import glob
 import logging
 
 import typer
 
-from chartmetric_challenge import VALID_INGESTORS
+from chartmetric_challenge import VALID_INGESTORS, ingestor_class
+from chartmetric_challenge.constants import GRANULARITIES, LOAD_MODES, JSON_FORMATS, INTERMEDIATE_FORMATS, PG_LOAD_MODES
+from chartmetric_challenge.pipeline import ingest_files
 
 
 def main(
@@ -12,22 +15,157 @@ def main(
     pg_connection_string: str,
     granularity: str = "day",
     log_level: str = "INFO",
+    load_mode: str = "pandas",
+    json_format: str = "array",
+    batch_size: int = 50_000,
+    copy_chunk_size: int = 8 * 1024 * 1024,
+    state_directory: str = None,
+    intermediate_format: str = "csv",
+    duckdb_database: str = ":memory:",
+    duckdb_memory_limit: str = None,
+    duckdb_threads: int = None,
+    duckdb_temp_directory: str = None,
+    pg_load_mode: str = "append",
+    profile: bool = False,
+    profile_queries: bool = False,
+    dead_letter_path: str = None,
+    extra_granularities: str = "",
+    canonicalize_artists: bool = False,
+    queue_size: int = 1,
+    pg_max_concurrency: int = 1,
 ):
     '''
     Given a source_path to the input file, an ingestor_type (see `constants.py`),
     then outputs CSVs to the output_directory which are then loaded into the
     database specified by pg_connection_string.
 
-    Currently, the only supported granularity is "day", which means it loads only the
-    latest record for each day if there are multiple records for the same entity on
-    the same day.
+    source_path can also be a glob (quote it) or a comma separated list of
+    paths and globs, eg "scrapes/2022-05-19T*.json". The files are ingested in
+    order as a pipeline which parses the next file while converting one and
+    loading the one before, with at most queue_size files waiting between
+    each step. Each file's output goes to its own directory under
+    output_directory and the IDs carry on from file to file through the
+    state_directory (output_directory/state by default).
+
+    granularity is one of "hour", "day" (the default), "week" or "month", it
+    loads only the latest record for each interval if there are multiple records
+    for the same entity in the same interval. extra_granularities is a comma
+    separated list of other granularities to also write the log tables at, eg
+    "hour,week" writes playlist_positions_log_hour.csv and
+    playlist_positions_log_week.csv. Only granularity is loaded into the database.
+
+    canonicalize_artists gives spellings and collaborations of an artist (eg
+    "The Weeknd" and "THE WEEKND ft. Daft Punk") the same artist ID.
+
+    load_mode "stream" parses the source file incrementally in batches of
+    batch_size records and "duckdb" lets DuckDB read the file directly, both
+    use much less memory than the default "pandas". Use json_format
+    "newline_delimited" for files with one JSON record per line.
+
+    Pass the same state_directory to every run to ingest incrementally, each
+    run then only processes records newer than the ones already ingested and
+    keeps the IDs from previous runs.
+
+    intermediate_format "parquet" or "arrow" writes typed, compressed files to
+    the output_directory instead of CSVs, which are smaller and faster to load.
+
+    The duckdb_ options configure the ingestor's own DuckDB connection, eg an
+    on-disk duckdb_database plus a duckdb_memory_limit and a
+    duckdb_temp_directory to spill to. With an on-disk duckdb_database and
+    load_mode "duckdb" the intermediate tables live in the file, so sources
+    bigger than memory can be converted.
+
+    pg_load_mode "upsert" merges the output into the existing tables through
+    staging tables instead of appending to them, so re-running an ingest
+    doesn't fail on the unique keys and skips rows that are already loaded.
+    It needs a state_directory, so the IDs of the rerun match the ones
+    already loaded.
+
+    With a pg_max_concurrency over 1 the ID tables are loaded at once over up
+    to that many connections, then the log tables (each with its current
+    table). Each of those commits on its own, so a failed load can leave part
+    of the output loaded, use pg_load_mode "upsert" to be able to rerun it.
+    Keep it low on a shared database.
+
+    profile writes run_report.json to the output_directory with the time,
+    rows in/out and peak memory of every stage. profile_queries also saves
+    DuckDB's profile of each log table query to output_directory/query_profiles.
+
+    Records with a missing playlist_id, video_id or timestp, or with values
+    that aren't valid timestamps or integers, are skipped and written to
+    dead_letter_path (output_directory/dead_letter.jsonl by default, use a
+    .parquet path for parquet) with the reason they were rejected.
     '''
     logging.basicConfig(level=log_level)
 
+    extra_granularity_list = [g for g in extra_granularities.split(',') if g]
+    for g in [granularity] + extra_granularity_list:
+        if g not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {GRANULARITIES}")
     if ingestor_type not in VALID_INGESTORS:
-        raise ValueError(f"ingestor_type must be one of {VALID_INGESTORS}")
+        raise ValueError(f"ingestor_type must be one of {list(VALID_INGESTORS)}")
+    if load_mode not in LOAD_MODES:
+        raise ValueError(f"load_mode must be one of {LOAD_MODES}")
+    if json_format not in JSON_FORMATS:
+        raise ValueError(f"json_format must be one of {JSON_FORMATS}")
+    if intermediate_format not in INTERMEDIATE_FORMATS:
+        raise ValueError(f"intermediate_format must be one of {INTERMEDIATE_FORMATS}")
+    if pg_load_mode not in PG_LOAD_MODES:
+        raise ValueError(f"pg_load_mode must be one of {PG_LOAD_MODES}")
+    if pg_max_concurrency < 1:
+        raise ValueError("pg_max_concurrency must be at least 1")
+
+    source_paths = []
+    for pattern in source_path.split(','):
+        source_paths.extend(sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern])
+    if not source_paths:
+        raise ValueError(f"source_path {source_path} doesn't match any files")
+    if len(source_paths) > 1 and dead_letter_path is not None:
+        raise ValueError("dead_letter_path can't be used with several source files, each file's rejects go to its output directory")
+
+    ingestor_kwargs = dict(
+        load_mode=load_mode,
+        json_format=json_format,
+        batch_size=batch_size,
+        copy_chunk_size=copy_chunk_size,
+        intermediate_format=intermediate_format,
+        duckdb_database=duckdb_database,
+        duckdb_memory_limit=duckdb_memory_limit,
+        duckdb_threads=duckdb_threads,
+        duckdb_temp_directory=duckdb_temp_directory,
+        pg_load_mode=pg_load_mode,
+        profile=profile,
+        profile_queries=profile_queries,
+        extra_granularities=extra_granularity_list,
+        canonicalize_artists=canonicalize_artists,
+        pg_max_concurrency=pg_max_concurrency,
+    )
+    if len(source_paths) > 1:
+        logging.info(f"Starting ingestor {ingestor_type} on {len(source_paths)} files")
+        summary = ingest_files(
+            ingestor_class(ingestor_type),
+            granularity,
+            source_paths,
+            output_directory,
+            pg_connection_string,
+            state_directory=state_directory,
+            queue_size=queue_size,
+            **ingestor_kwargs,
+        )
+        stage_seconds = ', '.join(f"{name} {seconds:.1f}s" for name, seconds in summary['stage_seconds'].items())
+        print(f"Ingested {summary['files']} files ({summary['records']} records) in {summary['seconds']:.1f}s ({stage_seconds})")
+        logging.info(f"Finished ingestor {ingestor_type}")
+        return
 
-    ingestor = VALID_INGESTORS[ingestor_type](granularity, source_path, output_directory, pg_connection_string)
+    ingestor = ingestor_class(ingestor_type)(
+        granularity,
+        source_paths[0],
+        output_directory,
+        pg_connection_string,
+        state_directory=state_directory,
+        dead_letter_path=dead_letter_path,
+        **ingestor_kwargs,
+    )
     logging.info(f"Starting ingestor {ingestor_type}")
     ingestor.ingest()
     logging.info(f"Finished ingestor {ingestor_type}")
@@ -0,0 +1,75 @@
+import logging
+
+import typer
+
+from chartmetric_challenge import VALID_INGESTORS, ingestor_class
+from chartmetric_challenge.constants import GRANULARITIES, LOAD_MODES, JSON_FORMATS, INTERMEDIATE_FORMATS, SHARD_BYS
+from chartmetric_challenge.partitioned import ingest_partitioned
+
+
+def main(
+    source_path: str,
+    ingestor_type: str,
+    output_directory: str,
+    pg_connection_string: str,
+    num_shards: int = 4,
+    shard_by: str = "playlist",
+    max_workers: int = None,
+    granularity: str = "day",
+    log_level: str = "INFO",
+    load_mode: str = "duckdb",
+    json_format: str = "array",
+    intermediate_format: str = "csv",
+    extra_granularities: str = "",
+    canonicalize_artists: bool = False,
+    state_directory: str = None,
+):
+    '''
+    Same as main.py, but the source rows are split into num_shards shards (by
+    playlist_id hash or by date range, see shard_by) which are converted in
+    parallel by up to max_workers processes. The output is the same as a
+    main.py run. extra_granularities have to be made of whole granularity
+    intervals, eg "week,month" with the default "day". Pass the same
+    state_directory as main.py runs to carry on from them (and they from it).
+    '''
+    logging.basicConfig(level=log_level)
+
+    extra_granularity_list = [g for g in extra_granularities.split(',') if g]
+    for g in [granularity] + extra_granularity_list:
+        if g not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {GRANULARITIES}")
+    if ingestor_type not in VALID_INGESTORS:
+        raise ValueError(f"ingestor_type must be one of {list(VALID_INGESTORS)}")
+    if shard_by not in SHARD_BYS:
+        raise ValueError(f"shard_by must be one of {SHARD_BYS}")
+    if load_mode not in LOAD_MODES:
+        raise ValueError(f"load_mode must be one of {LOAD_MODES}")
+    if json_format not in JSON_FORMATS:
+        raise ValueError(f"json_format must be one of {JSON_FORMATS}")
+    if intermediate_format not in INTERMEDIATE_FORMATS:
+        raise ValueError(f"intermediate_format must be one of {INTERMEDIATE_FORMATS}")
+
+    logging.info(f"Starting partitioned ingestor {ingestor_type}")
+    shard_timings = ingest_partitioned(
+        ingestor_class(ingestor_type),
+        granularity,
+        source_path,
+        output_directory,
+        pg_connection_string,
+        num_shards=num_shards,
+        shard_by=shard_by,
+        max_workers=max_workers,
+        load_mode=load_mode,
+        json_format=json_format,
+        intermediate_format=intermediate_format,
+        extra_granularities=extra_granularity_list,
+        canonicalize_artists=canonicalize_artists,
+        state_directory=state_directory,
+    )
+    for timing in shard_timings:
+        print(f"{timing['shard']}: {timing['rows']} rows in {timing['seconds']:.3f}s")
+    logging.info(f"Finished partitioned ingestor {ingestor_type}")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -4,6 +4,7 @@ create type SOURCE as enum ('YOUTUBE', 'SPOTIFY');
 
 create table users (
     -- NOTE handle bigserial starting at 1 even though I'm inserting not at 1...
+    -- (incremental ingests keep their own ID dictionaries so always insert IDs)
     id bigserial primary key,
     source SOURCE not null,
     source_id varchar not null,
@@ -31,43 +32,62 @@ create table artists (
     unique (name)
 );
 
-create table playlist_metadata_log (
+-- The latest row of each log table per ID, kept up to date by every load so
+-- eg what's on a playlist now is a primary key lookup instead of a search
+-- through the whole log. Rows are only replaced by ones with a later
+-- ingest_timestamp.
+
+create table playlist_metadata_current (
     playlist_id bigint not null references playlists(id),
     ingest_timestamp timestamp not null,
     name varchar,
     cover_url varchar,
     user_id bigint references users(id),
     num_media_items int,
-    primary key (playlist_id, ingest_timestamp)
+    primary key (playlist_id)
 );
 
-create table playlist_plays_log (
+create table playlist_plays_current (
     playlist_id bigint not null references playlists(id),
     ingest_timestamp timestamp not null,
     plays bigint,
-    primary key (playlist_id, ingest_timestamp)
+    primary key (playlist_id)
 );
 
-create table playlist_positions_log (
+create table playlist_positions_current (
     playlist_id bigint not null references playlists(id),
     media_item_id bigint not null references media_items(id),
     ingest_timestamp timestamp not null,
     position int,
-    primary key (playlist_id, media_item_id, ingest_timestamp)
+    primary key (playlist_id, media_item_id)
 );
 
-create table media_item_metadata_log (
+create table media_item_metadata_current (
     media_item_id bigint not null references media_items(id),
     ingest_timestamp timestamp not null,
     primary_title varchar,
     secondary_title varchar,
     artist_id bigint references artists(id),
     cover_url varchar,
-    primary key (media_item_id, ingest_timestamp)
+    primary key (media_item_id)
 );
 
+-- Replaced as a whole by isrc.py, which also builds its indexes
 create table isrc_lookup (
+    cm_track bigint,
     track varchar,
+    isrc varchar collate "C" primary key,
+    cm_artist bigint,
     artist varchar,
-    isrc varchar
+    -- see isrc_matching.normalize_title
+    normalized_title varchar
+);
+
+create table media_item_isrc (
+    media_item_id bigint not null references media_items(id),
+    isrc varchar not null,
+    -- how the match was made, see isrc_matching.py
+    match_type varchar not null,
+    confidence real not null,
+    primary key (media_item_id)
 );
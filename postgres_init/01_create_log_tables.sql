@@ -0,0 +1,37 @@
+-- The log tables, after 00_create_tables.sql. postgres_init_partitioned has a
+-- version of this file with them partitioned by month instead.
+
+create table playlist_metadata_log (
+    playlist_id bigint not null references playlists(id),
+    ingest_timestamp timestamp not null,
+    name varchar,
+    cover_url varchar,
+    user_id bigint references users(id),
+    num_media_items int,
+    primary key (playlist_id, ingest_timestamp)
+);
+
+create table playlist_plays_log (
+    playlist_id bigint not null references playlists(id),
+    ingest_timestamp timestamp not null,
+    plays bigint,
+    primary key (playlist_id, ingest_timestamp)
+);
+
+create table playlist_positions_log (
+    playlist_id bigint not null references playlists(id),
+    media_item_id bigint not null references media_items(id),
+    ingest_timestamp timestamp not null,
+    position int,
+    primary key (playlist_id, media_item_id, ingest_timestamp)
+);
+
+create table media_item_metadata_log (
+    media_item_id bigint not null references media_items(id),
+    ingest_timestamp timestamp not null,
+    primary_title varchar,
+    secondary_title varchar,
+    artist_id bigint references artists(id),
+    cover_url varchar,
+    primary key (media_item_id, ingest_timestamp)
+);
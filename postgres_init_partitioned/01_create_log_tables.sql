@@ -0,0 +1,43 @@
+-- Used in place of postgres_init/01_create_log_tables.sql, after
+-- postgres_init/00_create_tables.sql which holds the rest of the schema.
+--
+-- The log tables are partitioned by month of ingest_timestamp so range queries
+-- only scan the months they cover and old months can be detached or dropped
+-- without a big DELETE. csvs_to_pg creates the partitions a load needs, named
+-- eg playlist_positions_log_2022_05. There's no default partition since
+-- creating a partition would then have to scan it.
+
+create table playlist_metadata_log (
+    playlist_id bigint not null references playlists(id),
+    ingest_timestamp timestamp not null,
+    name varchar,
+    cover_url varchar,
+    user_id bigint references users(id),
+    num_media_items int,
+    primary key (playlist_id, ingest_timestamp)
+) partition by range (ingest_timestamp);
+
+create table playlist_plays_log (
+    playlist_id bigint not null references playlists(id),
+    ingest_timestamp timestamp not null,
+    plays bigint,
+    primary key (playlist_id, ingest_timestamp)
+) partition by range (ingest_timestamp);
+
+create table playlist_positions_log (
+    playlist_id bigint not null references playlists(id),
+    media_item_id bigint not null references media_items(id),
+    ingest_timestamp timestamp not null,
+    position int,
+    primary key (playlist_id, media_item_id, ingest_timestamp)
+) partition by range (ingest_timestamp);
+
+create table media_item_metadata_log (
+    media_item_id bigint not null references media_items(id),
+    ingest_timestamp timestamp not null,
+    primary_title varchar,
+    secondary_title varchar,
+    artist_id bigint references artists(id),
+    cover_url varchar,
+    primary key (media_item_id, ingest_timestamp)
+) partition by range (ingest_timestamp);
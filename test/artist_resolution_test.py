@@ -0,0 +1,54 @@
+from chartmetric_challenge.artist_resolution import ArtistResolver, artist_key
+from chartmetric_challenge.youtube_playlist_pg import YoutubePlaylistPgIngestor
+
+import pandas as pd
+
+from conftest import make_row
+
+
+def test_artist_key():
+    assert artist_key('BEYONCÉ') == 'beyonce'
+    assert artist_key('Jay-Z') == 'jay z'
+
+
+def test_resolve():
+    resolver = ArtistResolver()
+    assert resolver.resolve('The Weeknd') == ('the weeknd', 'The Weeknd')
+    assert resolver.resolve('THE WEEKND feat. Daft Punk') == ('the weeknd', 'The Weeknd')
+    assert resolver.resolve('The Weeknd (ft. Ariana Grande)') == ('the weeknd', 'The Weeknd')
+    assert resolver.resolve('Lil Nas X x Jack Harlow') == ('lil nas x', 'Lil Nas X')
+    # & only splits off a known artist
+    assert resolver.resolve('Mumford & Sons') == ('mumford sons', 'Mumford & Sons')
+    assert resolver.resolve('The Weeknd & Ariana Grande') == ('the weeknd', 'The Weeknd')
+
+
+def test_alias_table_resolves_single_artists_first():
+    aliases = ArtistResolver().alias_table(['Doja Cat, SZA', 'Doja Cat'])
+    assert aliases.to_pydict() == {
+        'raw_name': ['Doja Cat', 'Doja Cat, SZA'],
+        'canonical_key': ['doja cat', 'doja cat'],
+        'name': ['Doja Cat', 'Doja Cat'],
+    }
+
+
+def test_canonicalize_artists_across_runs(tmp_path):
+    state_directory = str(tmp_path / 'state')
+    first = YoutubePlaylistPgIngestor('day', None, str(tmp_path / 'first'), None, state_directory=state_directory, canonicalize_artists=True)
+    first.convert(pd.DataFrame([
+        make_row('2022-05-19T12:00:00', 'v1', artist_name='The Weeknd', num_videos=2),
+        make_row('2022-05-19T12:00:00', 'v2', artist_name='the weeknd ft. Daft Punk', num_videos=2),
+    ]))
+    first.commit_state()
+    second = YoutubePlaylistPgIngestor('day', None, str(tmp_path / 'second'), None, state_directory=state_directory, canonicalize_artists=True)
+    second.convert(pd.DataFrame([
+        make_row('2022-05-20T12:00:00', 'v3', artist_name='THE WEEKND', num_videos=2),
+        make_row('2022-05-20T12:00:00', 'v4', artist_name='Daft Punk', num_videos=2),
+    ]))
+    second.commit_state()
+
+    assert pd.read_csv(tmp_path / 'first' / 'artists.csv').values.tolist() == [[1, 'The Weeknd']]
+    assert pd.read_csv(tmp_path / 'second' / 'artists.csv').values.tolist() == [[2, 'Daft Punk']]
+    first_metadata = pd.read_csv(tmp_path / 'first' / 'media_item_metadata.csv')
+    second_metadata = pd.read_csv(tmp_path / 'second' / 'media_item_metadata.csv')
+    assert first_metadata['artist_id'].tolist() == [1, 1]
+    assert second_metadata.sort_values('media_item_id')['artist_id'].tolist() == [1, 2]
@@ -0,0 +1,56 @@
+import datetime
+
+import duckdb
+import pytest
+
+from chartmetric_challenge.compaction import RetentionTier, add_buckets, compact_sql, iter_batches, parse_retention_policy, tier_ranges
+
+
+def test_parse_retention_policy():
+    assert parse_retention_policy('365:month,90:week') == [RetentionTier(90, 'week'), RetentionTier(365, 'month')]
+    with pytest.raises(ValueError):
+        parse_retention_policy('90:fortnight')
+    with pytest.raises(ValueError):
+        parse_retention_policy('90:month,365:week')
+
+
+def test_add_buckets():
+    assert add_buckets(datetime.datetime(2022, 11, 1), 'month', 3) == datetime.datetime(2023, 2, 1)
+
+
+def test_tier_ranges_and_batches():
+    tiers = parse_retention_policy('90:week,365:month')
+    ranges = tier_ranges(tiers, datetime.datetime(2023, 6, 15, 12))
+    assert ranges == [
+        # 2023-03-17 rounded down to monday
+        (RetentionTier(90, 'week'), datetime.datetime(2022, 6, 1), datetime.datetime(2023, 3, 13)),
+        (RetentionTier(365, 'month'), None, datetime.datetime(2022, 6, 1)),
+    ]
+    batches = list(iter_batches(datetime.datetime(2022, 6, 1), datetime.datetime(2022, 7, 1), 'week', 2))
+    assert batches == [
+        (datetime.datetime(2022, 6, 1), datetime.datetime(2022, 6, 13)),
+        (datetime.datetime(2022, 6, 13), datetime.datetime(2022, 6, 27)),
+        (datetime.datetime(2022, 6, 27), datetime.datetime(2022, 7, 1)),
+    ]
+
+
+def test_compact_sql():
+    con = duckdb.connect()
+    con.execute('CREATE TABLE playlist_positions_log (playlist_id BIGINT, media_item_id BIGINT, ingest_timestamp TIMESTAMP, position INT)')
+    con.execute('''
+INSERT INTO playlist_positions_log VALUES
+    (1, 1, '2022-05-30 10:00', 1),
+    (1, 1, '2022-06-01 10:00', 2),
+    (1, 2, '2022-06-01 10:00', 5),
+    (1, 1, '2022-06-05 10:00', 3),
+    (1, 1, '2022-06-06 10:00', 4),
+    (1, 1, '2022-06-07 10:00', 5)
+''')
+    con.execute(compact_sql('playlist_positions_log', ['playlist_id', 'media_item_id'], 'week', datetime.datetime(2022, 5, 30), datetime.datetime(2022, 6, 7)))
+    assert con.sql('SELECT media_item_id, position FROM playlist_positions_log ORDER BY ALL').fetchall() == [
+        (1, 3),
+        # 2022-06-06 is the last row before the end of the range
+        (1, 4),
+        (1, 5),
+        (2, 5),
+    ]
@@ -1,3 +1,4 @@
+import json
 import tempfile
 
 import pytest
@@ -38,14 +39,44 @@ TEST_PLAYLIST_YOUTUBE_JSON_STR = '''
 ]
 '''
 
+
+def make_row(timestp, video_id, position=1, **overrides):
+    row = {
+        "playlist_id": "p1",
+        "playlist_name": "pn1",
+        "artwork_url": "au1",
+        "channel_id": "c1",
+        "views": 1,
+        "num_videos": 1,
+        "timestp": timestp,
+        "video_id": video_id,
+        "title": "t1",
+        "artist_name": "an1",
+        "image_url": "i1",
+        "track_title": "tt1",
+        "position": position,
+    }
+    row.update(overrides)
+    return row
+
+
 @pytest.fixture
 def youtube_playlist_json_file():
-    with tempfile.NamedTemporaryFile(mode='w') as f:
+    with tempfile.NamedTemporaryFile(mode='w', encoding='utf-8') as f:
         f.write(TEST_PLAYLIST_YOUTUBE_JSON_STR)
         f.flush()
         yield f.name
 
 
+@pytest.fixture
+def youtube_playlist_ndjson_file():
+    with tempfile.NamedTemporaryFile(mode='w', encoding='utf-8') as f:
+        for record in json.loads(TEST_PLAYLIST_YOUTUBE_JSON_STR):
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        f.flush()
+        yield f.name
+
+
 @pytest.fixture
 def output_directory():
     with tempfile.TemporaryDirectory() as d:
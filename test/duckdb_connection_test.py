@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from chartmetric_challenge.duckdb_connection import connect
+from chartmetric_challenge.youtube_playlist_pg import YoutubePlaylistPgIngestor
+
+import pandas as pd
+
+
+def test_connect_config(tmp_path):
+    con = connect(str(tmp_path / 'ingest.duckdb'), memory_limit='1GB', threads=2, temp_directory=str(tmp_path / 'spill'))
+    assert con.sql("SELECT current_setting('threads')").fetchone()[0] == 2
+    assert con.sql("SELECT current_setting('temp_directory')").fetchone()[0] == str(tmp_path / 'spill')
+    con.close()
+
+
+def make_df(playlist_count):
+    return pd.DataFrame([
+        {
+            "playlist_id": f"p{p}",
+            "playlist_name": f"pn{p}",
+            "artwork_url": "au1",
+            "channel_id": "c1",
+            "views": day,
+            "num_videos": 1,
+            "timestp": f"2022-05-{19 + day}T12:00:00",
+            "video_id": "v1",
+            "title": "t1",
+            "artist_name": "an1",
+            "image_url": "i1",
+            "track_title": "tt1",
+            "position": 1,
+        }
+        for p in range(playlist_count)
+        for day in range(3)
+    ])
+
+
+def test_parallel_ingestors(tmp_path):
+    def convert(playlist_count):
+        ingestor = YoutubePlaylistPgIngestor('day', None, str(tmp_path / str(playlist_count)), None)
+        ingestor.convert(make_df(playlist_count))
+        ingestor.close()
+        return len(pd.read_csv(tmp_path / str(playlist_count) / 'playlist_plays_log.csv'))
+
+    playlist_counts = [1, 2, 3, 4, 5, 6, 7, 8]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        plays_log_lengths = list(executor.map(convert, playlist_counts))
+    # plays change every day so each playlist has three rows
+    assert plays_log_lengths == [3 * c for c in playlist_counts]
+
+
+def test_on_disk_convert(tmp_path):
+    in_memory = YoutubePlaylistPgIngestor('day', None, str(tmp_path / 'in_memory'), None)
+    in_memory.convert(make_df(3))
+    on_disk = YoutubePlaylistPgIngestor(
+        'day', None, str(tmp_path / 'on_disk'), None,
+        duckdb_database=str(tmp_path / 'ingest.duckdb'), duckdb_memory_limit='100MB', duckdb_temp_directory=str(tmp_path / 'spill'),
+    )
+    on_disk.convert(make_df(3))
+    on_disk.close()
+    for filename in ['playlist_plays_log.csv', 'playlist_positions_log.csv', 'media_item_metadata.csv']:
+        assert (tmp_path / 'on_disk' / filename).read_text() == (tmp_path / 'in_memory' / filename).read_text()
+
+    # every intermediate table is dropped once it has been used
+    con = connect(str(tmp_path / 'ingest.duckdb'))
+    assert con.sql('SHOW TABLES').fetchall() == []
+    con.close()
@@ -0,0 +1,82 @@
+from chartmetric_challenge.pg_ingestor import reduction_granularity
+from chartmetric_challenge.youtube_playlist_pg import YoutubePlaylistPgIngestor
+
+import pandas as pd
+import pytest
+
+
+def make_df(timestamps_and_positions):
+    return pd.DataFrame([
+        {
+            "playlist_id": "p1",
+            "playlist_name": "pn1",
+            "artwork_url": "au1",
+            "channel_id": "c1",
+            "views": 1,
+            "num_videos": 1,
+            "timestp": timestp,
+            "video_id": "v1",
+            "title": "t1",
+            "artist_name": "an1",
+            "image_url": "i1",
+            "track_title": "tt1",
+            "position": position,
+        }
+        for timestp, position in timestamps_and_positions
+    ])
+
+
+DF = make_df([
+    ('2022-05-30T10:05:00', 1),
+    ('2022-05-30T10:55:00', 2),
+    ('2022-05-30T11:30:00', 3),
+    ('2022-05-31T09:00:00', 3),
+    ('2022-06-01T09:00:00', 4),
+    ('2022-06-02T09:00:00', 4),
+])
+
+
+def read_positions(path):
+    df = pd.read_csv(path)
+    return list(zip(df['ingest_timestamp'], df['position']))
+
+
+def test_reduction_granularity():
+    assert reduction_granularity(['day', 'hour', 'month']) == 'hour'
+    assert reduction_granularity(['week', 'month']) == 'day'
+    assert reduction_granularity(['month']) == 'month'
+
+
+def test_hour_granularity(output_directory):
+    ingestor = YoutubePlaylistPgIngestor('hour', None, output_directory, None)
+    ingestor.convert(DF)
+    assert read_positions(f'{output_directory}/playlist_positions_log.csv') == [
+        ('2022-05-30 10:55:00', 2),
+        ('2022-05-30 11:30:00', 3),
+        ('2022-06-01 09:00:00', 4),
+    ]
+
+
+@pytest.mark.parametrize('granularity,extra_granularities', [
+    ('day', ['hour', 'week', 'month']),
+    ('week', ['month']),
+])
+def test_extra_granularities(granularity, extra_granularities, tmp_path):
+    ingestor = YoutubePlaylistPgIngestor(granularity, None, str(tmp_path / 'all'), None, extra_granularities=extra_granularities)
+    ingestor.convert(DF)
+    for g in [granularity] + extra_granularities:
+        single = YoutubePlaylistPgIngestor(g, None, str(tmp_path / g), None)
+        single.convert(DF)
+        suffix = '' if g == granularity else f'_{g}'
+        assert read_positions(tmp_path / 'all' / f'playlist_positions_log{suffix}.csv') == read_positions(tmp_path / g / 'playlist_positions_log.csv')
+    # week starts on monday 2022-05-30, the month changes part way through it
+    assert read_positions(tmp_path / 'month' / 'playlist_positions_log.csv') == [
+        ('2022-05-31 09:00:00', 3),
+        ('2022-06-02 09:00:00', 4),
+    ]
+
+
+def test_invalid_granularity(output_directory):
+    ingestor = YoutubePlaylistPgIngestor('minute', None, output_directory, None)
+    with pytest.raises(ValueError):
+        ingestor.convert(DF)
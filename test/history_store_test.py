@@ -0,0 +1,115 @@
+import concurrent.futures
+import datetime
+import os
+
+import pandas as pd
+import pyarrow.parquet
+
+from chartmetric_challenge.history_store import (
+    MANIFEST_FILENAME,
+    HistoryStore,
+    compact_history_store,
+    history_store_path,
+    read_manifest,
+    update_history_store,
+)
+from chartmetric_challenge.youtube_playlist_pg import YoutubePlaylistPgIngestor
+
+from conftest import make_row
+
+
+def convert(tmp_path, name, rows):
+    ingestor = YoutubePlaylistPgIngestor('day', None, str(tmp_path / name), None, state_directory=str(tmp_path / 'state'))
+    ingestor.convert(pd.DataFrame(rows))
+    ingestor.commit_state()
+    ingestor.close()
+    return str(tmp_path / name)
+
+
+def test_history_store(tmp_path):
+    first = convert(tmp_path, 'first', [
+        make_row("2022-05-19T12:00:00", "v1", 1),
+        make_row("2022-05-19T12:00:00", "v2", 2),
+        make_row("2022-05-20T12:00:00", "v1", 2),
+        make_row("2022-05-20T12:00:00", "v2", 1),
+    ])
+    store_directory = str(tmp_path / 'history')
+    assert update_history_store(store_directory, [first], row_group_size=2)['playlist_positions_log'] == 4
+
+    store = HistoryStore(store_directory)
+    history = store.get_position_history(playlist_id=1, media_item_id=1)
+    assert history[['ingest_timestamp', 'position']].values.tolist() == [
+        [pd.Timestamp('2022-05-19 12:00:00'), 1],
+        [pd.Timestamp('2022-05-20 12:00:00'), 2],
+    ]
+    # sorted by media item, so its rows are the first of the two row groups
+    assert store.cache_info() == {'hits': 0, 'misses': 1, 'row_groups': 1}
+    store.get_position_history(playlist_id=1, media_item_id=1)
+    assert store.cache_info()['hits'] == 1
+
+    history = store.get_position_history(playlist_id=1, start=datetime.datetime(2022, 5, 20), end=datetime.datetime(2022, 5, 21))
+    assert history[['media_item_id', 'position']].values.tolist() == [[1, 2], [2, 1]]
+    assert len(store.get_plays_history(playlist_id=1)) == 1
+    assert len(store.get_position_history(playlist_id=2)) == 0
+
+    # a later ingest is added as a file of its own, and picked up by the
+    # open store
+    second = convert(tmp_path, 'second', [make_row("2022-05-21T12:00:00", "v1", 3)])
+    update_history_store(store_directory, [second], row_group_size=2)
+    assert store.get_position_history(playlist_id=1, media_item_id=1)['position'].tolist() == [1, 2, 3]
+    table_directory = history_store_path(store_directory, 'playlist_positions_log')
+    filenames = read_manifest(table_directory)
+    assert len(filenames) == 2
+    table = pyarrow.parquet.read_table(os.path.join(table_directory, filenames[-1]))
+    assert table.column('media_item_id').to_pylist() == [1]
+
+    # outputs already in the store aren't added twice
+    update_history_store(store_directory, [first, second])
+    assert len(store.get_position_history(playlist_id=1)) == 5
+    assert not any(name.endswith('.tmp') for name in os.listdir(table_directory))
+
+
+def test_history_store_superseded_rows_and_compaction(tmp_path):
+    store_directory = str(tmp_path / 'history')
+    first = convert(tmp_path, 'first', [
+        make_row("2022-05-19T12:00:00", "v1", 1),
+        make_row("2022-05-20T06:00:00", "v1", 2),
+    ])
+    update_history_store(store_directory, [first])
+    # the next ingest starts part way through the 20th and supersedes its row
+    second = convert(tmp_path, 'second', [make_row("2022-05-20T18:00:00", "v1", 3)])
+    update_history_store(store_directory, [second])
+
+    store = HistoryStore(store_directory)
+    expected = [
+        [pd.Timestamp('2022-05-19 12:00:00'), 1],
+        [pd.Timestamp('2022-05-20 18:00:00'), 3],
+    ]
+    assert store.get_position_history(playlist_id=1)[['ingest_timestamp', 'position']].values.tolist() == expected
+
+    # the next update over max_files merges the files and drops the
+    # superseded row for good
+    third = convert(tmp_path, 'third', [make_row("2022-05-21T12:00:00", "v1", 4)])
+    update_history_store(store_directory, [third], max_files=2)
+    table_directory = history_store_path(store_directory, 'playlist_positions_log')
+    filenames = read_manifest(table_directory)
+    assert len(filenames) == 1
+    assert sorted(os.listdir(table_directory)) == sorted(filenames + [MANIFEST_FILENAME])
+    table = pyarrow.parquet.read_table(os.path.join(table_directory, filenames[0]))
+    assert table.column('position').to_pylist() == [1, 3, 4]
+    history = store.get_position_history(playlist_id=1)
+    assert history[['ingest_timestamp', 'position']].values.tolist() == expected + [[pd.Timestamp('2022-05-21 12:00:00'), 4]]
+    assert compact_history_store(store_directory)['playlist_positions_log'] == 3
+
+
+def test_history_store_threads(tmp_path):
+    rows = [make_row(f"2022-05-{day}T12:00:00", f"v{i}", (i + day) % 10) for day in range(19, 25) for i in range(10)]
+    store_directory = str(tmp_path / 'history')
+    update_history_store(store_directory, [convert(tmp_path, 'first', rows)], row_group_size=4)
+
+    store = HistoryStore(store_directory, cache_row_groups=2)
+    expected = {i: store.get_position_history(playlist_id=1, media_item_id=i)['position'].tolist() for i in range(1, 11)}
+    # a small cache so the threads keep reading row groups at the same time
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        results = executor.map(lambda i: (i, store.get_position_history(playlist_id=1, media_item_id=i)['position'].tolist()), list(range(1, 11)) * 20)
+        assert all(positions == expected[i] for i, positions in results)
@@ -0,0 +1,252 @@
+import datetime
+
+from chartmetric_challenge.pg_ingestor import LOG_TABLE_FILENAMES
+from chartmetric_challenge.youtube_playlist_pg import YoutubePlaylistPgIngestor
+import chartmetric_challenge.pg_ingestor
+
+import pandas as pd
+import pytest
+
+from conftest import make_row
+
+
+def test_incremental_convert(tmp_path):
+    first_rows = [
+        make_row("2022-05-19T12:00:00", "v1", 1),
+        make_row("2022-05-20T12:00:00", "v1", 2),
+    ]
+    second_rows = first_rows + [
+        # unchanged since the first run, dropped
+        make_row("2022-05-21T12:00:00", "v1", 2),
+        make_row("2022-05-21T12:00:00", "v2", 1),
+        make_row("2022-05-22T12:00:00", "v1", 3),
+    ]
+    state_directory = str(tmp_path / 'state')
+
+    first = YoutubePlaylistPgIngestor('day', None, str(tmp_path / 'first'), None, state_directory=state_directory)
+    first.convert(pd.DataFrame(first_rows))
+    first.commit_state()
+    second = YoutubePlaylistPgIngestor('day', None, str(tmp_path / 'second'), None, state_directory=state_directory)
+    second.convert(pd.DataFrame(second_rows))
+    second.commit_state()
+
+    first_media_items = pd.read_csv(tmp_path / 'first' / 'media_items.csv')
+    second_media_items = pd.read_csv(tmp_path / 'second' / 'media_items.csv')
+    assert first_media_items[['id', 'source_id']].values.tolist() == [[1, 'v1']]
+    assert second_media_items[['id', 'source_id']].values.tolist() == [[2, 'v2']]
+    assert len(pd.read_csv(tmp_path / 'second' / 'playlists.csv')) == 0
+
+    positions = pd.read_csv(tmp_path / 'second' / 'playlist_positions_log.csv')
+    assert positions[['media_item_id', 'ingest_timestamp', 'position']].values.tolist() == [
+        [2, '2022-05-21 12:00:00', 1],
+        [1, '2022-05-22 12:00:00', 3],
+    ]
+    # nothing changed in the playlist metadata after the first day
+    assert len(pd.read_csv(tmp_path / 'second' / 'playlist_metadata_log.csv')) == 0
+
+    # the latest change per ID in this run, loaded into the *_current tables
+    current_positions = pd.read_csv(tmp_path / 'second' / 'playlist_positions_current.csv')
+    assert current_positions[['media_item_id', 'ingest_timestamp', 'position']].values.tolist() == [
+        [1, '2022-05-22 12:00:00', 3],
+        [2, '2022-05-21 12:00:00', 1],
+    ]
+
+
+def test_incremental_convert_without_commit(tmp_path):
+    rows = [make_row("2022-05-19T12:00:00", "v1", 1)]
+    state_directory = str(tmp_path / 'state')
+
+    for output_directory in ['first', 'second']:
+        # without a commit the second run starts from scratch again
+        ingestor = YoutubePlaylistPgIngestor('day', None, str(tmp_path / output_directory), None, state_directory=state_directory)
+        ingestor.convert(pd.DataFrame(rows))
+
+    assert len(pd.read_csv(tmp_path / 'second' / 'playlist_positions_log.csv')) == 1
+
+
+@pytest.mark.parametrize('old_state', ['without_digests', 'with_duckdb_hashes'])
+def test_incremental_convert_state_without_row_digests(old_state, tmp_path):
+    # state written before the log rows' digests were kept in it, or when
+    # they were DuckDB hash()es which can change between versions
+    state_directory = tmp_path / 'state'
+    first = YoutubePlaylistPgIngestor('day', None, str(tmp_path / 'first'), None, state_directory=str(state_directory))
+    first.convert(pd.DataFrame([make_row("2022-05-19T12:00:00", "v1", 1)]))
+    first.commit_state()
+    state_path = state_directory / 'playlist_positions_log.parquet'
+    assert 'row_digest' in pd.read_parquet(state_path).columns
+    state = pd.read_parquet(state_path).drop(columns='row_digest')
+    if old_state == 'with_duckdb_hashes':
+        state['row_hash'] = 12345
+    state.to_parquet(state_path)
+
+    second = YoutubePlaylistPgIngestor('day', None, str(tmp_path / 'second'), None, state_directory=str(state_directory))
+    second.convert(pd.DataFrame([
+        make_row("2022-05-20T12:00:00", "v1", 1),
+        make_row("2022-05-21T12:00:00", "v1", 2),
+    ]))
+    second.commit_state()
+
+    positions = pd.read_csv(tmp_path / 'second' / 'playlist_positions_log.csv')
+    assert positions.columns.tolist() == ['playlist_id', 'media_item_id', 'ingest_timestamp', 'position']
+    assert positions[['ingest_timestamp', 'position']].values.tolist() == [['2022-05-21 12:00:00', 2]]
+    assert 'row_digest' in pd.read_parquet(state_path).columns
+
+
+def test_incremental_convert_splitting_a_day(tmp_path):
+    rows = [
+        make_row("2022-05-19T12:00:00", "v1", 1),
+        make_row("2022-05-20T06:00:00", "v1", 2),
+        # back to the first day's position by the end of the day
+        make_row("2022-05-20T18:00:00", "v1", 1),
+        make_row("2022-05-21T12:00:00", "v1", 3),
+    ]
+    columns = ['media_item_id', 'ingest_timestamp', 'position']
+    single = YoutubePlaylistPgIngestor('day', None, str(tmp_path / 'single'), None)
+    single.convert(pd.DataFrame(rows))
+    single_positions = pd.read_csv(tmp_path / 'single' / 'playlist_positions_log.csv')[columns].values.tolist()
+
+    # the second run starts part way through the 20th
+    state_directory = str(tmp_path / 'state')
+    positions = []
+    for output_directory, run_rows in [('first', rows[:2]), ('second', rows[2:3]), ('third', rows[3:])]:
+        ingestor = YoutubePlaylistPgIngestor('day', None, str(tmp_path / output_directory), None, state_directory=state_directory)
+        ingestor.convert(pd.DataFrame(run_rows))
+        ingestor.commit_state()
+        superseded_path = tmp_path / output_directory / 'playlist_positions_log_superseded.csv'
+        # only the second run starts in an interval a previous run wrote
+        assert superseded_path.exists() == (output_directory == 'second')
+        if output_directory == 'second':
+            superseded_keys = pd.read_csv(superseded_path)[['media_item_id', 'ingest_timestamp']].values.tolist()
+            assert superseded_keys == [[1, '2022-05-20 06:00:00']]
+            positions = [row for row in positions if row[:2] not in superseded_keys]
+        positions += pd.read_csv(tmp_path / output_directory / 'playlist_positions_log.csv')[columns].values.tolist()
+        if output_directory == 'second':
+            # nothing new to log, the current row goes back to the 19th's
+            current_positions = pd.read_csv(tmp_path / 'second' / 'playlist_positions_current.csv')
+            assert current_positions[columns].values.tolist() == [[1, '2022-05-19 12:00:00', 1]]
+
+    assert positions == single_positions == [
+        [1, '2022-05-19 12:00:00', 1],
+        [1, '2022-05-21 12:00:00', 3],
+    ]
+
+
+def test_incremental_convert_rerun_gives_same_ids(tmp_path):
+    state_directory = str(tmp_path / 'state')
+    first = YoutubePlaylistPgIngestor('day', None, str(tmp_path / 'first'), None, state_directory=state_directory)
+    first.convert(pd.DataFrame([make_row("2022-05-19T12:00:00", "v1", 1)]))
+    first.commit_state()
+
+    rows = [make_row("2022-05-20T12:00:00", f"v{i}", i) for i in [5, 3, 4, 2]]
+    for output_directory in ['second', 'retry']:
+        # a retry after a failed load, from the same state in a different order
+        ingestor = YoutubePlaylistPgIngestor('day', None, str(tmp_path / output_directory), None, state_directory=state_directory)
+        ingestor.convert(pd.DataFrame(rows))
+        rows.reverse()
+
+    for output_directory in ['second', 'retry']:
+        media_items = pd.read_csv(tmp_path / output_directory / 'media_items.csv')
+        assert media_items[['id', 'source_id']].values.tolist() == [[2, 'v2'], [3, 'v3'], [4, 'v4'], [5, 'v5']]
+
+
+class RecordingLoader:
+    '''
+    Stands in for PgCopyLoader against the postgres_init_partitioned schema,
+    recording the partitions, deletes and copies a load asks for.
+    '''
+    calls = []
+    # the calls made through each loader, in the order they were opened
+    loader_calls = []
+
+    def __init__(self, pg_connection_string, copy_chunk_size=None):
+        self._calls = []
+
+    def __enter__(self):
+        self.loader_calls.append(self._calls)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def partitioned_table_names(self):
+        return set(LOG_TABLE_FILENAMES)
+
+    def create_month_partitions(self, table_name, month_starts):
+        self.calls.append(('partitions', table_name, sorted(month_starts)))
+        return [f'{table_name}_{m:%Y_%m}' for m in sorted(set(month_starts))]
+
+    def delete_rows(self, path, table_names, intermediate_format):
+        self.calls.append(('delete', table_names[0]))
+        self._calls.append(('delete', table_names[0]))
+        return 0
+
+    def copy_csv(self, path, table_name, **kwargs):
+        self.calls.append(('copy', table_name))
+        self._calls.append(('copy', table_name))
+        return 0
+
+
+def test_incremental_rerun_partitioned_load(monkeypatch, tmp_path):
+    monkeypatch.setattr(chartmetric_challenge.pg_ingestor, 'PgCopyLoader', RecordingLoader)
+    monkeypatch.setattr(RecordingLoader, 'calls', [])
+    state_directory = str(tmp_path / 'state')
+    rows = [make_row("2022-05-19T12:00:00", "v1", 1)]
+
+    for output_directory in ['first', 'rerun']:
+        ingestor = YoutubePlaylistPgIngestor('day', None, str(tmp_path / output_directory), 'postgresql://unused', state_directory=state_directory)
+        ingestor.convert(pd.DataFrame(rows))
+        ingestor.csvs_to_pg()
+        ingestor.commit_state()
+
+    # nothing was superseded so nothing is deleted
+    assert not [c for c in RecordingLoader.calls if c[0] == 'delete']
+    assert not list((tmp_path / 'first').glob('*_superseded.csv'))
+    assert not list((tmp_path / 'rerun').glob('*_superseded.csv'))
+    # the rerun has nothing new, its log outputs are header-only
+    assert len(pd.read_csv(tmp_path / 'rerun' / 'playlist_plays_log.csv')) == 0
+    partitions = [c for c in RecordingLoader.calls if c[0] == 'partitions' and c[1] == 'playlist_plays_log']
+    assert [month_starts for _, _, month_starts in partitions] == [[datetime.datetime(2022, 5, 1)], []]
+
+
+def test_incremental_load_deletes_superseded_rows(monkeypatch, tmp_path):
+    monkeypatch.setattr(chartmetric_challenge.pg_ingestor, 'PgCopyLoader', RecordingLoader)
+    monkeypatch.setattr(RecordingLoader, 'calls', [])
+    state_directory = str(tmp_path / 'state')
+
+    for output_directory, timestp in [('first', "2022-05-20T06:00:00"), ('second', "2022-05-20T18:00:00")]:
+        ingestor = YoutubePlaylistPgIngestor('day', None, str(tmp_path / output_directory), 'postgresql://unused', state_directory=state_directory)
+        ingestor.convert(pd.DataFrame([make_row(timestp, "v1", 1)]))
+        ingestor.csvs_to_pg()
+        ingestor.commit_state()
+
+    # the second run replaces the first's row for the 20th in every log table
+    deletes = sorted(c[1] for c in RecordingLoader.calls if c[0] == 'delete')
+    assert deletes == sorted(LOG_TABLE_FILENAMES)
+
+
+def test_incremental_load_concurrently(monkeypatch, tmp_path):
+    monkeypatch.setattr(chartmetric_challenge.pg_ingestor, 'PgCopyLoader', RecordingLoader)
+    monkeypatch.setattr(RecordingLoader, 'calls', [])
+    monkeypatch.setattr(RecordingLoader, 'loader_calls', [])
+    state_directory = str(tmp_path / 'state')
+
+    for output_directory, timestp in [('first', "2022-05-20T06:00:00"), ('second', "2022-05-20T18:00:00")]:
+        ingestor = YoutubePlaylistPgIngestor(
+            'day', None, str(tmp_path / output_directory), 'postgresql://unused', state_directory=state_directory, pg_max_concurrency=4,
+        )
+        ingestor.convert(pd.DataFrame([make_row(timestp, "v1", 1)]))
+        RecordingLoader.loader_calls.clear()
+        ingestor.csvs_to_pg()
+        ingestor.commit_state()
+
+    # after the loader creating the partitions, every ID table and then every
+    # log table with its current table is loaded over a loader of its own
+    partitions_calls, *id_calls = RecordingLoader.loader_calls[:5]
+    assert partitions_calls == []
+    assert sorted(id_calls) == [[('copy', 'artists')], [('copy', 'media_items')], [('copy', 'playlists')], [('copy', 'users')]]
+    assert sorted(RecordingLoader.loader_calls[5:]) == [
+        [('delete', 'media_item_metadata_log'), ('copy', 'media_item_metadata_log_2022_05'), ('copy', 'media_item_metadata_current')],
+        [('delete', 'playlist_metadata_log'), ('copy', 'playlist_metadata_log_2022_05'), ('copy', 'playlist_metadata_current')],
+        [('delete', 'playlist_plays_log'), ('copy', 'playlist_plays_log_2022_05'), ('copy', 'playlist_plays_current')],
+        [('delete', 'playlist_positions_log'), ('copy', 'playlist_positions_log_2022_05'), ('copy', 'playlist_positions_current')],
+    ]
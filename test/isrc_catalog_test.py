@@ -0,0 +1,26 @@
+import io
+
+import pytest
+
+from chartmetric_challenge.isrc_catalog import iter_catalog_chunks
+
+
+def test_iter_catalog_chunks():
+    f = io.StringIO(
+        '"cm_track","track","isrc","cm_artist","artist"\n'
+        '1,"FEEL SOMETHING (feat. Marshmello)","ussm12006584",10,"Illenium"\n'
+        '2,"No ISRC","",20,"Someone"\n'
+        '3,"Canción, Dos",UK1,,"Artist ""2"""\n'
+    )
+    counts = {}
+    chunks = list(iter_catalog_chunks(f, chunk_size=1, counts=counts))
+    assert chunks == [
+        b'1,FEEL SOMETHING (feat. Marshmello),USSM12006584,10,Illenium,feel something\n',
+        b'3,"Canci\xc3\xb3n, Dos",UK1,,"Artist ""2""",cancion dos\n',
+    ]
+    assert counts == {'rows_read': 3, 'rows_skipped': 1}
+
+
+def test_iter_catalog_chunks_missing_column():
+    with pytest.raises(ValueError):
+        list(iter_catalog_chunks(io.StringIO('cm_track,track,artist\n1,t,a\n')))
@@ -0,0 +1,85 @@
+from chartmetric_challenge.isrc_matching import IsrcIndex, normalize_title, read_media_items, split_artists, split_video_title
+from chartmetric_challenge.youtube_playlist_pg import YoutubePlaylistPgIngestor
+
+import pandas as pd
+
+from conftest import make_row
+
+
+def make_index():
+    index = IsrcIndex()
+    index.add('FEEL SOMETHING (feat. Marshmello)', 'Illenium', 'USA1')
+    index.add('Happier Than Ever - Edit', 'Billie Eilish', 'USA2')
+    index.add('Holiday', 'Lil Nas X', 'USA3')
+    index.add('Envolver', 'Anitta', 'USA4')
+    index.add('Happier', 'Marshmello ft. Bastille', 'USA5')
+    return index
+
+
+def test_normalize_title():
+    assert normalize_title('FEEL SOMETHING (feat. Marshmello)') == 'feel something'
+    assert normalize_title('Canción ft. Someone') == 'cancion'
+    assert normalize_title("she's all i wanna be!") == 'she s all i wanna be'
+
+
+def test_split_artists():
+    assert split_artists('Marshmello ft. Bastille') == ('marshmello', 'bastille')
+    assert split_artists('Doja Cat, The Weeknd & SZA') == ('doja cat', 'the weeknd', 'sza')
+
+
+def test_split_video_title():
+    assert split_video_title('Illenium - Feel Something (Official Video)') == ('Illenium', 'Feel Something  ')
+    assert split_video_title('KSI – Holiday') == ('KSI', 'Holiday')
+    assert split_video_title('Envolver') == (None, 'Envolver')
+
+
+def test_match_title_and_artist():
+    match = make_index().match('Feel Something', 'whatever', 'ILLENIUM')
+    assert match == ('USA1', 'title_and_artist', 1.0)
+
+
+def test_match_video_title():
+    match = make_index().match(None, 'Illenium - Feel Something (Official Video)', None)
+    assert match.isrc == 'USA1'
+    assert match.match_type == 'video_title_and_artist'
+
+
+def test_match_fuzzy_needs_artist():
+    index = make_index()
+    match = index.match('Happier Than Ever', None, 'Billie Eilish')
+    assert match.isrc == 'USA2'
+    assert match.match_type == 'fuzzy'
+    assert index.match('Happier Than Ever', None, None) is None
+
+
+def test_match_title_only():
+    index = make_index()
+    assert index.match(None, 'Envolver', None) == ('USA4', 'title_only', 0.6)
+    # a different artist's song with the same title isn't a match
+    assert index.match(None, 'KSI – Holiday', None) is None
+
+
+def test_match_featured_artist():
+    index = make_index()
+    assert index.match('Happier', None, 'Bastille') == ('USA5', 'title_and_artist', 1.0)
+    assert index.match(None, 'Bastille - Happier (Official Video)', None).isrc == 'USA5'
+    assert index.match('Happierr', None, 'Bastille').isrc == 'USA5'
+
+
+def test_read_media_items_incremental(tmp_path):
+    state_directory = str(tmp_path / 'state')
+    first = YoutubePlaylistPgIngestor('day', None, str(tmp_path / 'first'), None, state_directory=state_directory)
+    first.convert(pd.DataFrame([make_row("2022-05-19T12:00:00", "v1", title="Illenium - v1", artist_name="Illenium", track_title="v1")]))
+    first.commit_state()
+    second = YoutubePlaylistPgIngestor('day', None, str(tmp_path / 'second'), None, state_directory=state_directory)
+    second.convert(pd.DataFrame([
+        make_row("2022-05-20T12:00:00", "v2", title="Illenium - v2", artist_name="Illenium", track_title="v2"),
+        make_row("2022-05-20T12:00:00", "v3", title="Anitta - v3", artist_name="Anitta", track_title="v3"),
+    ]))
+    second.commit_state()
+
+    # Illenium's ID was added by the first run so it's only in the state
+    media_items = read_media_items(str(tmp_path / 'second'), state_directory=state_directory)
+    assert {m['secondary_title']: m['artist_name'] for m in media_items} == {'v2': 'Illenium', 'v3': 'Anitta'}
+    media_items = read_media_items(str(tmp_path / 'second'))
+    assert {m['secondary_title']: m['artist_name'] for m in media_items} == {'v2': None, 'v3': 'Anitta'}
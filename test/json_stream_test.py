@@ -0,0 +1,99 @@
+import json
+import os
+import subprocess
+import sys
+
+from chartmetric_challenge.json_stream import iter_json_records, iter_record_batches
+from chartmetric_challenge.youtube_playlist_pg import YOUTUBE_PLAYLIST_SCHEMA, YoutubePlaylistPgIngestor
+
+import pandas as pd
+import pytest
+
+
+def test_iter_json_records_small_reads(youtube_playlist_json_file):
+    # a tiny read size forces records to be split across reads
+    records = list(iter_json_records(youtube_playlist_json_file, read_size=7))
+    with open(youtube_playlist_json_file) as f:
+        assert records == json.load(f)
+
+
+def test_iter_json_records_newline_delimited(youtube_playlist_json_file, youtube_playlist_ndjson_file):
+    with open(youtube_playlist_json_file) as f:
+        assert list(iter_json_records(youtube_playlist_ndjson_file, 'newline_delimited')) == json.load(f)
+
+
+@pytest.mark.parametrize('json_format', ['array', 'newline_delimited'])
+def test_iter_json_records_utf8_in_ascii_locale(json_format, tmp_path):
+    path = tmp_path / 'source.json'
+    record = {'title': 'Hugo e Guilherme - DVD Próximo Passo'}
+    text = json.dumps([record] if json_format == 'array' else record, ensure_ascii=False)
+    path.write_text(text, encoding='utf-8')
+    code = f'''
+from chartmetric_challenge.json_stream import iter_json_records
+print(ascii(list(iter_json_records({str(path)!r}, {json_format!r}))))
+'''
+    # without UTF-8 mode this locale reads files as ASCII by default
+    env = {**os.environ, 'LC_ALL': 'C', 'LANG': 'C', 'PYTHONUTF8': '0', 'PYTHONCOERCECLOCALE': '0'}
+    root_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', code], cwd=root_directory, env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ascii([record])
+
+
+def test_iter_json_records_incomplete(tmp_path):
+    path = tmp_path / 'bad.json'
+    path.write_text('[{"playlist_id": "p1"}, {"playlist_id": ')
+    with pytest.raises(ValueError):
+        list(iter_json_records(str(path)))
+
+
+def test_iter_record_batches(youtube_playlist_json_file):
+    batches = list(iter_record_batches(youtube_playlist_json_file, YOUTUBE_PLAYLIST_SCHEMA, batch_size=1))
+    assert [b.num_rows for b in batches] == [1, 1]
+    assert batches[1].column('artist_name').to_pylist() == [None]
+
+
+
+def test_iter_record_batches_not_strict(tmp_path):
+    path = tmp_path / 'bad.json'
+    path.write_text('[{"playlist_id": "p1", "views": 5}, {"playlist_id": "p2", "views": "lots"}, {"views": [1]}]')
+    with pytest.raises(ValueError):
+        list(iter_record_batches(str(path), YOUTUBE_PLAYLIST_SCHEMA, batch_size=2))
+    batches = list(iter_record_batches(str(path), YOUTUBE_PLAYLIST_SCHEMA, batch_size=2, strict=False))
+    assert [b.column('views').to_pylist() for b in batches] == [['5', 'lots'], ['[1]']]
+    assert batches[1].column('playlist_id').to_pylist() == [None]
+
+
+def normalize_frame(df: pd.DataFrame) -> pd.DataFrame:
+    # the row order within a file doesn't matter, and an all null column is
+    # read back as float or object depending on the file
+    return df.sort_values(list(df.columns)).reset_index(drop=True).convert_dtypes()
+
+
+@pytest.mark.parametrize('load_mode,json_format', [
+    ('stream', 'array'),
+    ('stream', 'newline_delimited'),
+    ('duckdb', 'array'),
+    ('duckdb', 'newline_delimited'),
+    ('pandas', 'newline_delimited'),
+])
+def test_load_modes_match_pandas(load_mode, json_format, youtube_playlist_json_file, youtube_playlist_ndjson_file, tmp_path):
+    expected_ingestor = YoutubePlaylistPgIngestor('day', youtube_playlist_json_file, str(tmp_path / 'expected'), None)
+    expected_ingestor.convert(expected_ingestor.load())
+
+    source_path = youtube_playlist_json_file if json_format == 'array' else youtube_playlist_ndjson_file
+    ingestor = YoutubePlaylistPgIngestor(
+        'day',
+        source_path,
+        str(tmp_path / 'actual'),
+        None,
+        load_mode=load_mode,
+        json_format=json_format,
+    )
+    ingestor.convert(ingestor.load())
+
+    filenames = sorted(p.name for p in (tmp_path / 'expected').glob('*.csv'))
+    assert filenames == sorted(p.name for p in (tmp_path / 'actual').glob('*.csv'))
+    for filename in filenames:
+        expected = normalize_frame(pd.read_csv(tmp_path / 'expected' / filename))
+        actual = normalize_frame(pd.read_csv(tmp_path / 'actual' / filename))
+        pd.testing.assert_frame_equal(actual, expected, obj=filename)
@@ -0,0 +1,106 @@
+import json
+
+from chartmetric_challenge.partitioned import ingest_partitioned
+from chartmetric_challenge.youtube_playlist_pg import YoutubePlaylistPgIngestor
+
+import pandas as pd
+import pytest
+
+
+def make_records():
+    records = []
+    for day in range(4):
+        for playlist in range(3):
+            for video in range(3):
+                records.append({
+                    "playlist_id": f"p{playlist}",
+                    "playlist_name": f"pn{playlist}",
+                    "artwork_url": "au1",
+                    "channel_id": "c1",
+                    "views": day // 2,
+                    "num_videos": 3,
+                    # each playlist is scraped at a different time of day
+                    "timestp": f"2022-05-{19 + day}T{10 + playlist}:00:00",
+                    # v0 is on every playlist, so its metadata comes from p2
+                    # (scraped last each day) which only changes every other
+                    # day, even though the other playlists change every day
+                    "video_id": f"v{video}" if video == 0 else f"v{playlist}_{video}",
+                    "title": f"t{video}_{day // 2}" if playlist == 2 else f"t{video}_{playlist}_{day}",
+                    "artist_name": "an1",
+                    "image_url": "i1",
+                    "track_title": "tt1",
+                    "position": (video + day) % 3,
+                })
+    return records
+
+
+def read_with_source_ids(output_directory, filename):
+    media_items = pd.read_csv(f'{output_directory}/media_items.csv').set_index('id')['source_id']
+    playlists = pd.read_csv(f'{output_directory}/playlists.csv').set_index('id')['source_id']
+    df = pd.read_csv(f'{output_directory}/{filename}')
+    if 'media_item_id' in df:
+        df['media_item_id'] = df['media_item_id'].map(media_items)
+    if 'playlist_id' in df:
+        df['playlist_id'] = df['playlist_id'].map(playlists)
+    return sorted(df.astype(str).values.tolist())
+
+
+@pytest.mark.parametrize('shard_by', ['playlist', 'date'])
+def test_ingest_partitioned_matches_convert(shard_by, tmp_path):
+    source_path = tmp_path / 'source.json'
+    source_path.write_text(json.dumps(make_records()))
+
+    ingestor = YoutubePlaylistPgIngestor('day', str(source_path), str(tmp_path / 'single'), None)
+    ingestor.convert(ingestor.load())
+    shard_timings = ingest_partitioned(
+        YoutubePlaylistPgIngestor,
+        'day',
+        str(source_path),
+        str(tmp_path / 'partitioned'),
+        None,
+        num_shards=3,
+        shard_by=shard_by,
+        max_workers=2,
+    )
+
+    assert sum(t['rows'] for t in shard_timings) == 36
+    for filename in ['media_item_metadata.csv', 'playlist_positions_log.csv', 'playlist_plays_log.csv', 'playlist_metadata_log.csv']:
+        assert read_with_source_ids(tmp_path / 'partitioned', filename) == read_with_source_ids(tmp_path / 'single', filename)
+
+
+def test_ingest_partitioned_commits_state(tmp_path):
+    records = make_records()
+    first_records = [r for r in records if r['timestp'] < '2022-05-21']
+    second_records = [r for r in records if r['timestp'] >= '2022-05-21']
+    source_path = tmp_path / 'source.json'
+    source_path.write_text(json.dumps(first_records))
+
+    ingest_partitioned(
+        YoutubePlaylistPgIngestor,
+        'day',
+        str(source_path),
+        str(tmp_path / 'partitioned'),
+        None,
+        num_shards=3,
+        max_workers=2,
+        state_directory=str(tmp_path / 'partitioned_state'),
+    )
+    single = YoutubePlaylistPgIngestor('day', None, str(tmp_path / 'single'), None, state_directory=str(tmp_path / 'single_state'))
+    single.convert(pd.DataFrame(first_records))
+    single.commit_state()
+
+    # an incremental run after each carries on from its IDs and watermark
+    for name in ['partitioned', 'single']:
+        ingestor = YoutubePlaylistPgIngestor('day', None, str(tmp_path / f'{name}_next'), None, state_directory=str(tmp_path / f'{name}_state'))
+        ingestor.convert(pd.DataFrame(records))
+        ingestor.commit_state()
+    assert (tmp_path / 'partitioned_state' / 'watermark.json').read_text() == (tmp_path / 'single_state' / 'watermark.json').read_text()
+    # no media item is new, so none is renumbered
+    assert len(pd.read_csv(tmp_path / 'partitioned_next' / 'media_items.csv')) == 0
+    for filename in ['media_item_metadata.csv', 'playlist_positions_log.csv', 'playlist_plays_log.csv', 'playlist_metadata_log.csv']:
+        partitioned_next = pd.read_csv(tmp_path / 'partitioned_next' / filename)
+        single_next = pd.read_csv(tmp_path / 'single_next' / filename)
+        pd.testing.assert_frame_equal(
+            partitioned_next.sort_values(list(partitioned_next.columns)).reset_index(drop=True),
+            single_next.sort_values(list(single_next.columns)).reset_index(drop=True),
+        )
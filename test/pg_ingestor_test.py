@@ -0,0 +1,87 @@
+import json
+
+from chartmetric_challenge.constants import ORG_SPOTIFY
+from chartmetric_challenge.pg_ingestor import digest_sql
+from chartmetric_challenge.spotify_playlist_pg import SpotifyPlaylistPgIngestor
+
+import duckdb
+import pandas as pd
+import pytest
+
+
+def make_record(**overrides):
+    record = {
+        "playlist_uri": "spotify:playlist:1",
+        "name": "Today's Top Hits",
+        "image": "i1",
+        "owner_id": "spotify",
+        "followers": 100,
+        "total_tracks": 50,
+        "scraped_at": "2022-05-19T12:00:00",
+        "track_uri": "spotify:track:1",
+        "track_name": "As It Was",
+        "artist": "Harry Styles",
+        "album_art": "a1",
+        "position": 1,
+    }
+    record.update(overrides)
+    return record
+
+
+@pytest.mark.parametrize('load_mode', ['pandas', 'stream'])
+def test_column_mapping(load_mode, tmp_path):
+    records = [
+        make_record(),
+        make_record(scraped_at='2022-05-20T12:00:00', followers=120, position=2),
+        make_record(track_uri=None),
+        make_record(followers='lots', track_uri='spotify:track:2'),
+    ]
+    source_path = tmp_path / 'source.json'
+    source_path.write_text('\n'.join(json.dumps(r) for r in records))
+
+    ingestor = SpotifyPlaylistPgIngestor(
+        'day', str(source_path), str(tmp_path), None, load_mode=load_mode, json_format='newline_delimited',
+    )
+    ingestor.convert(ingestor.load())
+
+    playlists = pd.read_csv(tmp_path / 'playlists.csv')
+    assert playlists[['source', 'source_id']].values.tolist() == [[ORG_SPOTIFY, 'spotify:playlist:1']]
+    assert pd.read_csv(tmp_path / 'users.csv')['source_id'].tolist() == ['spotify']
+    assert pd.read_csv(tmp_path / 'playlist_plays_log.csv')['plays'].tolist() == [100, 120]
+    assert pd.read_csv(tmp_path / 'playlist_positions_log.csv')['position'].tolist() == [1, 2]
+    media_item_metadata = pd.read_csv(tmp_path / 'media_item_metadata.csv')
+    assert media_item_metadata['primary_title'].tolist() == ['As It Was']
+    # the source has no secondary title
+    assert media_item_metadata['secondary_title'].isna().all()
+
+    with open(tmp_path / 'dead_letter.jsonl') as f:
+        # the reasons are named after the source's fields
+        assert sorted(json.loads(line)['reject_reason'] for line in f) == ['invalid_followers', 'missing_track_uri']
+
+
+def test_column_mapping_must_be_complete(tmp_path):
+    class IncompleteIngestor(SpotifyPlaylistPgIngestor):
+        COLUMN_MAPPING = {c: f for c, f in SpotifyPlaylistPgIngestor.COLUMN_MAPPING.items() if c != 'position'}
+
+    with pytest.raises(ValueError, match='position'):
+        IncompleteIngestor('day', None, str(tmp_path), None)
+
+
+def test_upsert_needs_state_directory(tmp_path):
+    with pytest.raises(ValueError, match='state_directory'):
+        SpotifyPlaylistPgIngestor('day', None, str(tmp_path), None, pg_load_mode='upsert')
+
+
+def test_pg_max_concurrency_at_least_one(tmp_path):
+    with pytest.raises(ValueError, match='pg_max_concurrency'):
+        SpotifyPlaylistPgIngestor('day', None, str(tmp_path), None, pg_max_concurrency=0)
+
+
+def test_digest_sql():
+    digest = digest_sql(["'a'", 'NULL', '12'])
+    swapped_digest = digest_sql(['NULL', "'a'", '12'])
+    digests = duckdb.sql(f'SELECT {digest}, {swapped_digest}').fetchone()
+    # the lower half of md5('1:a-2:12') as a little endian integer, which
+    # mustn't change between DuckDB versions since digests are kept in the state
+    assert digests[0] == 2565910225550377370
+    assert digests[1] != digests[0]
@@ -0,0 +1,97 @@
+import json
+
+import pandas as pd
+import pytest
+
+from chartmetric_challenge.pipeline import ingest_files, source_output_directory
+from chartmetric_challenge.youtube_playlist_pg import YoutubePlaylistPgIngestor
+
+from conftest import make_row
+
+
+def write_source(path, rows):
+    with open(path, 'w') as f:
+        json.dump(rows, f)
+    return str(path)
+
+
+def test_ingest_files(tmp_path):
+    source_paths = [
+        write_source(tmp_path / 'scrape_1.json', [make_row("2022-05-19T12:00:00", "v1", 1)]),
+        write_source(tmp_path / 'scrape_2.json', [
+            # unchanged since the first file, dropped
+            make_row("2022-05-20T12:00:00", "v1", 1),
+            make_row("2022-05-20T12:00:00", "v2", 2),
+        ]),
+        write_source(tmp_path / 'scrape_3.json', [make_row("2022-05-21T12:00:00", "v1", 2)]),
+    ]
+    output_directory = str(tmp_path / 'out')
+
+    summary = ingest_files(YoutubePlaylistPgIngestor, 'day', source_paths, output_directory, None)
+
+    assert summary['files'] == 3
+    assert summary['records'] == 4
+    assert [f['source_path'] for f in summary['per_file']] == source_paths
+    first, second, third = [source_output_directory(output_directory, p) for p in source_paths]
+    # IDs carry on from one file to the next
+    assert pd.read_csv(f'{first}/media_items.csv')[['id', 'source_id']].values.tolist() == [[1, 'v1']]
+    assert pd.read_csv(f'{second}/media_items.csv')[['id', 'source_id']].values.tolist() == [[2, 'v2']]
+    assert len(pd.read_csv(f'{third}/media_items.csv')) == 0
+    positions = pd.read_csv(f'{second}/playlist_positions_log.csv')
+    assert positions[['media_item_id', 'position']].values.tolist() == [[2, 2]]
+    positions = pd.read_csv(f'{third}/playlist_positions_log.csv')
+    assert positions[['media_item_id', 'position']].values.tolist() == [[1, 2]]
+
+
+def test_ingest_files_missing_file(tmp_path):
+    source_paths = [
+        write_source(tmp_path / 'scrape_1.json', [make_row("2022-05-19T12:00:00", "v1", 1)]),
+        str(tmp_path / 'missing.json'),
+        write_source(tmp_path / 'scrape_3.json', [make_row("2022-05-21T12:00:00", "v1", 2)]),
+    ]
+    output_directory = str(tmp_path / 'out')
+
+    with pytest.raises(ValueError, match='does not exist'):
+        ingest_files(YoutubePlaylistPgIngestor, 'day', source_paths, output_directory, None)
+    # the file before the missing one still makes it through
+    first = source_output_directory(output_directory, source_paths[0])
+    assert len(pd.read_csv(f'{first}/media_items.csv')) == 1
+
+
+def test_ingest_files_same_file_name(tmp_path):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    source_paths = [
+        write_source(tmp_path / 'a' / 'scrape.json', [make_row("2022-05-19T12:00:00", "v1", 1)]),
+        write_source(tmp_path / 'b' / 'scrape.json', [make_row("2022-05-20T12:00:00", "v1", 1)]),
+    ]
+    with pytest.raises(ValueError, match='different file names'):
+        ingest_files(YoutubePlaylistPgIngestor, 'day', source_paths, str(tmp_path / 'out'), None)
+
+
+class FailingLoadIngestor(YoutubePlaylistPgIngestor):
+    def csvs_to_pg(self):
+        if self._source_path.endswith('scrape_2.json'):
+            raise RuntimeError('COPY failed')
+
+
+def test_ingest_files_failed_load(tmp_path):
+    source_paths = [
+        write_source(tmp_path / 'scrape_1.json', [make_row("2022-05-19T12:00:00", "v1", 1)]),
+        write_source(tmp_path / 'scrape_2.json', [make_row("2022-05-20T12:00:00", "v2", 2)]),
+        write_source(tmp_path / 'scrape_3.json', [make_row("2022-05-21T12:00:00", "v3", 3)]),
+    ]
+    output_directory = str(tmp_path / 'out')
+
+    with pytest.raises(RuntimeError, match='COPY failed'):
+        ingest_files(FailingLoadIngestor, 'day', source_paths, output_directory, 'postgresql://unused')
+    # only the first file was loaded, so only its state was committed
+    with open(tmp_path / 'out' / 'state' / 'watermark.json') as f:
+        assert json.load(f)['watermark'] == '2022-05-19T12:00:00'
+    assert sorted(p.name for p in (tmp_path / 'out' / 'state').iterdir() if p.is_dir()) == []
+
+    # the rerun converts the files after the first one again
+    ingest_files(YoutubePlaylistPgIngestor, 'day', source_paths, output_directory, None)
+    second, third = [source_output_directory(output_directory, p) for p in source_paths[1:]]
+    assert pd.read_csv(f'{second}/media_items.csv')[['id', 'source_id']].values.tolist() == [[2, 'v2']]
+    assert pd.read_csv(f'{third}/media_items.csv')[['id', 'source_id']].values.tolist() == [[3, 'v3']]
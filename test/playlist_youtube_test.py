@@ -157,3 +157,48 @@ def assert_expected_fields_at_times(df, expected_fields_at_times):
             expected_fields = expected_fields_at_times[i]
         for field, value in expected_fields.items():
             assert row[field] == value, f'{field} at time {i} should be {value} but is {row[field]}, row: {row}'
+
+
+def test_convert_playlist_positions_log(output_directory):
+    ingestor = YoutubePlaylistPgIngestor(
+        'day',
+        None,
+        output_directory,
+        None,
+    )
+    base_row = {
+        "playlist_id": "p1",
+        "playlist_name": "pn1",
+        "artwork_url": "au1",
+        "channel_id": "c1",
+        "views": 1,
+        "num_videos": 1,
+        "video_id": "v1",
+        "title": "t1",
+        "artist_name": "an1",
+        "image_url": "i1",
+        "track_title": "tt1",
+    }
+    df = pd.DataFrame([
+        # T0 position 1
+        {**base_row, "timestp": "2022-05-19T12:00:00.000000", "position": 1},
+        # T1 unchanged position, dropped
+        {**base_row, "timestp": "2022-05-20T12:00:00.000000", "position": 1},
+        # T2 ignored position (earlier than other from same day)
+        {**base_row, "timestp": "2022-05-21T11:00:00.000000", "position": 3},
+        # T2 moved to position 2
+        {**base_row, "timestp": "2022-05-21T12:00:00.000000", "position": 2},
+        # T3 moved back to position 1
+        {**base_row, "timestp": "2022-05-22T12:00:00.000000", "position": 1},
+        # T4 unchanged position, dropped
+        {**base_row, "timestp": "2022-05-23T12:00:00.000000", "position": 1},
+    ])
+    ingestor.convert(df)
+    result_df = pd.read_csv(f'{output_directory}/playlist_positions_log.csv')
+    expected_fields_at_times = {
+        0: {'position': 1, 'ingest_timestamp': '2022-05-19 12:00:00'},
+        1: {'position': 2, 'ingest_timestamp': '2022-05-21 12:00:00'},
+        2: {'position': 1, 'ingest_timestamp': '2022-05-22 12:00:00'},
+    }
+    assert len(result_df) == 3
+    assert_expected_fields_at_times(result_df, expected_fields_at_times)
@@ -0,0 +1,59 @@
+import json
+import time
+
+from chartmetric_challenge.profiling import RSS_SAMPLE_SECONDS, Profiler
+from chartmetric_challenge.youtube_playlist_pg import YoutubePlaylistPgIngestor
+
+import pytest
+
+
+def test_disabled_profiler():
+    profiler = Profiler()
+    with profiler.stage('load'):
+        profiler.set_rows(rows_out=1)
+    assert profiler.report()['stages'] == []
+
+
+def test_nested_stages():
+    profiler = Profiler(enabled=True)
+    with profiler.stage('convert', rows_in=3):
+        with profiler.stage('log.playlist_plays_log'):
+            profiler.set_rows(rows_out=2)
+        profiler.set_rows(rows_out=5)
+    with pytest.raises(ValueError):
+        with profiler.stage('csvs_to_pg'):
+            raise ValueError('bad')
+    convert, log, csvs_to_pg = profiler.report()['stages']
+    assert (convert['name'], convert['rows_in'], convert['rows_out']) == ('convert', 3, 5)
+    assert (log['name'], log['rows_out']) == ('log.playlist_plays_log', 2)
+    assert csvs_to_pg['error'] == "ValueError('bad')"
+    assert all(s['seconds'] >= 0 and s['peak_rss_mb'] > 0 for s in [convert, log, csvs_to_pg])
+
+
+def test_stage_peak_rss():
+    profiler = Profiler(enabled=True)
+    with profiler.stage('allocate'):
+        buffer = bytearray(200 * 1024 * 1024)
+        # touch every page so it's resident
+        buffer[::4096] = b'x' * len(buffer[::4096])
+        time.sleep(10 * RSS_SAMPLE_SECONDS)
+        del buffer
+    with profiler.stage('after'):
+        pass
+    allocate, after = profiler.report()['stages']
+    # the buffer is gone by the time the stage ends but it's in the samples
+    assert allocate['peak_rss_mb'] - after['peak_rss_mb'] > 150
+    # the process' peak doesn't go down again once the buffer is freed
+    assert after['process_peak_rss_mb'] - after['peak_rss_mb'] > 150
+
+
+def test_convert_profile(youtube_playlist_json_file, tmp_path):
+    ingestor = YoutubePlaylistPgIngestor('day', youtube_playlist_json_file, str(tmp_path), None, profile_queries=True)
+    ingestor.convert(ingestor.load())
+    stages = {s['name']: s for s in ingestor.profile_report()['stages']}
+    assert stages['register_source']['rows_out'] == 2
+    assert stages['ids.media_items']['rows_out'] == 2
+    assert stages['log.playlist_positions_log']['rows_in'] == 2
+    assert stages['log.playlist_positions_log']['rows_out'] == 2
+    with open(stages['log.playlist_positions_log']['query_profile']) as f:
+        assert 'INSERT INTO playlist_positions_log' in json.load(f)['query_name']
@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+
+from chartmetric_challenge import VALID_INGESTORS, ingestor_class
+from chartmetric_challenge.spotify_playlist_pg import SpotifyPlaylistPgIngestor
+from chartmetric_challenge.youtube_playlist_pg import YoutubePlaylistPgIngestor
+
+import pytest
+
+
+def test_ingestor_class():
+    assert ingestor_class('PLAYLIST_YOUTUBE') is YoutubePlaylistPgIngestor
+    assert ingestor_class('PLAYLIST_SPOTIFY') is SpotifyPlaylistPgIngestor
+    assert list(VALID_INGESTORS) == ['PLAYLIST_YOUTUBE', 'PLAYLIST_SPOTIFY']
+    with pytest.raises(ValueError, match='PLAYLIST_YOUTUBE'):
+        ingestor_class('PLAYLIST_NOPE')
+
+
+def test_cli_imports_no_heavy_modules():
+    # in a fresh interpreter, the test session has imported everything already
+    code = '''
+import sys
+import main
+import main_partitioned
+print(",".join(m for m in ["duckdb", "pyarrow", "pandas", "psycopg2"] if m in sys.modules))
+'''
+    root_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', code], cwd=root_directory, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ''
+
+
+def test_isrc_modules_import_no_ingest_engine():
+    code = '''
+import sys
+import chartmetric_challenge.isrc_catalog
+import chartmetric_challenge.isrc_matching
+print(",".join(m for m in ["duckdb", "pandas", "chartmetric_challenge.pg_ingestor"] if m in sys.modules))
+'''
+    root_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', code], cwd=root_directory, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ''
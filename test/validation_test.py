@@ -0,0 +1,71 @@
+import json
+
+from chartmetric_challenge.youtube_playlist_pg import YoutubePlaylistPgIngestor
+
+import pandas as pd
+import pytest
+
+
+def make_record(**overrides):
+    record = {
+        "playlist_id": "p1",
+        "playlist_name": "pn1",
+        "artwork_url": "au1",
+        "channel_id": "c1",
+        "views": 1,
+        "num_videos": 1,
+        "timestp": "2022-05-19T12:00:00",
+        "video_id": "v1",
+        "title": "t1",
+        "artist_name": "an1",
+        "image_url": "i1",
+        "track_title": "tt1",
+        "position": 1,
+    }
+    record.update(overrides)
+    return record
+
+
+@pytest.mark.parametrize('load_mode', ['pandas', 'stream', 'duckdb'])
+def test_invalid_records_dead_lettered(load_mode, tmp_path):
+    records = [
+        make_record(),
+        make_record(playlist_id=None, video_id='v2'),
+        make_record(video_id=None),
+        make_record(timestp='yesterday', video_id='v3'),
+        make_record(views='lots', video_id='v4'),
+        make_record(position=1.5, video_id='v5'),
+        make_record(views='1.5', video_id='v6'),
+        make_record(timestp='2022-05-20T12:00:00', views=2, position=None),
+    ]
+    source_path = tmp_path / 'source.json'
+    source_path.write_text('\n'.join(json.dumps(r) for r in records))
+
+    output_directory = tmp_path / 'output'
+    ingestor = YoutubePlaylistPgIngestor(
+        'day', str(source_path), str(output_directory), None, load_mode=load_mode, json_format='newline_delimited',
+    )
+    ingestor.convert(ingestor.load())
+
+    with open(output_directory / 'dead_letter.jsonl') as f:
+        dead_letters = [json.loads(line) for line in f]
+    assert sorted(r['reject_reason'] for r in dead_letters) == [
+        'invalid_position', 'invalid_timestp', 'invalid_views', 'invalid_views', 'missing_playlist_id', 'missing_video_id',
+    ]
+    assert {r['video_id'] for r in dead_letters} == {'v2', None, 'v3', 'v4', 'v5', 'v6'}
+    # only the valid records get IDs and log rows
+    assert pd.read_csv(output_directory / 'media_items.csv')['source_id'].tolist() == ['v1']
+    assert pd.read_csv(output_directory / 'playlist_plays_log.csv')['plays'].tolist() == [1, 2]
+
+
+def test_no_dead_letter_file_when_valid(youtube_playlist_json_file, tmp_path):
+    (tmp_path / 'dead_letter.jsonl').write_text('{}\n')
+    ingestor = YoutubePlaylistPgIngestor('day', youtube_playlist_json_file, str(tmp_path), None)
+    ingestor.convert(ingestor.load())
+    assert not (tmp_path / 'dead_letter.jsonl').exists()
+
+
+def test_dead_letter_parquet(tmp_path):
+    ingestor = YoutubePlaylistPgIngestor('day', None, str(tmp_path), None, dead_letter_path=str(tmp_path / 'rejects.parquet'))
+    ingestor.convert(pd.DataFrame([make_record(), make_record(timestp=None)]))
+    assert pd.read_parquet(tmp_path / 'rejects.parquet')['reject_reason'].tolist() == ['missing_timestp']
@@ -0,0 +1,40 @@
+import glob
+import json
+import logging
+
+import typer
+
+from chartmetric_challenge.constants import INTERMEDIATE_FORMATS
+from chartmetric_challenge.history_store import DEFAULT_MAX_FILES, DEFAULT_ROW_GROUP_SIZE, update_history_store
+
+
+def main(
+    store_directory: str,
+    output_directories: str,
+    intermediate_format: str = "csv",
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    max_files: int = DEFAULT_MAX_FILES,
+    log_level: str = "INFO",
+):
+    '''
+    Adds the log tables of one or more ingests' output directories (a glob
+    or comma separated list, in the order they were ingested) to the history
+    store in store_directory, which HistoryStore reads time series from
+    without going to Postgres. Each run adds one file per table, a table
+    with more than max_files is merged back into one. Prints the rows
+    written to each table.
+    '''
+    logging.basicConfig(level=log_level)
+
+    if intermediate_format not in INTERMEDIATE_FORMATS:
+        raise ValueError(f"intermediate_format must be one of {INTERMEDIATE_FORMATS}")
+    directories = []
+    for pattern in output_directories.split(','):
+        directories.extend(sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern])
+
+    row_counts = update_history_store(store_directory, directories, intermediate_format, row_group_size, max_files)
+    print(json.dumps(row_counts, indent=2))
+
+
+if __name__ == "__main__":
+    typer.run(main)